@@ -2,118 +2,56 @@ import numpy as np
 
 import gfx
 import mp
-import params
+import renderqueue
+import transform
 
 GRAPHICS_SCALE = 2.
 
-BALL_VS = """
-#version 130
-
-uniform mat4 u_model;
-uniform mat4 u_view;
-uniform mat4 u_projection;
+# Per-vertex quad attributes, then per-instance ones
+BALL_ATTRIBUTES = ('position', 'texUV', 'placement', 'appearance')
+# Instance columns: center and scale (placement), opacity and texture layer (appearance)
+BALL_INSTANCE_SIZES = (4, 2)
 
+BALL_VS = """
+#version 140
+""" + transform.CAMERA_BLOCK + transform.STEREO_VS + """
 in vec3 position;
 in vec2 texUV;
+in vec4 placement;
+in vec2 appearance;
 
 out vec2 vf_texUV;
+flat out float vf_opacity;
+flat out float vf_layer;
 
 void main() {
 	mat4 billboard_view = transpose(mat4(u_view[0], u_view[1], u_view[2], vec4(0, 0, 0, 1)));
-	gl_Position = u_projection * u_view * u_model * billboard_view * vec4(position, 1);
+	vec3 offset = (billboard_view * vec4(position, 1)).xyz;
+	gl_Position = eye_position(u_view * vec4(placement.xyz + placement.w * offset, 1), eye_index(gl_InstanceID));
 	vf_texUV = texUV;
+	vf_opacity = appearance.x;
+	vf_layer = appearance.y;
 }
 """
 
 BALL_FS = """
-#version 130
-
-uniform sampler2D t_ball;
-uniform float u_opacity;
+#version 140
+""" + transform.STEREO_FS + """
+uniform sampler2DArray t_balls;
 
 in vec2 vf_texUV;
-
-out vec4 fragColor;
+flat in float vf_opacity;
+flat in float vf_layer;
 
 void main() {
-	vec4 color = texture2D(t_ball, vf_texUV);
-	fragColor = vec4(color.rgb, color.a * u_opacity);
+	vec4 color = texture(t_balls, vec3(vf_texUV, vf_layer));
+	set_color(vec4(color.rgb, color.a * vf_opacity));
 }
 """
 
 class Balls:
-	def __init__(self, scene, ball_textures):
-		self.scene = scene
-
-		self.ball_textures = ball_textures
-		self.balls = [Ball(self.scene, self, i) for i in range(params.BALLS.MAX)]
-
-		self.program = gfx.Program(BALL_VS, BALL_FS)
-
-		self._next_ball_index = 0
-
-		self.scene.controller.controls['ball_radius'].on_change(lambda _, radius: self.scene.defer(self.set_ball_radius, radius))
-		self.scene.controller.controls['ball_speed'].on_change(lambda _, speed: self.scene.defer(self.set_ball_speed, speed))
-		self.scene.controller.controls['ball_count'].on_change(lambda _, count: self.scene.defer(self.set_ball_count, count))
-
-	def enabled_balls(self):
-		return [b for b in self.balls if b.enabled]
-
-	def send_next_to(self, face):
-		ball = self.balls[self._next_ball_index]
-		self._next_ball_index = (self._next_ball_index + 1) % len(self.balls)
-
-		dir_ = face.midpoint
-		self._reset_ball(ball, dir=dir_)
-		ball.fade_rate_after_collision = 2.
-		ball.enabled = True
-
-	def set_ball_count(self, count):
-		for i in range(params.BALLS.MAX):
-			if i >= count:
-				self.balls[i].enabled = False
-			elif not self.balls[i].enabled:
-				self._reset_ball(self.balls[i])
-				self.balls[i].enabled = True
-
-	def set_ball_speed(self, speed):
-		self._ball_speed = speed
-		for b in self.enabled_balls():
-			b.speed = speed
-
-	def set_ball_radius(self, radius):
-		self._ball_radius = radius
-		for b in self.enabled_balls():
-			b.radius = radius
-
-	def reset_balls(self):
-		for b in self.enabled_balls():
-			self._reset_ball(b)
-
-	def update(self, dt):
-		for b in self.enabled_balls():
-			b.update(dt)
-
-		for b in self.enabled_balls():
-			if b.get_distance_to(mp.array([0, 0, 0])) > self.scene.active_shape.radius:
-				self._reset_ball(b)
-
-	def pre_render(self, projection, view):
-		with self.program:
-			self.program.set_uniform('u_view', view)
-			self.program.set_uniform('u_projection', projection)
-
-	def _reset_ball(self, ball, dir=None):
-		if dir is None: dir = mp.normalize(np.random.standard_normal(3))
-		ball.init(
-			pos=[0, 0, 0],
-			dir=dir,
-			speed=self._ball_speed,
-			radius=self._ball_radius,
-			texture=np.random.choice(self.ball_textures)
-		)
-
-class Ball:
+	# Draws every enabled ball in one instanced call, with one instance per ball and eye. Balls are sorted back to front
+	# and streamed to the GPU once per frame.
 	VERTICES = [
 		[[-1, -1, 0], [+1, -1, 0], [-1, +1, 0]],
 		[[-1, +1, 0], [+1, -1, 0], [+1, +1, 0]]
@@ -123,71 +61,73 @@ class Ball:
 		[[0, 1], [1, 0], [1, 1]]
 	]
 
-	def __init__(self, scene, manager, index):
+	def __init__(self, scene, balls, ball_texture):
 		self.scene = scene
-		self.manager = manager
-		self.index = index
-
-		self.enabled = False
-		self.fade_rate_after_collision = 0
-
-		self.vao = gfx.VAO()
-		with self.vao:
-			self.vao.create_vbo_attrib(0, self.VERTICES)
-			self.vao.create_vbo_attrib(1, self.TEXCOORDS)
-
-		self.init([0, 0, 0], [0, 0, 0], 0, 0, None)
-
-	def init(self, pos, dir, speed, radius, texture):
-		self.pos = mp.array(pos)
-		self.dir = mp.array(dir)
-		self.speed = speed
-		self.radius = radius
-		self.texture = texture
-
-		self.opacity = 1.
-		self.fading = False
-
-	def get_distance_to(self, target):
-		return mp.norm(self.pos - target)
+		self.balls = balls
+		self.ball_texture = ball_texture
 
-	def _update_physics(self, dt):
-		collision_blacklist = []
-
-		while dt > 0:
-			col_tri, col_time, col_pos = self.scene.pick_triangle(self.pos, self.dir*self.speed, self.radius, maxtime=dt, blacklist=collision_blacklist)
-			if col_tri is None:
-				break
-
-			if not self.fading:
-				self.scene.ball_face_collision(self, col_tri.face, col_pos)
-
-			collision_blacklist.append(col_tri)
-
-			if self.fade_rate_after_collision:
-				self.fading = True
-
-			self.dir = mp.reflect(-col_tri.normal, self.dir)
-			self.pos += self.dir * self.speed * col_time
-			dt -= col_time
-
-		self.pos += self.dir * self.speed * dt
+		self.program = gfx.Program(BALL_VS, BALL_FS, BALL_ATTRIBUTES, transform.STEREO_OUTPUTS)
+		self.program.bind_uniform_block('Camera', transform.CAMERA_BINDING)
+		with self.program:
+			self.program.set_uniform('t_balls', self.ball_texture.number)
+
+		self.count = 0
+		self._offsets = np.zeros((len(self.balls.balls), 3), dtype=mp.DTYPE)
+		self._distances = np.zeros(len(self.balls.balls), dtype=mp.DTYPE)
+
+		# One vertex array per region of the instance stream, each pointing into its own region, so that the instance
+		# layout is only set up again when the number of eyes changes
+		self.instance_vbo = gfx.StreamBuffer(len(self.balls.balls), sum(BALL_INSTANCE_SIZES))
+		vertices = gfx.VBO.create_with_data(self.VERTICES)
+		texcoords = gfx.VBO.create_with_data(self.TEXCOORDS)
+		self._vaos = []
+		for i in range(self.instance_vbo.regions):
+			vao = gfx.VAO()
+			with vao:
+				vao.set_vbo_as_attrib(0, vertices)
+				vao.set_vbo_as_attrib(1, texcoords)
+			self._vaos.append(vao)
+		self._instance_eyes = [None] * self.instance_vbo.regions
+
+	def _get_vao(self, eyes):
+		# Consecutive instances are the same ball seen by each eye. Only called with the region just written current.
+		region = self.instance_vbo.region
+		vao = self._vaos[region]
+		if self._instance_eyes[region] != eyes:
+			self._instance_eyes[region] = eyes
+			with vao:
+				vao.set_interleaved_vbo(self.instance_vbo, BALL_INSTANCE_SIZES, first_index=2, divisor=eyes)
+		return vao
 
 	def update(self, dt):
-		self._update_physics(dt)
-
-		if self.fading:
-			self.opacity -= dt * self.fade_rate_after_collision
-			if self.opacity < 0:
-				self.enabled = False
-
-	def render(self):
-		model = mp.translateM(self.pos) @ mp.scaleM(self.radius * GRAPHICS_SCALE)
-		with self.manager.program:
-			self.manager.program.set_uniform('t_ball', self.texture.number)
-			self.manager.program.set_uniform('u_model', model)
-			self.manager.program.set_uniform('u_opacity', self.opacity)
-			self.vao.draw_triangles()
+		balls = self.balls
+		enabled = np.flatnonzero(balls.enabled)
+		self.count = len(enabled)
+		if self.count == 0:
+			return
+
+		offsets, distances = self._offsets[:self.count], self._distances[:self.count]
+		np.subtract(balls.render_pos[enabled], self.scene.camera.get_pos(), out=offsets)
+		np.einsum('ij,ij->i', offsets, offsets, out=distances)
+		order = enabled[np.argsort(-distances, kind='stable')]
+
+		# Written straight into the stream's mapped memory
+		instances = self.instance_vbo.begin()[:self.count]
+		instances[:, 0:3] = balls.render_pos[order]
+		np.multiply(balls.radius[order], GRAPHICS_SCALE, out=instances[:, 3])
+		instances[:, 4] = balls.opacity[order]
+		instances[:, 5] = balls.texture[order]
+		self.instance_vbo.end()
+
+	def render(self, queue):
+		if self.count == 0:
+			return
+
+		queue.submit(renderqueue.PASS_INSIDE, self.program, self._draw, texture=self.ball_texture)
+
+	def _draw(self):
+		eyes = len(self.scene.transforms.eyes)
+		self._get_vao(eyes).draw_triangles(instances=self.count * eyes)
 
 	def __repr__(self):
-		return "<Ball %d>" % (self.index,)
+		return "<Balls %d>" % (self.count,)
@@ -0,0 +1,85 @@
+import numpy as np
+
+import mp
+
+LEAF_SIZE = 8
+
+class BVH:
+	def __init__(self, vertices, leaf_size=LEAF_SIZE):
+		vertices = mp.asarray(vertices)
+		tri_mins, tri_maxs = vertices.min(axis=1), vertices.max(axis=1)
+		centroids = vertices.mean(axis=1)
+
+		self.order = np.arange(len(vertices))
+		mins, maxs, lefts, rights, starts, counts = [], [], [], [], [], []
+
+		# Median split along the longest axis of the centroid bounds; leaves own a contiguous range of self.order
+		def _build(start, end):
+			node = len(mins)
+			indices = self.order[start:end]
+			mins.append(tri_mins[indices].min(axis=0))
+			maxs.append(tri_maxs[indices].max(axis=0))
+			lefts.append(-1)
+			rights.append(-1)
+			starts.append(start)
+			counts.append(0)
+
+			if end - start <= leaf_size:
+				counts[node] = end - start
+				return node
+
+			c = centroids[indices]
+			axis = np.argmax(c.max(axis=0) - c.min(axis=0))
+			mid = (start + end) // 2
+			self.order[start:end] = indices[np.argpartition(c[:, axis], mid - start)]
+
+			lefts[node] = _build(start, mid)
+			rights[node] = _build(mid, end)
+			return node
+
+		_build(0, len(vertices))
+
+		self.mins, self.maxs = mp.array(mins), mp.array(maxs)
+		self.lefts, self.rights = np.array(lefts), np.array(rights)
+		self.starts, self.counts = np.array(starts), np.array(counts)
+
+	def query(self, pos, vel, radius, maxtime):
+		# Traverses the tree for all swept spheres at once, one level per iteration. Returns (sphere, triangle) pairs for
+		# every leaf whose box, grown by the sphere radius, is crossed within [0, maxtime].
+		pos, vel = mp.asarray(pos), mp.asarray(vel)
+		radius, maxtime = mp.asarray(radius), mp.asarray(maxtime)
+
+		with np.errstate(divide='ignore'):
+			inv_vel = 1 / vel
+
+		spheres = np.arange(len(pos))
+		nodes = np.zeros(len(pos), dtype=np.int64)
+		pair_spheres, pair_triangles = [], []
+
+		while len(spheres) > 0:
+			hit = self._slab_test(pos[spheres], inv_vel[spheres], radius[spheres], maxtime[spheres], nodes)
+			spheres, nodes = spheres[hit], nodes[hit]
+
+			leaf = self.counts[nodes] > 0
+			leaf_spheres, leaf_nodes = spheres[leaf], nodes[leaf]
+			leaf_counts = self.counts[leaf_nodes]
+			pair_spheres.append(np.repeat(leaf_spheres, leaf_counts))
+			pair_triangles.append(self.order[np.repeat(self.starts[leaf_nodes], leaf_counts) + mp.ragged_arange(leaf_counts)])
+
+			inner_spheres, inner_nodes = spheres[~leaf], nodes[~leaf]
+			spheres = np.concatenate([inner_spheres, inner_spheres])
+			nodes = np.concatenate([self.lefts[inner_nodes], self.rights[inner_nodes]])
+
+		return (np.concatenate(pair_spheres), np.concatenate(pair_triangles))
+
+	def _slab_test(self, pos, inv_vel, radius, maxtime, nodes):
+		lo = self.mins[nodes] - radius[:, np.newaxis]
+		hi = self.maxs[nodes] + radius[:, np.newaxis]
+
+		with np.errstate(invalid='ignore'):
+			t0, t1 = (lo - pos) * inv_vel, (hi - pos) * inv_vel
+
+		# fmin/fmax skip the NaNs from starting exactly on a slab while moving parallel to it
+		tnear = np.max(np.fmin(t0, t1), axis=-1)
+		tfar = np.min(np.fmax(t0, t1), axis=-1)
+		return (tfar >= np.maximum(tnear, 0)) & (tnear <= maxtime)
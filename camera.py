@@ -1,33 +1,62 @@
-import time
+import numpy as np
 
 import mp
 
 class Camera:
+	def __init__(self):
+		# Scratch buffers, so computing the view matrix every frame doesn't allocate
+		self._pos = np.zeros(3, dtype=mp.DTYPE)
+		self._forward = np.zeros(3, dtype=mp.DTYPE)
+		self._right = np.zeros(3, dtype=mp.DTYPE)
+		self._up = np.zeros(3, dtype=mp.DTYPE)
+		self._view = mp.identityM()
+
+		# Moves whenever the camera does; the view matrix is only recomputed for a new version
+		self.version = 0
+		self._view_version = None
+
 	def get_pos(self):
 		raise NotImplementedError()
 
-	def get_forward(self):
+	def get_forward(self, out=None):
 		raise NotImplementedError()
 
 	def _get_temp_up(self):
 		raise NotImplementedError()
 
-	def get_right(self):
-		return mp.normalize(mp.cross(self.get_forward(), self._get_temp_up()))
+	def get_right(self, out=None):
+		return self._get_right(self.get_forward(), out)
+
+	def get_up(self, out=None):
+		forward = self.get_forward()
+		return self._get_up(forward, self._get_right(forward), out)
 
-	def get_up(self):
-		return mp.normalize(mp.cross(self.get_right(), self.get_forward()))
+	def _get_right(self, forward, out=None):
+		return mp.normalize(mp.cross(forward, self._get_temp_up(), out=out), out=out)
+
+	def _get_up(self, forward, right, out=None):
+		return mp.normalize(mp.cross(right, forward, out=out), out=out)
 
 	def get_view_matrix(self):
-		return mp.lookatM(self.get_pos(), self.get_pos() + self.get_forward(), self.get_up())
+		# The returned matrix is reused by the next call
+		if self._view_version == self.version:
+			return self._view
+		self._view_version = self.version
+
+		forward = self.get_forward(out=self._forward)
+		right = self._get_right(forward, out=self._right)
+		up = self._get_up(forward, right, out=self._up)
+		return mp.viewM(self.get_pos(), forward, right, up, out=self._view)
 
 class SphericalCamera(Camera):
 	def __init__(self, scene, pos, speed, target, up):
+		super().__init__()
 		self.scene = scene
 		self.pos = mp.array(pos)
 		self.speed = mp.array(speed)
 		self.target = mp.array(target)
 		self.up = mp.array(up)
+		self.move([0, 0, 0])
 
 	def update(self, dt):
 		if self.scene.keys['w']: self.move([ 0, -dt, 0 ])
@@ -39,39 +68,42 @@ class SphericalCamera(Camera):
 
 	def move(self, movedir):
 		self.pos += self.speed * mp.asarray(movedir)
+		mp.spherical_to_cartesian(self.pos, out=self._pos)
+		self.version += 1
 
 	def get_pos(self):
-		return mp.spherical_to_cartesian(self.pos)
+		return self._pos
 
-	def get_forward(self):
-		return mp.normalize(self.target - self.get_pos())
+	def get_forward(self, out=None):
+		return mp.normalize(np.subtract(self.target, self.get_pos(), out=out), out=out)
 
 	def _get_temp_up(self):
 		return self.up
 
 class WanderingSphericalCamera(Camera):
 	def __init__(self, target, up, theta_eq, phi_eq, r_eq):
+		super().__init__()
 		self.target = mp.array(target)
 		self.up = mp.array(up)
 		self.theta_eq = theta_eq
 		self.phi_eq = phi_eq
 		self.r_eq = r_eq
 
-		self.pos = mp.array([0, 0, 0])
-		self.start_time = time.monotonic()
+		self.elapsed = 0.
 
 	def update(self, dt):
-		elapsed = time.monotonic() - self.start_time
-		theta = self.theta_eq(elapsed)
-		phi = self.phi_eq(elapsed)
-		r = self.r_eq(elapsed)
-		self.pos = mp.spherical_to_cartesian([theta, phi, r])
+		self.elapsed += dt
+		theta = self.theta_eq(self.elapsed)
+		phi = self.phi_eq(self.elapsed)
+		r = self.r_eq(self.elapsed)
+		mp.spherical_to_cartesian((theta, phi, r), out=self._pos)
+		self.version += 1
 
 	def get_pos(self):
-		return self.pos
+		return self._pos
 
-	def get_forward(self):
-		return mp.normalize(self.target - self.get_pos())
+	def get_forward(self, out=None):
+		return mp.normalize(np.subtract(self.target, self.get_pos(), out=out), out=out)
 
 	def _get_temp_up(self):
 		return self.up
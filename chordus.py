@@ -7,8 +7,8 @@ class Chordus:
 		self.record_center = None
 		self.reset()
 
-	def note_down(self, channel, note, velocity):
-		self.midi.note_down(channel, note, velocity)
+	def note_down(self, channel, note, velocity, now):
+		self.midi.note_down(channel, note, velocity, now)
 
 		if self.recording:
 			if self.record_center is None:
@@ -22,10 +22,10 @@ class Chordus:
 			for delta in self.deltas:
 				hnote = note + delta
 				if 0 <= hnote <= 127:
-					self.midi.note_down(channel, hnote, velocity)
+					self.midi.note_down(channel, hnote, velocity, now)
 
-	def note_up(self, channel, note, velocity):
-		self.midi.note_up(channel, note, velocity)
+	def note_up(self, channel, note, velocity, now):
+		self.midi.note_up(channel, note, velocity, now)
 
 		if self.recording:
 			pass
@@ -33,7 +33,7 @@ class Chordus:
 			for delta in self.deltas:
 				hnote = note + delta
 				if 0 <= hnote <= 127:
-					self.midi.note_up(channel, note + delta, velocity)
+					self.midi.note_up(channel, note + delta, velocity, now)
 
 	def reset(self):
 		self.deltas = []
@@ -12,11 +12,12 @@ class ColorPalette:
 	def get_hud_colors(self):
 		return ((1., 1., 1., 1.), (.5, .5, .5, 1.), (.25, .25, .25, 1.))
 
+	# None stands for the default colors, which can change over time and are given to the shader as they do
 	def get_wire_color_for_note(self, note):
-		return self.get_default_wire_color()
+		return None
 
 	def get_face_colors_for_note(self, note):
-		return self.get_default_face_colors()
+		return (None, None)
 
 	def update(self, dt):
 		pass
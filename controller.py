@@ -1,13 +1,12 @@
+import heapq
+import itertools as it
 import json
 import logging
 import math
-import threading
-import time
 
 import chordus
 import midi
 import params
-import scheduler
 
 IGNORE_PLAY_CHANNELS = [9]
 
@@ -16,6 +15,7 @@ def _get_controls():
 		Control('ball_speed',  params.BALL_SPEED,   Control.fexprange()),
 		Control('ball_radius', params.BALL_RADIUS,  Control.frange),
 		Control('ball_count',  params.BALLS,        Control.irange),
+		Control('ball_collisions', params.BALL_COLLISIONS, Control.bool),
 		Control('shape',       params.SHAPES,       Control.enumindex),
 		Control('note_length', params.NOTE_LENGTHS, Control.enumindex),
 		Control('channel',     params.CHANNELS,     Control.enumindex),
@@ -48,6 +48,7 @@ def _get_note_mapping():
 #		(9, 37): 'shuffle_faces',
 #		(9, 38): 'toggle_hud',
 #		(9, 39): 'toggle_assignment_feedback',
+#		(9, 40): 'toggle_ball_collisions',
 	}
 
 class Controller:
@@ -75,7 +76,7 @@ class Controller:
 	def _on_channel_change(self, control, cn):
 		self.current_channel = params.CHANNELS[cn]
 
-	def initialize_controls(self):
+	def initialize_controls(self, values=None):
 		try:
 			with open(self.channels_file, 'r') as f:
 				for channel in params.CHANNELS:
@@ -89,7 +90,10 @@ class Controller:
 			if channel['program'] is not None:
 				self.midi.change_program(channel['number'], channel['program'])
 
-		self.load_controls()
+		if values is None:
+			self.load_controls()
+		else:
+			self.set_control_values(values)
 
 		for control in self.controls.values():
 			control.set(control.get(), fire_onchange=True)
@@ -109,28 +113,34 @@ class Controller:
 		except json.decoder.JSONDecodeError:
 			return
 
-		for cname, cval in valmap.items():
-			if cname in self.controls:
-				self.controls[cname].set(cval, fire_onchange=False)
-			else:
-				self._logger.warning("Saved control \"%s\" not found", cname)
+		self.set_control_values(valmap)
 
 	def save_controls(self):
 		if self.save_file is None: return
 
-		valmap = { c.name: c.get() for c in self.controls.values() }
+		valmap = self.get_control_values()
 		with open(self.save_file, 'w') as f:
 			json.dump(valmap, f, indent='\t')
 			f.write('\n') # Bug in json
 
+	def get_control_values(self):
+		return { c.name: c.get() for c in self.controls.values() }
+
+	def set_control_values(self, valmap):
+		for cname, cval in valmap.items():
+			if cname in self.controls:
+				self.controls[cname].set(cval, fire_onchange=False)
+			else:
+				self._logger.warning("Saved control \"%s\" not found", cname)
+
 	def handle_event(self, event, arg):
 		self._logger.debug("Event \"%s\" (arg: %s)", event, arg)
 
 		if event == 'reset_balls':
-			self.scene.defer(self.scene.balls.reset_balls)
+			self.scene.defer(self.scene.simulation.balls.reset_balls)
 
 		elif event == 'shuffle_faces':
-			self.scene.defer(self.scene.shuffle_faces)
+			self.scene.defer(self.scene.simulation.shuffle_faces)
 
 		elif event == 'chan_prev':
 			if arg > 0:
@@ -143,6 +153,9 @@ class Controller:
 		elif event == 'toggle_hud':
 			self.scene.hud.enabled = not self.scene.hud.enabled
 
+		elif event == 'toggle_ball_collisions':
+			self.controls['ball_collisions'].set(not self.controls['ball_collisions'].get())
+
 		elif event == 'toggle_assignment_feedback':
 			self.controls['assignment_feedback'].set(not self.controls['assignment_feedback'].get())
 
@@ -157,11 +170,11 @@ class Controller:
 
 		elif event == 'prev_symmetry':
 			if arg > 0:
-				self.scene.defer(self.scene.set_next_symmetry, +1)
+				self.scene.defer(self.scene.simulation.set_next_symmetry, +1)
 
 		elif event == 'next_symmetry':
 			if arg > 0:
-				self.scene.defer(self.scene.set_next_symmetry, -1)
+				self.scene.defer(self.scene.simulation.set_next_symmetry, -1)
 
 		elif event == 'disable_assignment':
 			if arg > 0:
@@ -173,7 +186,7 @@ class Controller:
 
 		elif event == 'shuffle':
 			if arg > 0:
-				self.scene.defer(self.scene.shuffle_faces)
+				self.scene.defer(self.scene.simulation.shuffle_faces)
 
 		elif event == 'chordus':
 			if arg > 0:
@@ -192,25 +205,25 @@ class Controller:
 		else:
 			self.handle_event(mapping, value)
 
-	def update(self, dt):
-		pass
+	def update(self, now):
+		self.note_player.update(now)
 
-	def note_down(self, channel, note, velocity):
+	def note_down(self, channel, note, velocity, now):
 		self._logger.debug("Note %d (%-3s) DOWN on channel %d with velocity %d", note, midi.get_note_name(note), channel, velocity)
 		self._handle_mapping(self.note_mapping.get((channel, note), None), velocity)
 
 		if channel in IGNORE_PLAY_CHANNELS:
 			return
 
-		self.chordus.note_down(channel, note, velocity)
+		self.chordus.note_down(channel, note, velocity, now)
 
-	def note_up(self, channel, note, velocity):
+	def note_up(self, channel, note, velocity, now):
 		self._logger.debug("Note %d (%-3s)  UP  on channel %d with velocity %d", note, midi.get_note_name(note), channel, velocity)
 
 		if channel in IGNORE_PLAY_CHANNELS:
 			return
 
-		self.chordus.note_up(channel, note, velocity)
+		self.chordus.note_up(channel, note, velocity, now)
 
 	def note_play(self, channel, note, duration, svel, evel):
 		self._logger.debug("Note %d (%-3s) PLAY on channel %d with duration %.2f (velocity %d ~ %d)", note, midi.get_note_name(note), channel, duration, svel, evel)
@@ -231,11 +244,16 @@ class NotePlayer:
 
 		self._logger = logging.getLogger(__name__)
 		self._notes_down = []
-		self._note_up_scheduler = scheduler.Scheduler()
-		threading.Thread(target=self._note_up_scheduler.run, name="NotePlayer scheduler", daemon=True).start()
+		# Fixed-length note-ups, as (time, sequence, channel, note), due on the scene clock
+		self._note_ups = []
+		self._note_up_sequence = it.count()
 
-	def note_down(self, channel, note, velocity):
-		now = time.monotonic()
+	def update(self, now):
+		while self._note_ups and self._note_ups[0][0] <= now:
+			time_, _, channel, note = heapq.heappop(self._note_ups)
+			self.note_up(channel, note, 0, time_, scheduled=True)
+
+	def note_down(self, channel, note, velocity, now):
 		down_channel = self.controller.current_channel['number']
 		custom_length = (self.controller.note_length == params.CUSTOM_NOTE_LENGTH)
 		assignment_enabled = self.controller.assignment_enabled
@@ -244,11 +262,9 @@ class NotePlayer:
 		self._notes_down.append(((channel, note), now, down_channel, down_data, custom_length, assignment_enabled))
 
 		if not custom_length:
-			self._note_up_scheduler.enter(self.controller.note_length, self.note_up, (channel, note, 0), { 'scheduled': True })
-
-	def note_up(self, channel, note, velocity, scheduled=False):
-		now = time.monotonic()
+			heapq.heappush(self._note_ups, (now + self.controller.note_length, next(self._note_up_sequence), channel, note))
 
+	def note_up(self, channel, note, velocity, now, scheduled=False):
 		for i, nd in enumerate(self._notes_down):
 			if nd[0] == (channel, note):
 				down_time, down_channel, down_data, custom_length, assignment_enabled = nd[1:]
@@ -263,16 +279,14 @@ class NotePlayer:
 		self._logger.debug("NotePlayer %d (%-3s) DOWN on channel %d with velocity %d", note, midi.get_note_name(note), channel, velocity)
 
 		if assignment_enabled:
-			faces = self.controller.scene.get_next_faces_and_rotate()
+			faces = self.controller.scene.simulation.get_next_faces_and_rotate()
 		else:
-			faces = self.controller.scene.get_next_faces()
+			faces = self.controller.scene.simulation.get_next_faces()
 
 		if self.controller.get_feedback_enabled():
 			self.controller.midi.send_note_down(channel, note, velocity)
 
 		for f in faces:
-			f.set_wire_color(self.controller.scene.color_palette.get_wire_color_for_note(note))
-			f.set_face_colors(*self.controller.scene.color_palette.get_face_colors_for_note(note))
 			f.highlight(math.inf)
 		return { 'faces': faces, 'svel': velocity }
 
@@ -284,7 +298,7 @@ class NotePlayer:
 
 		for f in down_data['faces']:
 			if self.controller.assignment_enabled:
-				self.controller.scene.set_face_mapping(f, (channel, note, duration, down_data['svel'], velocity))
+				self.controller.scene.simulation.set_face_mapping(f, (channel, note, duration, down_data['svel'], velocity))
 			f.highlight(0., force=True)
 
 class Control:
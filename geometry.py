@@ -0,0 +1,113 @@
+import mp
+import objreader
+import physics
+
+HIGHLIGHT_FALLOFF_TIME = .5
+# Shape time is brought back to zero past this, as shaders compare times in single precision
+TIME_REBASE_PERIOD = 1000.
+
+class Shape:
+	def __init__(self, name, radius, convex=False):
+		self.name = name
+		self.radius = radius
+		self.convex = convex
+
+		self.faces = []
+		self.symmetries = {}
+
+		# Highlights are kept as times on this clock, so time passing doesn't touch the faces until the clock is rebased.
+		# The version moves whenever a face's colors or highlight change.
+		self.time = 0.
+		self.version = 0
+
+	def load_file(self, filename, default_symmetry=True):
+		with open(filename, 'r') as f:
+			vertices, texcoords, normals = objreader.read_obj_map(f, vec_cls=mp.array)
+
+		bsrad = max(map(lambda fvs: max(map(mp.norm, fvs)), vertices))
+
+		for i, vf in enumerate(vertices):
+			tf, nf = texcoords[i], normals[i]
+			vf_scaled = list(map(lambda v: v / bsrad * self.radius, vf))
+			face = Face(self, i, vf_scaled, tf, nf)
+			self.faces.append(face)
+
+		if default_symmetry:
+			self.symmetries[len(self.faces)] = [(f.index,) for f in self.faces]
+
+		self.collider = physics.TriangleCollider([t for f in self.faces for t in f.triangles])
+
+	def update(self, dt):
+		self.time += dt
+		if self.time >= TIME_REBASE_PERIOD:
+			self._rebase_time()
+
+	def _rebase_time(self):
+		for f in self.faces:
+			f.highlight_until = max(f.highlight_until - self.time, 0.)
+		self.time = 0.
+		self.version += 1
+
+	def __repr__(self):
+		return "<Shape %s>" % (self.name,)
+
+class Face:
+	def __init__(self, shape, index, vertices, texcoords, normals):
+		self.shape = shape
+		self.index = index
+
+		self.vertices = vertices
+		self.texcoords = texcoords
+		self.triangles = []
+		self.midpoint = sum(vertices) / len(vertices)
+		self.normal = mp.triangle_normal(vertices[0:3])
+		# Colors of None follow the color palette's defaults
+		self.wire_color = None
+		self.face_color_normal = None
+		self.face_color_highlighted = None
+		# Shape time at which the highlight has faded out
+		self.highlight_until = 0.
+
+		for i in range(1, len(vertices)-1):
+			i0, i1, i2 = 0, i, i+1
+			_triplet = lambda arr: [arr[i0], arr[i1], arr[i2]]
+			triangle = Triangle(self, _triplet(vertices), _triplet(texcoords), _triplet(normals), [True, i2==len(vertices)-1, i==1])
+			self.triangles.append(triangle)
+
+	def set_wire_color(self, color):
+		self.wire_color = color
+		self.shape.version += 1
+
+	def set_face_colors(self, normal_color, highlighted_color):
+		self.face_color_normal = normal_color
+		self.face_color_highlighted = highlighted_color
+		self.shape.version += 1
+
+	def highlight(self, highlight_time, force=False):
+		# Fully highlights the face for highlight_time, after which the highlight fades out
+		highlight_until = self.shape.time + float(highlight_time) + HIGHLIGHT_FALLOFF_TIME
+		if not force:
+			highlight_until = max(self.highlight_until, highlight_until)
+
+		if highlight_until != self.highlight_until:
+			self.highlight_until = highlight_until
+			self.shape.version += 1
+
+	def get_highlight(self):
+		return mp.clamp((self.highlight_until - self.shape.time) / HIGHLIGHT_FALLOFF_TIME, 0., 1.)
+
+	def __repr__(self):
+		return "<Face %d>" % (self.index,)
+
+class Triangle:
+	def __init__(self, face, vertices, texcoords=None, normals=None, wires=None):
+		if texcoords is None: texcoords = [[0, 0], [0, 1], [1, 0]]
+		if normals is None: normals = [[0, 0, 0], [0, 0, 0], [0, 0, 0]]
+		if wires is None: wires = [True, True, True]
+
+		self.face = face
+		self.vertices = vertices
+		self.texcoords = texcoords
+		self.normals = normals
+		self.wires = wires
+		self.normal = mp.triangle_normal(self.vertices)
@@ -27,79 +27,243 @@ class UniformNotFound(Exception):
 	def __init__(self, uniform_name):
 		super().__init__("Uniform \"%s\" not found" % (uniform_name,))
 
-def get_uniform_location(program_id, name, silent=False):
-	location = GL.glGetUniformLocation(program_id, name)
-	if location == -1:
-		if not silent:
-			raise UniformNotFound(name)
-	return location
-
-def set_uniform(program_id, name, value, silent=False):
-	set_uniform_by_location(get_uniform_location(program_id, name, silent=silent), value)
-
-def set_uniform_by_location(location, value):
-	if isinstance(value, tuple):
-		shape = (len(value),)
-		tkind = 'f'
-	elif isinstance(value, float):
-		shape = ()
-		tkind = 'f'
-	elif isinstance(value, int):
-		shape = ()
-		tkind = 'i'
-	else:
-		varray = np.asarray(value)
-		shape = varray.shape
-		tkind = varray.dtype.kind
-
-	if shape == ():
-		if tkind == 'f':
-			GL.glUniform1f(location, value)
-		elif tkind == 'i':
-			GL.glUniform1i(location, value)
-		else:
-			raise NotImplementedError("I don't know how to process the dtype %s" % (value.dtype,))
-	elif shape == (3,):
-		if tkind == 'f':
-			GL.glUniform3fv(location, 1, value)
-		else:
-			raise NotImplementedError("I don't know how to process the dtype %s" % (value.dtype,))
-	elif shape == (4,):
-		if tkind == 'f':
-			GL.glUniform4fv(location, 1, value)
-		else:
-			raise NotImplementedError("I don't know how to process the dtype %s" % (value.dtype,))
-	elif shape == (4, 4):
-		GL.glUniformMatrix4fv(location, 1, GL.GL_TRUE, value)
-	elif len(shape) == 2 and shape[1] == 4:
-		GL.glUniform4fv(location, shape[0], value)
-	else:
-		raise NotImplementedError("I don't know how to process the shape %s" % (shape,))
+class UniformBlockNotFound(Exception):
+	def __init__(self, block_name):
+		super().__init__("Uniform block \"%s\" not found" % (block_name,))
+
+class FeatureNotAvailable(Exception):
+	def __init__(self, feature):
+		super().__init__("%s is not available" % (feature,))
+
+class Stats:
+	# Counters for the current frame; reset when the frame begins
+	def __init__(self):
+		self.reset()
+
+	def reset(self):
+		self.uniform_uploads = 0
+		self.uniform_uploads_elided = 0
+		self.binds = 0
+		self.binds_elided = 0
+		self.fence_waits = 0
+
+stats = Stats()
+
+_extensions = None
+
+def has_extension(name):
+	global _extensions
+	if _extensions is None:
+		count = GL.glGetIntegerv(GL.GL_NUM_EXTENSIONS)
+		_extensions = { GL.glGetStringi(GL.GL_EXTENSIONS, i).decode('ascii') for i in range(count) }
+	return name in _extensions
+
+def has_version(major, minor):
+	return (GL.glGetIntegerv(GL.GL_MAJOR_VERSION), GL.glGetIntegerv(GL.GL_MINOR_VERSION)) >= (major, minor)
+
+# Frames of streamed data that can be in flight at once
+STREAM_FRAMES = 3
+
+class Frames:
+	# Counts frames, and fences the end of each so that streamed data can wait for the GPU to be done with a frame
+	def __init__(self):
+		self.number = 0
+		self._fences = {}
+
+	def begin_frame(self):
+		stats.reset()
+
+	def end_frame(self):
+		self._fences[self.number] = GL.glFenceSync(GL.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+		self.number += 1
+
+		old = self._fences.pop(self.number - STREAM_FRAMES - 1, None)
+		if old is not None:
+			GL.glDeleteSync(old)
+
+	def wait(self, frame):
+		# Blocks until the GPU has finished the given frame, if it was fenced
+		fence = self._fences.get(frame)
+		if fence is None:
+			return
+
+		result = GL.glClientWaitSync(fence, 0, 0)
+		if result in (GL.GL_ALREADY_SIGNALED, GL.GL_CONDITION_SATISFIED):
+			return
+
+		stats.fence_waits += 1
+		while result == GL.GL_TIMEOUT_EXPIRED:
+			result = GL.glClientWaitSync(fence, GL.GL_SYNC_FLUSH_COMMANDS_BIT, 1000000)
+
+frames = Frames()
+
+class State:
+	# Shadow of the bindings made through this module, so that binding what's already bound costs no GL call. Code that
+	# binds programs, vertex arrays, buffers or textures behind this module's back must call invalidate() afterwards.
+	def __init__(self):
+		# Objects are left bound when their `with` block ends unless this is set, which helps catch code that relies on
+		# a binding it didn't make
+		self.unbind_on_exit = False
+		self.invalidate()
+
+	def invalidate(self):
+		self.program = None
+		self.vertex_array = None
+		self.buffers = {}
+		self.texture_unit = None
+		self.textures = {}
+
+	def use_program(self, program_id):
+		if self.program == program_id:
+			stats.binds_elided += 1
+			return
+
+		GL.glUseProgram(program_id)
+		self.program = program_id
+		stats.binds += 1
+
+	def bind_vertex_array(self, vertex_array_id):
+		if self.vertex_array == vertex_array_id:
+			stats.binds_elided += 1
+			return
+
+		GL.glBindVertexArray(vertex_array_id)
+		self.vertex_array = vertex_array_id
+		# The element array buffer binding is part of the vertex array's state
+		self.buffers.pop(GL.GL_ELEMENT_ARRAY_BUFFER, None)
+		stats.binds += 1
+
+	def bind_buffer(self, target, buffer_id):
+		if self.buffers.get(target) == buffer_id:
+			stats.binds_elided += 1
+			return
+
+		GL.glBindBuffer(target, buffer_id)
+		self.buffers[target] = buffer_id
+		stats.binds += 1
+
+	def bind_buffer_base(self, target, index, buffer_id):
+		# Indexed bindings aren't shadowed, but binding one also binds the buffer to the generic target
+		GL.glBindBufferBase(target, index, buffer_id)
+		self.buffers[target] = buffer_id
+		stats.binds += 1
+
+	def bind_texture(self, unit, target, texture_id):
+		# Also leaves the unit active, as uploads go to the active unit's texture
+		if self.texture_unit != unit:
+			GL.glActiveTexture(GL.GL_TEXTURE0 + unit)
+			self.texture_unit = unit
+			stats.binds += 1
+
+		if self.textures.get((unit, target)) == texture_id:
+			stats.binds_elided += 1
+			return
+
+		GL.glBindTexture(target, texture_id)
+		self.textures[(unit, target)] = texture_id
+		stats.binds += 1
+
+state = State()
+
+def _uniform_array_setter(func, width):
+	return lambda location, value: func(location, value.size // width, value)
+
+def _uniform_matrix_setter(func, width):
+	return lambda location, value: func(location, value.size // width, GL.GL_TRUE, value)
+
+# GL uniform type -> (setter taking a contiguous array, dtype); scalars are uploaded as arrays of one
+_UNIFORM_SETTERS = {
+	GL.GL_FLOAT:      (_uniform_array_setter(GL.glUniform1fv, 1), np.float32),
+	GL.GL_FLOAT_VEC2: (_uniform_array_setter(GL.glUniform2fv, 2), np.float32),
+	GL.GL_FLOAT_VEC3: (_uniform_array_setter(GL.glUniform3fv, 3), np.float32),
+	GL.GL_FLOAT_VEC4: (_uniform_array_setter(GL.glUniform4fv, 4), np.float32),
+	GL.GL_FLOAT_MAT4: (_uniform_matrix_setter(GL.glUniformMatrix4fv, 16), np.float32),
+	GL.GL_INT:        (_uniform_array_setter(GL.glUniform1iv, 1), np.int32),
+	GL.GL_BOOL:       (_uniform_array_setter(GL.glUniform1iv, 1), np.int32),
+}
+for _sampler in (GL.GL_SAMPLER_2D, GL.GL_SAMPLER_CUBE, GL.GL_SAMPLER_2D_ARRAY, GL.GL_SAMPLER_BUFFER):
+	_UNIFORM_SETTERS[_sampler] = _UNIFORM_SETTERS[GL.GL_INT]
+
+class Uniform:
+	# An active uniform of a linked program, with a setter chosen by its GL type. The last uploaded value is kept so that
+	# setting the same value again costs a comparison instead of a GL call.
+	def __init__(self, name, location, size, gl_type):
+		self.name = name
+		self.location = location
+		self.size = size
+		self.type = gl_type
+
+		if gl_type not in _UNIFORM_SETTERS:
+			raise NotImplementedError("I don't know how to set uniform \"%s\" of type 0x%x" % (name, gl_type))
+		self._setter, self.dtype = _UNIFORM_SETTERS[gl_type]
+		self._value = None
+
+	def set(self, value):
+		value = np.ascontiguousarray(value, dtype=self.dtype)
+		if self._value is not None and np.array_equal(value, self._value):
+			stats.uniform_uploads_elided += 1
+			return
+
+		self._setter(self.location, value)
+		self._value = value.copy()
+		stats.uniform_uploads += 1
 
 class Program:
-	def __init__(self, vert_shader, frag_shader):
+	def __init__(self, vert_shader, frag_shader, attributes=(), outputs=()):
+		# Vertex attribute i is bound to the input named attributes[i]; others are left to the linker. Likewise, the
+		# output named outputs[i] is bound to source i of the first draw buffer, for dual source blending.
 		self.id = GL.glCreateProgram()
-		self._uniform_locations = {}
-		self._compile_program(vert_shader, frag_shader)
+		self._compile_program(vert_shader, frag_shader, attributes, outputs)
+		self.uniforms = self._get_active_uniforms()
 
 	def set_uniform(self, name, value, silent=False):
-		if name not in self._uniform_locations:
-			self._uniform_locations[name] = get_uniform_location(self.id, name, silent=silent)
-
-		set_uniform_by_location(self._uniform_locations[name], value)
+		# The program must be active
+		uniform = self.uniforms.get(name)
+		if uniform is None:
+			if not silent:
+				raise UniformNotFound(name)
+			return
+
+		uniform.set(value)
+
+	def _get_active_uniforms(self):
+		uniforms = {}
+		for i in range(GL.glGetProgramiv(self.id, GL.GL_ACTIVE_UNIFORMS)):
+			name, size, gl_type = GL.glGetActiveUniform(self.id, i)
+			name = name.decode('ascii')
+			if name.endswith('[0]'):
+				name = name[:-3]
+
+			# Members of uniform blocks have no location
+			location = GL.glGetUniformLocation(self.id, name)
+			if location == -1:
+				continue
+
+			uniforms[name] = Uniform(name, location, int(size), int(gl_type))
+		return uniforms
+
+	def bind_uniform_block(self, name, binding):
+		index = GL.glGetUniformBlockIndex(self.id, name)
+		if index == GL.GL_INVALID_INDEX:
+			raise UniformBlockNotFound(name)
+		GL.glUniformBlockBinding(self.id, index, binding)
 
 	def activate(self):
-		GL.glUseProgram(self.id)
+		state.use_program(self.id)
 
 	def deactivate(self):
-		GL.glUseProgram(0)
+		state.use_program(0)
 
-	def _compile_program(self, vert_shader, frag_shader):
+	def _compile_program(self, vert_shader, frag_shader, attributes, outputs):
 		vs = self._compile_shader(vert_shader, GL.GL_VERTEX_SHADER, "vertex")
 		fs = self._compile_shader(frag_shader, GL.GL_FRAGMENT_SHADER, "fragment")
 
 		GL.glAttachShader(self.id, vs)
 		GL.glAttachShader(self.id, fs)
+		for index, name in enumerate(attributes):
+			GL.glBindAttribLocation(self.id, index, name)
+		for index, name in enumerate(outputs):
+			GL.glBindFragDataLocationIndexed(self.id, 0, index, name)
 		GL.glLinkProgram(self.id)
 
 		if GL.glGetProgramiv(self.id, GL.GL_LINK_STATUS) == GL.GL_FALSE:
@@ -123,7 +287,8 @@ class Program:
 		self.activate()
 
 	def __exit__(self, exc_type, exc_value, traceback):
-		self.deactivate()
+		if state.unbind_on_exit:
+			self.deactivate()
 
 class VAO:
 	def __init__(self):
@@ -131,39 +296,54 @@ class VAO:
 		self.attribs = {}
 
 	def activate(self):
-		GL.glBindVertexArray(self.id)
+		state.bind_vertex_array(self.id)
 
 	def deactivate(self):
-		GL.glBindVertexArray(0)
+		state.bind_vertex_array(0)
 
-	def set_vbo_as_attrib(self, index, vbo):
+	def set_vbo_as_attrib(self, index, vbo, size=None, offset=0, divisor=0):
+		# With a nonzero divisor the attribute advances once per `divisor` instances instead of once per vertex
 		if index not in self.attribs:
 			GL.glEnableVertexAttribArray(index)
 
 		with vbo:
-			vbo.set_attrib_pointer(index)
+			vbo.set_attrib_pointer(index, size=size, offset=offset)
+		GL.glVertexAttribDivisor(index, divisor)
 
 		self.attribs[index] = vbo
 
+	def set_interleaved_vbo(self, vbo, sizes, first_index=0, divisor=0):
+		# Each row of the VBO holds one vertex (or instance), with attribute first_index+i taking the next sizes[i] columns
+		offset = 0
+		for i, size in enumerate(sizes):
+			self.set_vbo_as_attrib(first_index + i, vbo, size=size, offset=offset, divisor=divisor)
+			offset += size
+
 	def create_vbo_attrib(self, index, data, **vbo_kwargs):
 		vbo = VBO.create_with_data(data, **vbo_kwargs)
 		self.set_vbo_as_attrib(index, vbo)
 
-	def draw_triangles(self, vbo_index=0):
-		self.draw(GL.GL_TRIANGLES, vbo_index=vbo_index)
+	def draw_triangles(self, vbo_index=0, first=0, count=None, instances=None):
+		self.draw(GL.GL_TRIANGLES, vbo_index=vbo_index, first=first, count=count, instances=instances)
 
-	def draw_line_loop(self, vbo_index=0):
-		self.draw(GL.GL_LINE_LOOP, vbo_index=vbo_index)
+	def draw_line_loop(self, vbo_index=0, first=0, count=None, instances=None):
+		self.draw(GL.GL_LINE_LOOP, vbo_index=vbo_index, first=first, count=count, instances=instances)
 
-	def draw(self, mode, vbo_index=0):
+	def draw(self, mode, vbo_index=0, first=0, count=None, instances=None):
+		# Draws `count` vertices starting at `first`, or all of them, optionally as that many instances
+		if count is None: count = math.prod(self.attribs[vbo_index].data.shape[:-1]) - first
 		with self:
-			GL.glDrawArrays(mode, 0, math.prod(self.attribs[vbo_index].data.shape[:-1]))
+			if instances is None:
+				GL.glDrawArrays(mode, first, count)
+			else:
+				GL.glDrawArraysInstanced(mode, first, count, instances)
 
 	def __enter__(self):
 		self.activate()
 
 	def __exit__(self, exc_type, exc_value, traceback):
-		self.deactivate()
+		if state.unbind_on_exit:
+			self.deactivate()
 
 class VBO:
 	@classmethod
@@ -187,18 +367,27 @@ class VBO:
 		self.data_size = None
 
 	def activate(self):
-		GL.glBindBuffer(self.type, self.id)
+		state.bind_buffer(self.type, self.id)
 
 	def deactivate(self):
-		GL.glBindBuffer(self.type, 0)
+		state.bind_buffer(self.type, 0)
 
 	def set_data(self, data):
 		self.data = np.asarray(data, dtype=self.dtype)
 		self.data_size = self.data.itemsize * self.data.size
 		GL.glBufferData(self.type, self.data, self.hint)
 
-	def set_attrib_pointer(self, index):
-		GL.glVertexAttribPointer(index, self.data.shape[-1], GL.GL_FLOAT, False, self.data.shape[-1]*self.data.itemsize, None)
+	def update(self, data, offset=0):
+		# Overwrites part of the buffer's storage, starting `offset` bytes in
+		data = np.ascontiguousarray(data, dtype=self.dtype)
+		with self:
+			GL.glBufferSubData(self.type, offset, data.nbytes, data)
+
+	def set_attrib_pointer(self, index, size=None, offset=0):
+		# By default the attribute takes up whole rows; otherwise `size` columns starting at column `offset`
+		if size is None: size = self.data.shape[-1]
+		stride = self.data.shape[-1] * self.data.itemsize
+		GL.glVertexAttribPointer(index, size, GL.GL_FLOAT, False, stride, ctypes.c_void_p(offset * self.data.itemsize))
 
 	def mmap(self, access):
 		mapped_ptr = GL.glMapBuffer(self.type, access)
@@ -206,6 +395,13 @@ class VBO:
 		mapped_obj = mapped_type.from_address(mapped_ptr)
 		return mapped_obj
 
+	def mmap_range(self, offset, size, access):
+		# Maps `size` bytes from `offset`; access is a mask of GL_MAP_*_BIT
+		mapped_ptr = GL.glMapBufferRange(self.type, offset, size, access)
+		mapped_type = ctypes.c_byte * size
+		mapped_obj = mapped_type.from_address(mapped_ptr)
+		return mapped_obj
+
 	def munmap(self):
 		GL.glUnmapBuffer(self.type)
 
@@ -213,4 +409,93 @@ class VBO:
 		self.activate()
 
 	def __exit__(self, exc_type, exc_value, traceback):
-		self.deactivate()
+		if state.unbind_on_exit:
+			self.deactivate()
+
+class UniformBuffer(VBO):
+	# A uniform block's backing buffer, permanently bound to its binding point. Data must already be laid out the way
+	# the block expects (e.g. std140).
+	def __init__(self, binding, size, hint=GL.GL_DYNAMIC_DRAW):
+		super().__init__(buffer_type=GL.GL_UNIFORM_BUFFER, hint=hint, dtype=np.uint8)
+		self.binding = binding
+
+		with self:
+			self.set_data(np.zeros(size, dtype=np.uint8))
+		state.bind_buffer_base(GL.GL_UNIFORM_BUFFER, binding, self.id)
+
+	def update(self, data, offset=0):
+		# Takes data of any type, as a block mixes them
+		data = np.ascontiguousarray(data)
+		with self:
+			GL.glBufferSubData(self.type, offset, data.nbytes, data)
+
+class StreamBuffer(VBO):
+	# A buffer rewritten every frame. Data is written through NumPy views of mapped memory, between begin() and end().
+	# Where ARB_buffer_storage is available the buffer stays mapped, holding STREAM_FRAMES regions used in turn; a
+	# region is only written once the GPU is done with the frame that last read it, so writes never wait on the
+	# driver. Elsewhere there's a single region, orphaned each frame so the driver can hand out fresh memory instead of
+	# waiting. Readers must look at the region starting `offset` bytes in.
+	allow_persistent = True
+
+	def __init__(self, rows, columns, buffer_type=GL.GL_ARRAY_BUFFER, dtype=np.float32):
+		super().__init__(buffer_type=buffer_type, hint=GL.GL_STREAM_DRAW, dtype=dtype)
+		# Only gives the shape of a region; the regions themselves are only handed out by begin()
+		self.data = np.zeros((rows, columns), dtype=dtype)
+		self.region_size = self.data.nbytes
+		self.region = 0
+		self.offset = 0
+		self._frame = None
+
+		# Regions can also be read as texture buffer ranges, whose offsets have their own alignment
+		self.persistent = self.allow_persistent and has_extension('GL_ARB_buffer_storage') and has_extension('GL_ARB_texture_buffer_range')
+		if self.persistent:
+			alignment = max(int(GL.glGetIntegerv(GL.GL_TEXTURE_BUFFER_OFFSET_ALIGNMENT)), 16)
+			self.region_stride = -(-self.region_size // alignment) * alignment
+			self.regions = STREAM_FRAMES
+			self.data_size = self.region_stride * self.regions
+
+			flags = GL.GL_MAP_WRITE_BIT | GL.GL_MAP_PERSISTENT_BIT | GL.GL_MAP_COHERENT_BIT
+			with self:
+				GL.glBufferStorage(self.type, self.data_size, None, flags)
+				self._mapped = np.frombuffer(self.mmap_range(0, self.data_size, flags), dtype=np.uint8)
+		else:
+			self.region_stride = self.region_size
+			self.regions = 1
+			self.data_size = self.region_size
+			with self:
+				GL.glBufferData(self.type, self.data_size, None, self.hint)
+
+	def set_data(self, data):
+		raise TypeError("Stream buffers are written with begin() and end()")
+
+	def update(self, data, offset=0):
+		raise TypeError("Stream buffers are written with begin() and end()")
+
+	def set_attrib_pointer(self, index, size=None, offset=0):
+		# Points at the current region, so a vertex array that reads the stream needs one layout per region
+		if size is None: size = self.data.shape[-1]
+		stride = self.data.shape[-1] * self.data.itemsize
+		GL.glVertexAttribPointer(index, size, GL.GL_FLOAT, False, stride, ctypes.c_void_p(self.offset + offset * self.data.itemsize))
+
+	def begin(self):
+		# Returns a (rows, columns) array to fill in for this frame, valid until end(). Calling it again in the same
+		# frame returns the same region; earlier writes may be lost.
+		if self.persistent:
+			if self._frame != frames.number:
+				self._frame = frames.number
+				frames.wait(frames.number - STREAM_FRAMES)
+				self.region = frames.number % self.regions
+				self.offset = self.region * self.region_stride
+			region = self._mapped[self.offset:self.offset + self.region_size]
+		else:
+			with self:
+				GL.glBufferData(self.type, self.data_size, None, self.hint)
+				access = GL.GL_MAP_WRITE_BIT | GL.GL_MAP_INVALIDATE_BUFFER_BIT | GL.GL_MAP_UNSYNCHRONIZED_BIT
+				region = np.frombuffer(self.mmap_range(0, self.region_size, access), dtype=np.uint8)
+
+		return region.view(self.dtype).reshape(self.data.shape)
+
+	def end(self):
+		if not self.persistent:
+			with self:
+				self.munmap()
@@ -7,6 +7,7 @@ import pygame.freetype
 import gfx
 import midi
 import mp
+import renderqueue
 
 HUD_VS = """
 #version 130
@@ -69,7 +70,7 @@ class Hud:
 			Channel(self, self._get_rect(.02, -.048, .2, .022)),
 			NoteLength(self, self._get_rect(.25, -.07, .2, .05)),
 			AssignmentStatus(self, self._get_rect(.45, -.05, .045, .035)),
-			DynamicText(self, self._get_rect(.4, -.09, .2, .02), lambda: "%s (%d)" % (self.scene.active_shape.name, self.scene.active_symmetry)),
+			DynamicText(self, self._get_rect(.4, -.09, .2, .02), lambda: "%s (%d)" % (self.scene.simulation.active_shape.name, self.scene.simulation.active_symmetry)),
 			FaceMapping(self, self._get_rect(.5, -.035, .49, .015)),
 		]
 
@@ -150,10 +151,7 @@ class Hud:
 		for e in self.elements:
 			e.update(dt)
 
-	def pre_render(self, projection, view):
-		pass
-
-	def render(self):
+	def render(self, queue):
 		if not self.enabled: return
 
 		self.surface.fill(pygame.Color(0, 0, 0, 0), self.active_rect)
@@ -164,8 +162,7 @@ class Hud:
 		arr = np.frombuffer(self.surface_buffer, dtype=np.uint8).reshape(self.size[1], self.size[0], 4)
 		self.hudtex.load_subarray(arr, self.active_rect[0], self.active_rect[1], self.active_rect[2], self.active_rect[3])
 
-		with self.program:
-			self.vao.draw_triangles()
+		queue.submit(renderqueue.PASS_OVERLAY, self.program, self.vao.draw_triangles, texture=self.hudtex)
 
 class HudElement:
 	def __init__(self, hud, rect):
@@ -287,10 +284,10 @@ class AssignmentStatus(HudElement):
 class FaceMapping(HudElement):
 	def __init__(self, hud, rect):
 		super().__init__(hud, rect)
-		self.max_notes = self.hud.scene.max_symmetries
+		self.max_notes = self.hud.scene.simulation.max_symmetries
 
 	def update(self, dt):
-		mappings = [self.hud.scene.get_face_mapping(face[0]) for face in reversed(self.hud.scene.face_queue)]
+		mappings = [self.hud.scene.simulation.get_face_mapping(face[0]) for face in reversed(self.hud.scene.simulation.face_queue)]
 		self.names = ["%d·%s" % (mapping[0] + 1, midi.get_note_name(mapping[1]).replace('♯', '#')) if mapping is not None else "·" for mapping in mappings]
 
 	def render(self):
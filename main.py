@@ -6,8 +6,10 @@ import sys
 from OpenGL import GL
 import sdl2
 
+import gfx
 import scene
 import midi
+import replay
 
 TITLE = "MPv2"
 FPS_PRINT_TIME = 10
@@ -20,8 +22,16 @@ def main():
 	args.add_argument('-s', '--vsync',        action='store_true', help="use vsync")
 	args.add_argument('-v', '--verbose',      action='store_true', help="increase verbosity")
 	args.add_argument('-w', '--windowed',     action='store_true', help="run in a window")
-	args.add_argument('-3', '--stereoscopy', choices=[scene.STEREOSCOPY_OFF, scene.STEREOSCOPY_ANAGLYPH], help="stereoscopy mode")
+	args.add_argument('-3', '--stereoscopy', choices=scene.STEREOSCOPY_MODES, help="stereoscopy mode")
 	args.add_argument('-e', '--eye-separation', type=float, help="stereoscopic eye separation")
+	args.add_argument('-p', '--physics-rate', type=float, help="ball physics steps per second")
+	args.add_argument('-j', '--physics-workers', type=int, help="step ball physics in this many worker processes")
+	args.add_argument('-r', '--record',       help="record seed, frame times, MIDI, key and mouse input to a file")
+	args.add_argument('-R', '--replay',       help="replay a recording instead of using the clock and MIDI input")
+	args.add_argument('-f', '--replay-fast',  action='store_true', help="replay as fast as possible instead of in real time")
+	args.add_argument('--seed',               type=int, help="random seed")
+	args.add_argument('--gl-unbind',          action='store_true', help="unbind GL objects after use, to debug missing binds")
+	args.add_argument('--gl-orphan',          action='store_true', help="stream data by orphaning buffers even where persistent mapping is available")
 	opts = args.parse_args(sys.argv[1:])
 
 	if opts.verbose:
@@ -46,6 +56,8 @@ def main():
 	window_flags = sdl2.SDL_WINDOW_OPENGL | (sdl2.SDL_WINDOW_FULLSCREEN if not opts.windowed else 0)
 	window = sdl2.SDL_CreateWindow(TITLE.encode('utf-8'), sdl2.SDL_WINDOWPOS_UNDEFINED, sdl2.SDL_WINDOWPOS_UNDEFINED, width, height, window_flags)
 	context = sdl2.SDL_GL_CreateContext(window)
+	gfx.state.unbind_on_exit = opts.gl_unbind
+	gfx.StreamBuffer.allow_persistent = not opts.gl_orphan
 
 	fbo = create_multisampled_fbo(width, height, 0)
 
@@ -57,7 +69,14 @@ def main():
 		sdl2.SDL_GL_SetSwapInterval(0)
 
 	midi_handler = midi.MidiHandler(opts.midi_input, opts.midi_output)
-	main_scene = scene.Scene((width, height), midi_handler, debug_camera=opts.debug_camera)
+
+	player = None
+	if opts.replay is not None:
+		player = replay.Player(opts.replay)
+		midi_handler.disable_input()
+		main_scene = scene.Scene((width, height), midi_handler, debug_camera=opts.debug_camera, seed=player.seed, controls=player.controls)
+	else:
+		main_scene = scene.Scene((width, height), midi_handler, debug_camera=opts.debug_camera, seed=opts.seed)
 
 	if opts.stereoscopy is not None:
 		main_scene.set_stereoscopy(opts.stereoscopy)
@@ -65,8 +84,28 @@ def main():
 	if opts.eye_separation is not None:
 		main_scene.stereoscopy_eye_separation = opts.eye_separation
 
+	if opts.physics_rate is not None:
+		main_scene.simulation.balls.physics_rate = opts.physics_rate
+
+	if opts.physics_workers is not None:
+		main_scene.simulation.balls.set_physics_workers(opts.physics_workers)
+
+	recorder = None
+	if opts.record is not None:
+		recorder = replay.Recorder(opts.record, main_scene.simulation.seed, main_scene.controller.get_control_values())
+		midi_handler.recorder = recorder
+
+	def scene_input(event, *args):
+		# Live key and mouse input is recorded, and ignored during a replay, which feeds back the recorded input
+		if player is not None:
+			return
+		if recorder is not None:
+			recorder.event(event, *args)
+		getattr(main_scene, event)(*args)
+
 	frames = 0
 	frame_count_time = time.monotonic()
+	start_time = frame_count_time
 
 	ev = sdl2.SDL_Event()
 	running = True
@@ -82,18 +121,39 @@ def main():
 				running = False
 
 			elif ev.type == sdl2.SDL_KEYDOWN and ev.key.repeat == 0:
-				main_scene.key_down(sdl2.SDL_GetKeyName(ev.key.keysym.sym).decode('ascii').lower())
+				scene_input('key_down', sdl2.SDL_GetKeyName(ev.key.keysym.sym).decode('ascii').lower())
 
 			elif ev.type == sdl2.SDL_KEYUP and ev.key.repeat == 0:
-				main_scene.key_up(sdl2.SDL_GetKeyName(ev.key.keysym.sym).decode('ascii').lower())
+				scene_input('key_up', sdl2.SDL_GetKeyName(ev.key.keysym.sym).decode('ascii').lower())
 
 			elif ev.type == sdl2.SDL_MOUSEBUTTONDOWN:
-				main_scene.mouse_down(ev.button.button, (ev.button.x / width, ev.button.y / height))
+				scene_input('mouse_down', ev.button.button, (ev.button.x / width, ev.button.y / height))
 
 			elif ev.type == sdl2.SDL_MOUSEBUTTONUP:
-				main_scene.mouse_up(ev.button.button, (ev.button.x / width, ev.button.y / height))
+				scene_input('mouse_up', ev.button.button, (ev.button.x / width, ev.button.y / height))
+
+		if player is not None:
+			frame = player.next_frame()
+			if frame is None:
+				break
 
-		main_scene.update()
+			# MIDI goes through the same queue as live input, which the scene drains at the start of the frame
+			dt, events = frame
+			for event, args in events:
+				if event == 'midi':
+					midi_handler.queue_message(*args)
+				else:
+					getattr(main_scene, event)(*args)
+
+			if not opts.replay_fast:
+				time.sleep(max(0., main_scene.last_update_time + dt - time.monotonic()))
+		else:
+			dt = time.monotonic() - main_scene.last_update_time
+
+		main_scene.update(dt)
+		# The scene records MIDI input as it handles it during the update, so the frame ends after that
+		if recorder is not None:
+			recorder.add_frame(dt)
 		main_scene.render()
 		blit_multisampled_fbo(width, height, fbo)
 		sdl2.SDL_GL_SwapWindow(window)
@@ -104,7 +164,17 @@ def main():
 			fps = frames / (now - frame_count_time)
 			frames = 0
 			frame_count_time = now
-			logger.debug("%.3f FPS", fps)
+			logger.debug("%.3f FPS (%d ball pairs tested, %d/%d uniform uploads, %d/%d binds made/elided, %d fence waits, %d draws with %d state changes last frame)", fps,
+				main_scene.simulation.balls.ball_pairs_tested, gfx.stats.uniform_uploads, gfx.stats.uniform_uploads_elided,
+				gfx.stats.binds, gfx.stats.binds_elided, gfx.stats.fence_waits, main_scene.render_queue.draws, main_scene.render_queue.state_changes)
+
+	if player is not None:
+		elapsed = time.monotonic() - start_time
+		logger.info("Replayed %d frames in %.3f s (%.3f ms per frame)", player.frame, elapsed, elapsed / max(player.frame, 1) * 1000)
+
+	if recorder is not None:
+		midi_handler.recorder = None
+		recorder.close()
 
 	main_scene.shutdown()
 
@@ -1,6 +1,6 @@
 import logging
+import queue
 import threading
-import time
 
 import rtmidi
 
@@ -15,7 +15,10 @@ class MidiHandler:
 	def __init__(self, inport=None, outport=None):
 		self._logger = logging.getLogger(__name__)
 		self.controller = None
+		self.recorder = None
 		self.notes = {}
+		# Input arrives on rtmidi's thread and waits here until the scene handles it at the start of a frame
+		self._input = queue.Queue()
 		self.scheduled_notes = {}
 		self.note_scheduler = scheduler.Scheduler()
 
@@ -64,6 +67,9 @@ class MidiHandler:
 		ev = self.note_scheduler.enter(duration, _note_off, (channel, note, evel))
 		self.scheduled_notes[(channel, note)] = ev
 
+	def schedule_note(self, time_, channel, note, duration, svel, evel):
+		self.note_scheduler.enterabs(time_, self.play_note, (channel, note, duration, svel, evel))
+
 	def send_note_down(self, channel, note, svel):
 		self.send_message([0x90 + channel, note, svel])
 
@@ -83,21 +89,40 @@ class MidiHandler:
 	def send_message(self, msg):
 		self.midi_out.send_message(msg)
 
+	def disable_input(self):
+		self.midi_in.cancel_callback()
+
 	def _midi_in_cb(self, message, user_data):
-		now = time.monotonic()
 		midimsg, timestamp = message
+		self.queue_message(midimsg)
+
+	def queue_message(self, midimsg):
+		self._input.put_nowait(midimsg)
+
+	def process_input(self, now):
+		while True:
+			try:
+				midimsg = self._input.get_nowait()
+			except queue.Empty:
+				break
+
+			if self.recorder is not None:
+				self.recorder.event('midi', midimsg)
+			self.handle_message(midimsg, now)
+
+	def handle_message(self, midimsg, now):
 		event, channel = midimsg[0] & 0xF0, midimsg[0] & 0x0F
 
 		if event == 0x90:
 			note, velocity = midimsg[1], midimsg[2]
 			if self.controller is not None:
-				self.controller.note_down(channel, note, velocity)
+				self.controller.note_down(channel, note, velocity, now)
 			self.notes[(channel, note)] = (now, velocity)
 
 		elif event == 0x80:
 			note, velocity = midimsg[1], midimsg[2]
 			if self.controller is not None:
-				self.controller.note_up(channel, note, velocity)
+				self.controller.note_up(channel, note, velocity, now)
 			if (channel, note) in self.notes:
 				stime, svel = self.notes[(channel, note)]
 				if self.controller is not None:
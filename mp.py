@@ -20,23 +20,42 @@ def augmax(a, b):
 	if b is None: return a
 	return max(a, b)
 
+def ragged_arange(counts):
+	# Concatenation of arange(c) for every c in counts
+	counts = np.asarray(counts)
+	return np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts)
+
 def clamp(x, a, b):
 	return max(a, min(b, x))
 
-def mix(a, b, x):
-	return a*(1-x) + b*x
+# Functions taking an `out` array write their result into it and return it instead of allocating a new one
+
+def mix(a, b, x, out=None):
+	if out is None:
+		return a*(1-x) + b*x
+
+	np.subtract(b, a, out=out)
+	out *= x
+	out += a
+	return out
 
 def norm(v):
 	return math.sqrt(dot(v, v))
 
-def normalize(v):
-	return v / norm(v)
+def normalize(v, out=None):
+	return np.divide(v, norm(v), out=out)
 
 def dot(v0, v1):
 	return v0[0]*v1[0] + v0[1]*v1[1] + v0[2]*v1[2]
 
-def cross(v0, v1):
-	return array([v0[1]*v1[2] - v0[2]*v1[1], v0[2]*v1[0] - v0[0]*v1[2], v0[0]*v1[1] - v0[1]*v1[0]])
+def cross(v0, v1, out=None):
+	if out is None:
+		out = np.empty(3, dtype=DTYPE)
+
+	# Components are computed before writing so that out may alias v0 or v1
+	x, y, z = v0[1]*v1[2] - v0[2]*v1[1], v0[2]*v1[0] - v0[0]*v1[2], v0[0]*v1[1] - v0[1]*v1[0]
+	out[0], out[1], out[2] = x, y, z
+	return out
 
 def angle_between(v0, v1):
 	return math.acos(dot(v0, v1) / (norm(v0) * norm(v1)))
@@ -79,29 +98,24 @@ def triangle_contains_point(tri, p):
 	edgeside2 = dot(p - tri[2], edgeperp2)
 	return all([edgeside0 <= 0, edgeside1 <= 0, edgeside2 <= 0])
 
-def identityM():
-	return array([
-		[1, 0, 0, 0],
-		[0, 1, 0, 0],
-		[0, 0, 1, 0],
-		[0, 0, 0, 1]
-	])
+_IDENTITY = np.identity(4, dtype=DTYPE)
 
-def translateM(v):
-	return array([
-		[1, 0, 0, v[0]],
-		[0, 1, 0, v[1]],
-		[0, 0, 1, v[2]],
-		[0, 0, 0,   1 ]
-	])
+def identityM(out=None):
+	if out is None:
+		return _IDENTITY.copy()
 
-def scaleM(s):
-	return array([
-		[s, 0, 0, 0],
-		[0, s, 0, 0],
-		[0, 0, s, 0],
-		[0, 0, 0, 1]
-	])
+	out[:] = _IDENTITY
+	return out
+
+def translateM(v, out=None):
+	out = identityM(out)
+	out[0:3, 3] = v
+	return out
+
+def scaleM(s, out=None):
+	out = identityM(out)
+	out[0, 0] = out[1, 1] = out[2, 2] = s
+	return out
 
 # https://en.wikipedia.org/wiki/Euler%E2%80%93Rodrigues_formula
 def rotateM(axis, theta):
@@ -115,35 +129,47 @@ def rotateM(axis, theta):
 		[  2 * (bd + ac),     2 * (cd - ab),   aa + dd - bb - cc],
 	])
 
-def perspectiveM(fovy, aspect, zNear, zFar):
-	f = 1 / math.tan(fovy / 2)
-	M = array([
-		[f/aspect, 0,                0,                                   0               ],
-		[    0,    f,                0,                                   0               ],
-		[    0,    0, (zFar + zNear) / (zNear - zFar), (2 * zFar * zNear) / (zNear - zFar)],
-		[    0,    0,               -1,                                   0               ]
-	])
-	return M
+def perspectiveM(fovy, aspect, zNear, zFar, out=None):
+	if out is None:
+		out = np.empty((4, 4), dtype=DTYPE)
 
-def lookatM(eye, center, up):
+	f = 1 / math.tan(fovy / 2)
+	out[:] = 0
+	out[0, 0] = f / aspect
+	out[1, 1] = f
+	out[2, 2] = (zFar + zNear) / (zNear - zFar)
+	out[2, 3] = (2 * zFar * zNear) / (zNear - zFar)
+	out[3, 2] = -1
+	return out
+
+def lookatM(eye, center, up, out=None):
 	eye, center, up = asarray(eye), asarray(center), asarray(up)
 	f = normalize(center - eye)
 	s = normalize(cross(f, up))
 	u = cross(s, f)
-	M = array([
-		[ s[0],  s[1],  s[2], 0],
-		[ u[0],  u[1],  u[2], 0],
-		[-f[0], -f[1], -f[2], 0],
-		[  0,     0,     0,   1]
-	])
-	return M @ translateM(-eye)
-
-def spherical_to_cartesian(p):
-	return array([
-		p[2] * math.sin(p[1]) * math.cos(p[0]),
-		p[2] * math.cos(p[1]),
-		p[2] * math.sin(p[1]) * math.sin(p[0]),
-	])
+	return viewM(eye, f, s, u, out)
+
+def viewM(eye, forward, right, up, out=None):
+	# View matrix from an orthonormal camera basis
+	out = identityM(out)
+	# Negated by multiplying: NumPy 2.4.6's in-place float32 np.negative on a column view such as out[0:3, 3] writes
+	# to the wrong elements, so np.negative isn't used on out at all
+	out[0, 0:3] = right
+	out[1, 0:3] = up
+	out[2, 0:3] = forward
+	out[2, 0:3] *= -1
+	np.matmul(out[0:3, 0:3], eye, out=out[0:3, 3])
+	out[0:3, 3] *= -1
+	return out
+
+def spherical_to_cartesian(p, out=None):
+	if out is None:
+		out = np.empty(3, dtype=DTYPE)
+
+	out[0] = p[2] * math.sin(p[1]) * math.cos(p[0])
+	out[1] = p[2] * math.cos(p[1])
+	out[2] = p[2] * math.sin(p[1]) * math.sin(p[0])
+	return out
 
 def unproject(winpos, modelview, projection):
 	ndc_near = array([2 * winpos[0] - 1, 2 * (1 - winpos[1]) - 1, -1, 1])
@@ -157,3 +183,56 @@ def unproject(winpos, modelview, projection):
 	unp_far  /= unp_far[3]
 
 	return (unp_near[0:3], unp_far[0:3])
+
+# Batched versions of the helpers above. They work on stacks of vectors (..., 3), triangles (..., 3, 3) and scalars
+# (...), broadcast against each other like NumPy does and return DTYPE arrays.
+
+def dot_n(v0, v1):
+	v0, v1 = asarray(v0), asarray(v1)
+	return np.sum(v0 * v1, axis=-1)
+
+def cross_n(v0, v1):
+	return np.cross(asarray(v0), asarray(v1))
+
+def norm_n(v):
+	return np.sqrt(dot_n(v, v))
+
+def normalize_n(v):
+	v = asarray(v)
+	return v / norm_n(v)[..., np.newaxis]
+
+def reflect_n(normal, incident):
+	normal, incident = asarray(normal), asarray(incident)
+	return incident - (2 * dot_n(incident, normal))[..., np.newaxis] * normal
+
+def triangle_normal_n(tris):
+	tris = asarray(tris)
+	return normalize_n(cross_n(tris[..., 1, :] - tris[..., 0, :], tris[..., 2, :] - tris[..., 0, :]))
+
+def intersect_plane_sphere_n(tris, spos, svel, srad=0, normals=None):
+	# Like intersect_plane_sphere; spheres moving parallel to the plane get an infinite time and a NaN point
+	tris, spos, svel, srad = asarray(tris), asarray(spos), asarray(svel), asarray(srad)
+	tn = triangle_normal_n(tris) if normals is None else asarray(normals)
+
+	velproj = dot_n(tn, svel)
+	sides = np.where(velproj > 0, 1, -1).astype(DTYPE)
+	sclosest = spos + tn * (sides * srad)[..., np.newaxis]
+	distproj = dot_n(tn, sclosest - tris[..., 0, :])
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		times = np.where(velproj == 0, DTYPE(np.inf) * -np.sign(distproj), distproj / -velproj)
+		times = np.where(distproj == 0, DTYPE(0), times)
+		points = np.where((velproj == 0)[..., np.newaxis] & (distproj != 0)[..., np.newaxis], DTYPE(np.nan), sclosest + svel * times[..., np.newaxis])
+
+	return (times, points)
+
+def triangle_edge_perps_n(tris, normals=None):
+	# Inward-facing edge perpendiculars; a point on the plane is inside the triangle if it is behind all three
+	tris = asarray(tris)
+	tn = triangle_normal_n(tris) if normals is None else asarray(normals)
+	return cross_n(np.roll(tris, -1, axis=-2) - tris, tn[..., np.newaxis, :])
+
+def triangle_contains_point_n(tris, p, normals=None, edge_perps=None):
+	tris, p = asarray(tris), asarray(p)
+	if edge_perps is None: edge_perps = triangle_edge_perps_n(tris, normals)
+	return np.all(dot_n(p[..., np.newaxis, :] - tris, edge_perps) <= 0, axis=-1)
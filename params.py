@@ -26,9 +26,20 @@ DEPTH = Range(.1, 1000.)
 
 SHAPE_SCALE = 3.
 
-BALLS = Range(0, 12, default=1)
+BALLS = Range(0, 256, default=1)
 BALL_SPEED = Range(0., 30., default=1.)
 BALL_RADIUS = Range(.05, .75, default=.2)
+BALL_COLLISIONS = Bool(default=False)
+
+PHYSICS_RATE = 240.
+PHYSICS_MAX_STEPS = 16
+
+# Collision notes are played a frame, the time the update takes to schedule them and a physics step after they
+# physically happened, the most a frame's collisions can lie in the past, so that each can be scheduled at its exact
+# time instead of at the next frame boundary. The frame
+# time used follows longer frames at once and shorter ones by this fraction per frame, so that note latency stays
+# steady while the frame rate wobbles.
+NOTE_LATENCY_DECAY = .1
 
 SHAPES = Enum([
 	shapes.Hexahedron,
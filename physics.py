@@ -0,0 +1,214 @@
+import collections
+import itertools as it
+
+import numpy as np
+
+import bvh
+import mp
+
+MAX_BOUNCES = 64
+BVH_MIN_TRIANGLES = 64
+
+Collision = collections.namedtuple('Collision', ['ball', 'index', 'time', 'point'])
+BallCollision = collections.namedtuple('BallCollision', ['ball0', 'ball1', 'point'])
+
+# The cell itself plus half of its 26 neighbors, so that every pair of adjacent cells is only visited once
+_HALF_NEIGHBORHOOD = [(0, 0, 0)] + [o for o in it.product((-1, 0, 1), repeat=3) if o > (0, 0, 0)]
+
+class TriangleCollider:
+	def __init__(self, triangles):
+		self.triangles = triangles
+		self.faces = [t.face for t in triangles]
+		self.vertices = mp.array([t.vertices for t in triangles])
+		self.normals = mp.triangle_normal_n(self.vertices)
+
+		self.edge_perps = mp.triangle_edge_perps_n(self.vertices, self.normals)
+
+		# Small meshes are cheaper to test exhaustively
+		self.bvh = bvh.BVH(self.vertices) if len(triangles) >= BVH_MIN_TRIANGLES else None
+
+	def __len__(self):
+		return len(self.triangles)
+
+	def first_hits(self, pos, vel, radius, maxtime, ignore=None):
+		# mp.intersect_plane_sphere_n and mp.triangle_contains_point_n, with precomputed normals and edge perpendiculars,
+		# over (sphere, triangle) pairs; that is all N x T pairs, or only the ones the BVH can't rule out
+		pos, vel = mp.asarray(pos), mp.asarray(vel)
+		radius, maxtime = mp.asarray(radius), mp.asarray(maxtime)
+
+		if self.bvh is None:
+			spheres, triangles = np.divmod(np.arange(len(pos) * len(self)), len(self))
+		else:
+			spheres, triangles = self.bvh.query(pos, vel, radius, maxtime)
+
+		normals, vertices = self.normals[triangles], self.vertices[triangles]
+		pvel = vel[spheres]
+
+		times, points = mp.intersect_plane_sphere_n(vertices, pos[spheres], pvel, radius[spheres], normals=normals)
+
+		with np.errstate(invalid='ignore'):
+			inside = mp.triangle_contains_point_n(vertices, points, edge_perps=self.edge_perps[triangles])
+
+			# Spheres moving parallel to a plane never hit it, even when they touch it
+			valid = (mp.dot_n(normals, pvel) != 0) & np.isfinite(times) & (times >= 0) & (times <= maxtime[spheres]) & inside
+
+		if ignore is not None:
+			valid &= triangles != ignore[spheres]
+
+		return _first_per_sphere(len(pos), spheres[valid], triangles[valid], times[valid], points[valid])
+
+class ConvexCollider:
+	# Spheres inside a convex polyhedron can only leave through the face planes they are moving towards, so the next hit
+	# is the earliest time the sphere touches one of those planes
+	def __init__(self, faces):
+		self.faces = faces
+		self.normals = mp.array([f.normal for f in faces])
+		self.offsets = np.sum(self.normals * mp.array([f.midpoint for f in faces]), axis=-1)
+
+		outward = np.where(self.offsets < 0, -1, 1).astype(mp.DTYPE)
+		self.normals *= outward[:, np.newaxis]
+		self.offsets *= outward
+
+	def __len__(self):
+		return len(self.faces)
+
+	def first_hits(self, pos, vel, radius, maxtime, ignore=None):
+		pos, vel = mp.asarray(pos), mp.asarray(vel)
+		radius, maxtime = mp.asarray(radius), mp.asarray(maxtime)
+
+		velproj = mp.dot_n(vel[:, np.newaxis, :], self.normals)
+		distances = self.offsets - radius[:, np.newaxis] - mp.dot_n(pos[:, np.newaxis, :], self.normals)
+
+		with np.errstate(divide='ignore', invalid='ignore'):
+			# Spheres already touching or penetrating a plane they move towards bounce off of it right away
+			times = np.maximum(distances / velproj, 0)
+
+		valid = (velproj > 0) & (times <= maxtime[:, np.newaxis])
+		if ignore is not None:
+			valid &= np.arange(len(self))[np.newaxis, :] != ignore[:, np.newaxis]
+
+		times = np.where(valid, times, np.inf)
+		indices = np.argmin(times, axis=1)
+		first_times = times[np.arange(len(indices)), indices]
+		indices[np.isinf(first_times)] = -1
+
+		first_points = pos + vel * np.where(np.isinf(first_times), 0, first_times)[:, np.newaxis] + self.normals[indices] * radius[:, np.newaxis]
+
+		return (first_times, indices, first_points)
+
+def _first_per_sphere(count, spheres, indices, times, points):
+	first_times = np.full(count, np.inf, dtype=mp.DTYPE)
+	first_indices = np.full(count, -1)
+	first_points = np.zeros((count, 3), dtype=mp.DTYPE)
+
+	if len(spheres) > 0:
+		order = np.lexsort((times, spheres))
+		sorted_spheres = spheres[order]
+		firsts = order[np.concatenate([[True], sorted_spheres[1:] != sorted_spheres[:-1]])]
+
+		first_times[spheres[firsts]] = times[firsts]
+		first_indices[spheres[firsts]] = indices[firsts]
+		first_points[spheres[firsts]] = points[firsts]
+
+	return (first_times, first_indices, first_points)
+
+def advance(collider, pos, dir, speed, radius, dt):
+	# Moves all spheres in place, only iterating the ones that still have time left after a bounce
+	remaining = np.full(len(pos), dt, dtype=mp.DTYPE)
+	last_hit = np.full(len(pos), -1)
+	active = np.arange(len(pos))
+	collisions = []
+
+	for bounce in range(MAX_BOUNCES + 1):
+		if len(active) == 0:
+			break
+
+		# Never collide with the triangle we just bounced off of
+		vel = dir[active] * speed[active, np.newaxis]
+		times, indices, points = collider.first_hits(pos[active], vel, radius[active], remaining[active], ignore=last_hit[active])
+		if bounce == MAX_BOUNCES:
+			indices[:] = -1
+
+		hit = indices >= 0
+		missed = active[~hit]
+		pos[missed] += vel[~hit] * remaining[missed, np.newaxis]
+
+		active, vel, times, indices, points = active[hit], vel[hit], times[hit], indices[hit], points[hit]
+		for i, ti, t, p in zip(active, indices, times, points):
+			collisions.append(Collision(i, ti, dt - remaining[i] + t, p))
+
+		last_hit[active] = indices
+		pos[active] += vel * times[:, np.newaxis]
+		remaining[active] -= times
+
+		dir[active] = mp.reflect_n(collider.normals[indices], dir[active])
+
+	return collisions
+
+def find_ball_pairs(pos, radius, bounds):
+	# Uniform grid broadphase over the cube [-bounds, +bounds] with cells at least one ball diameter wide, so touching
+	# balls are always in the same or adjacent cells. Balls are sorted by cell key and each neighboring cell is found
+	# with a binary search, which keeps the whole thing vectorized and near-linear in the ball count.
+	count = len(pos)
+	cells_per_axis = max(1, int(bounds / max(radius)))
+	cell_size = 2 * bounds / cells_per_axis
+	dims = cells_per_axis + 2
+
+	cells = np.clip(np.floor((pos + bounds) / cell_size).astype(np.int64), 0, cells_per_axis - 1) + 1
+	keys = (cells[:, 0] * dims + cells[:, 1]) * dims + cells[:, 2]
+	order = np.argsort(keys, kind='stable')
+	sorted_keys = keys[order]
+
+	firsts, seconds = [], []
+	for offset in _HALF_NEIGHBORHOOD:
+		neighbor_keys = sorted_keys + (offset[0] * dims + offset[1]) * dims + offset[2]
+		if offset == (0, 0, 0):
+			lo = np.arange(1, count + 1)
+		else:
+			lo = np.searchsorted(sorted_keys, neighbor_keys, side='left')
+		hi = np.searchsorted(sorted_keys, neighbor_keys, side='right')
+
+		counts = np.maximum(hi - lo, 0)
+		total = np.sum(counts)
+		if total == 0:
+			continue
+
+		first = np.repeat(np.arange(count), counts)
+		second = lo[first] + mp.ragged_arange(counts)
+		firsts.append(order[first])
+		seconds.append(order[second])
+
+	if len(firsts) == 0:
+		return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+	return (np.concatenate(firsts), np.concatenate(seconds))
+
+def collide_balls(pos, dir, speed, radius, bounds):
+	# Elastic collisions between equal mass balls; dir and speed are updated in place. Returns the collisions and the
+	# number of candidate pairs the broadphase let through.
+	firsts, seconds = find_ball_pairs(pos, radius, bounds)
+
+	deltas = pos[seconds] - pos[firsts]
+	touching = np.sum(deltas * deltas, axis=-1) < (radius[firsts] + radius[seconds]) ** 2
+
+	collisions = []
+	for i, j in zip(firsts[touching], seconds[touching]):
+		delta = pos[j] - pos[i]
+		distance = mp.norm(delta)
+		if distance == 0:
+			continue
+
+		normal = delta / distance
+		vi, vj = dir[i] * speed[i], dir[j] * speed[j]
+		approach = mp.dot(vi - vj, normal)
+		if approach <= 0:
+			continue
+
+		vi, vj = vi - approach * normal, vj + approach * normal
+		speed[i], speed[j] = mp.norm(vi), mp.norm(vj)
+		if speed[i] > 0: dir[i] = vi / speed[i]
+		if speed[j] > 0: dir[j] = vj / speed[j]
+
+		collisions.append(BallCollision(i, j, pos[i] + normal * radius[i]))
+
+	return (collisions, len(firsts))
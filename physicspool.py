@@ -0,0 +1,197 @@
+import logging
+import multiprocessing as mpr
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import mp
+import physics
+
+# Ball state arrays kept in shared memory, as (name, columns, dtype); a column count of None makes a flat array
+STATE_FIELDS = (
+	('pos', 3, mp.DTYPE),
+	('prev_pos', 3, mp.DTYPE),
+	('dir', 3, mp.DTYPE),
+	('speed', None, mp.DTYPE),
+	('radius', None, mp.DTYPE),
+	('enabled', None, np.bool_),
+)
+# Collision event columns: ball, triangle/face index, time, contact point
+EVENT_COLUMNS = 6
+RING_CAPACITY = 4096
+
+def _shared_array(shm, shape, dtype):
+	return np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+def _state_size(capacity):
+	return sum(capacity * (columns or 1) * np.dtype(dtype).itemsize for name, columns, dtype in STATE_FIELDS)
+
+def _state_arrays(shm, capacity):
+	# Views of each state field, laid out one after the other
+	arrays, offset = {}, 0
+	for name, columns, dtype in STATE_FIELDS:
+		shape = (capacity, columns) if columns is not None else (capacity,)
+		arrays[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+		offset += arrays[name].nbytes
+	return arrays
+
+class _Ring:
+	# Single producer (a worker), single consumer (the main process) event queue. The head and tail counters only grow;
+	# the producer owns the head and the consumer the tail.
+	def __init__(self, shm, capacity):
+		self.capacity = capacity
+		self.counters = _shared_array(shm, (3,), np.int64)
+		self.events = np.ndarray((capacity, EVENT_COLUMNS), dtype=np.float64, buffer=shm.buf, offset=self.counters.nbytes)
+
+	@staticmethod
+	def size(capacity):
+		return 3 * 8 + capacity * EVENT_COLUMNS * 8
+
+	def push(self, rows):
+		head, tail = self.counters[0], self.counters[1]
+		free = self.capacity - (head - tail)
+		if len(rows) > free:
+			# Overflowing events are dropped and counted rather than stalling the physics step
+			self.counters[2] += len(rows) - free
+			rows = rows[:free]
+
+		indices = (head + np.arange(len(rows))) % self.capacity
+		self.events[indices] = rows
+		self.counters[0] = head + len(rows)
+
+	def pop_all(self):
+		head, tail = self.counters[0], self.counters[1]
+		rows = self.events[np.arange(tail, head) % self.capacity].copy()
+		self.counters[1] = head
+		return rows
+
+	def pop_dropped(self):
+		dropped, self.counters[2] = int(self.counters[2]), 0
+		return dropped
+
+def _step_shard(collider, state, start, end, dt):
+	# Moves the enabled balls of rows [start, end) in place and returns their collisions, numbered by row
+	enabled = state['enabled'][start:end]
+	if enabled.all():
+		rows = slice(start, end)
+		state['prev_pos'][rows] = state['pos'][rows]
+		collisions = physics.advance(collider, state['pos'][rows], state['dir'][rows], state['speed'][rows], state['radius'][rows], dt)
+		return [(start + c.ball, c) for c in collisions]
+
+	# Sparse shards are gathered and scattered back, still without leaving shared memory
+	rows = start + np.flatnonzero(enabled)
+	pos, dir_ = state['pos'][rows], state['dir'][rows]
+	state['prev_pos'][rows] = pos
+	collisions = physics.advance(collider, pos, dir_, state['speed'][rows], state['radius'][rows], dt)
+	state['pos'][rows], state['dir'][rows] = pos, dir_
+	return [(rows[c.ball], c) for c in collisions]
+
+def _worker(conn, state_name, capacity, ring_name, ring_capacity):
+	state_shm = shared_memory.SharedMemory(name=state_name)
+	ring_shm = shared_memory.SharedMemory(name=ring_name)
+	state = _state_arrays(state_shm, capacity)
+	ring = _Ring(ring_shm, ring_capacity)
+	collider = None
+
+	try:
+		while True:
+			message = conn.recv()
+			if message[0] == 'collider':
+				collider = message[1]
+
+			elif message[0] == 'step':
+				_, start, end, dt = message
+				collisions = _step_shard(collider, state, start, end, dt)
+				if len(collisions) > 0:
+					ring.push(np.array([[ball, c.index, c.time, *c.point] for ball, c in collisions]))
+				conn.send(len(collisions))
+
+			elif message[0] == 'quit':
+				break
+	finally:
+		del state, ring
+		state_shm.close()
+		ring_shm.close()
+
+class PhysicsPool:
+	# Steps ball shards in worker processes. Ball state lives in shared memory arrays (pos, prev_pos, dir, speed, radius
+	# and enabled) that the owner of the balls uses as its own, so workers move the balls in place. Each worker reports
+	# its collisions through its own ring buffer.
+	def __init__(self, workers, capacity, ring_capacity=RING_CAPACITY):
+		self._logger = logging.getLogger(__name__)
+		self.capacity = capacity
+
+		self._state_shm = shared_memory.SharedMemory(create=True, size=_state_size(capacity))
+		self.state = _state_arrays(self._state_shm, capacity)
+		for name, array in self.state.items():
+			array[...] = 0
+			setattr(self, name, array)
+
+		# Workers are spawned rather than forked so they don't inherit the window and GL context
+		context = mpr.get_context('spawn')
+		self._ring_shms, self._rings, self._conns, self._processes = [], [], [], []
+		for i in range(workers):
+			ring_shm = shared_memory.SharedMemory(create=True, size=_Ring.size(ring_capacity))
+			ring = _Ring(ring_shm, ring_capacity)
+			ring.counters[:] = 0
+
+			conn, worker_conn = context.Pipe()
+			process = context.Process(target=_worker, args=(worker_conn, self._state_shm.name, capacity, ring_shm.name, ring_capacity), daemon=True)
+			process.start()
+
+			self._ring_shms.append(ring_shm)
+			self._rings.append(ring)
+			self._conns.append(conn)
+			self._processes.append(process)
+
+		self.collider = None
+
+	def set_collider(self, collider):
+		self.collider = collider
+		for conn in self._conns:
+			conn.send(('collider', collider))
+
+	def step(self, dt):
+		# Advances the enabled balls by dt and returns their collisions in time order; prev_pos gets their old positions
+		enabled = np.flatnonzero(self.enabled)
+		if len(enabled) == 0:
+			return []
+
+		# Shards are split by enabled ball, so that each worker gets its share even when they're spread out
+		bounds = np.append(enabled[np.linspace(0, len(enabled), len(self._conns), endpoint=False).astype(int)], enabled[-1] + 1)
+		busy = []
+		for conn, start, end in zip(self._conns, bounds[:-1], bounds[1:]):
+			if end > start:
+				conn.send(('step', start, end, dt))
+				busy.append(conn)
+
+		for conn in busy:
+			conn.recv()
+
+		collisions = []
+		for ring in self._rings:
+			dropped = ring.pop_dropped()
+			if dropped > 0:
+				self._logger.warning("Dropped %d collision events", dropped)
+
+			for row in ring.pop_all():
+				collisions.append(physics.Collision(int(row[0]), int(row[1]), row[2], row[3:6].astype(mp.DTYPE)))
+
+		collisions.sort(key=lambda c: c.time)
+		return collisions
+
+	def close(self):
+		for conn in self._conns:
+			conn.send(('quit',))
+		for process in self._processes:
+			process.join()
+
+		for name in self.state:
+			delattr(self, name)
+		del self.state
+		for ring_shm in self._ring_shms:
+			ring_shm.close()
+			ring_shm.unlink()
+		self._rings = []
+		self._state_shm.close()
+		self._state_shm.unlink()
@@ -0,0 +1,71 @@
+import collections
+
+# Passes, in the order they're drawn. Shapes are convex, so whatever is inside one is drawn between its faces seen from
+# behind and its faces seen from the front.
+PASS_BACKGROUND = 0
+PASS_BEHIND = 1
+PASS_INSIDE = 2
+PASS_IN_FRONT = 3
+PASS_OVERLAY = 4
+
+DrawItem = collections.namedtuple('DrawItem', ['key', 'program', 'texture', 'draw'])
+
+class RenderQueue:
+	# Collects a frame's draws and issues them sorted by (pass, program, texture, depth), so that draws sharing a program
+	# and texture follow each other. Items of translucent passes are sorted back to front before anything else, as
+	# blending needs them in that order.
+	def __init__(self):
+		self._passes = {}
+		self._items = []
+
+		# Counters for the last flush
+		self.draws = 0
+		self.state_changes = 0
+
+	def add_pass(self, pass_, translucent=False, state=None):
+		# The pass's GL state, if any, is an object with activate() and deactivate(); consecutive passes with the same
+		# state share one activation
+		self._passes[pass_] = (translucent, state)
+
+	def submit(self, pass_, program, draw, texture=None, depth=0.):
+		# draw() is called with the program and texture active. Depth is the distance from the camera.
+		translucent, _ = self._passes[pass_]
+		texture_key = texture.number if texture is not None else -1
+		if translucent:
+			key = (pass_, -depth, program.id, texture_key)
+		else:
+			key = (pass_, program.id, texture_key, depth)
+		self._items.append(DrawItem(key, program, texture, draw))
+
+	def flush(self):
+		self._items.sort(key=lambda item: item.key)
+		self.draws = len(self._items)
+		self.state_changes = 0
+
+		state, program, texture = None, None, None
+		for item in self._items:
+			pass_state = self._passes[item.key[0]][1]
+			if pass_state is not state:
+				if state is not None:
+					state.deactivate()
+				state = pass_state
+				if state is not None:
+					state.activate()
+				self.state_changes += 1
+
+			if item.program is not program:
+				program = item.program
+				program.activate()
+				self.state_changes += 1
+
+			if item.texture is not None and item.texture is not texture:
+				texture = item.texture
+				texture.activate()
+				self.state_changes += 1
+
+			item.draw()
+
+		if state is not None:
+			state.deactivate()
+
+		self._items.clear()
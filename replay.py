@@ -0,0 +1,55 @@
+import collections
+import json
+
+# Recordings are JSON lines: a header with the RNG seed and initial control values, then one line per frame time and
+# per input event. Events are MIDI messages and the scene's key and mouse events, tagged with the frame they were
+# handled at the start of, and are fed back at the start of that frame.
+
+class Recorder:
+	def __init__(self, filename, seed, controls):
+		self.frame = 0
+
+		self._file = open(filename, 'w')
+		self._write({ 'seed': seed, 'controls': controls })
+
+	def _write(self, entry):
+		self._file.write(json.dumps(entry) + '\n')
+
+	def event(self, name, *args):
+		self._write({ 'frame': self.frame, 'event': name, 'args': list(args) })
+
+	def add_frame(self, dt):
+		self._write({ 'dt': dt })
+		self.frame += 1
+
+	def close(self):
+		self._file.close()
+
+class Player:
+	def __init__(self, filename):
+		with open(filename, 'r') as f:
+			entries = [json.loads(line) for line in f if line.strip()]
+
+		header = entries[0]
+		self.seed = header['seed']
+		self.controls = header['controls']
+
+		self.dts = [e['dt'] for e in entries if 'dt' in e]
+		self.events = collections.defaultdict(list)
+		for e in entries:
+			if 'event' in e:
+				self.events[e['frame']].append((e['event'], e['args']))
+
+		self.frame = 0
+
+	def __len__(self):
+		return len(self.dts)
+
+	def next_frame(self):
+		# Returns (dt, [(event, args), ...]) for the next frame, or None once the recording is over
+		if self.frame >= len(self.dts):
+			return None
+
+		frame = (self.dts[self.frame], self.events.get(self.frame, []))
+		self.frame += 1
+		return frame
@@ -1,10 +1,8 @@
 import collections
 import glob
-import itertools as it
 import logging
 import math
 import queue
-import random
 import time
 
 import numpy as np
@@ -14,20 +12,70 @@ import ball
 import camera
 import colorpalette
 import controller
+import gfx
 import hud
 import mp
 import params
+import renderqueue
 import shape
+import simulation
 import skybox
 import texture
+import transform
 
 CAMERA_DISTANCE = 9.
 
 STEREOSCOPY_OFF = 'off'
 STEREOSCOPY_ANAGLYPH = 'anaglyph'
+STEREOSCOPY_SIDE_BY_SIDE = 'side-by-side'
+STEREOSCOPY_TOP_BOTTOM = 'top-bottom'
+
+# The eyes drawn by each mode, as (eye, viewport, color mask). Side by side and top-bottom squeeze each eye's image
+# into half the screen, for projectors that stretch it back.
+STEREOSCOPY_EYES = {
+	STEREOSCOPY_OFF: ((transform.EYE_CENTER, transform.VIEWPORT_FULL, transform.MASK_ALL),),
+	STEREOSCOPY_ANAGLYPH: (
+		(transform.EYE_LEFT, transform.VIEWPORT_FULL, transform.MASK_CYAN),
+		(transform.EYE_RIGHT, transform.VIEWPORT_FULL, transform.MASK_RED),
+	),
+	STEREOSCOPY_SIDE_BY_SIDE: (
+		(transform.EYE_LEFT, transform.VIEWPORT_LEFT, transform.MASK_ALL),
+		(transform.EYE_RIGHT, transform.VIEWPORT_RIGHT, transform.MASK_ALL),
+	),
+	STEREOSCOPY_TOP_BOTTOM: (
+		(transform.EYE_LEFT, transform.VIEWPORT_TOP, transform.MASK_ALL),
+		(transform.EYE_RIGHT, transform.VIEWPORT_BOTTOM, transform.MASK_ALL),
+	),
+}
+STEREOSCOPY_MODES = list(STEREOSCOPY_EYES)
+
+class _StereoState:
+	# GL state for drawing every eye at once. Eyes drawn to only some color channels are blended into just those by the
+	# shaders' second output, and eyes drawn to split viewports are clipped to their own.
+	def __init__(self, transforms):
+		self.transforms = transforms
+		self._masked = False
+		self._split = False
+
+	def activate(self):
+		self._masked = any(mask != transform.MASK_ALL for eye, viewport, mask in self.transforms.eyes)
+		self._split = any(viewport != transform.VIEWPORT_FULL for eye, viewport, mask in self.transforms.eyes)
+
+		if self._masked:
+			GL.glBlendFunc(GL.GL_SRC1_COLOR, GL.GL_ONE_MINUS_SRC1_COLOR)
+		if self._split:
+			for i in range(transform.STEREO_CLIP_DISTANCES):
+				GL.glEnable(GL.GL_CLIP_DISTANCE0 + i)
+
+	def deactivate(self):
+		if self._split:
+			for i in range(transform.STEREO_CLIP_DISTANCES):
+				GL.glDisable(GL.GL_CLIP_DISTANCE0 + i)
+		if self._masked:
+			GL.glBlendFunc(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA)
 
 class Scene:
-	def __init__(self, size, midi_handler, debug_camera=False):
+	def __init__(self, size, midi_handler, debug_camera=False, seed=None, controls=None):
 		self.size = size
 		self.keys = collections.defaultdict(lambda: False)
 		self.midi = midi_handler
@@ -35,11 +83,14 @@ class Scene:
 		self._logger = logging.getLogger(__name__)
 		self._deferred_calls = queue.Queue()
 		self._next_free_texture = 1
-		self.controller = controller.Controller(self, self.midi, 'controls.json', 'channels.txt')
+		# Given control values (e.g. from a replay) are used instead of, and don't overwrite, the saved ones
+		self.controller = controller.Controller(self, self.midi, 'controls.json' if controls is None else None, 'channels.txt')
 		self.midi.set_controller(self.controller)
 
 		self.set_stereoscopy(STEREOSCOPY_OFF)
 		self.stereoscopy_eye_separation = .5
+		self._face_colors_key = None
+		self._note_frame_time = 0.
 
 		if debug_camera:
 			self.camera = camera.SphericalCamera(
@@ -59,14 +110,26 @@ class Scene:
 			)
 		self.fov_y = math.tau / 8
 
+		# Stereo shaders have a second output for dual source blending, which every program drawing the scene binds
+		if not (gfx.has_version(3, 3) or gfx.has_extension('GL_ARB_blend_func_extended')):
+			raise gfx.FeatureNotAvailable("Dual source blending (OpenGL 3.3 or GL_ARB_blend_func_extended)")
+
+		self.transforms = transform.TransformState()
+		self.camera_block = gfx.UniformBuffer(transform.CAMERA_BINDING, transform.CAMERA_BLOCK_FLOATS * 4)
+		self._camera_block_version = None
+
+		stereo_state = _StereoState(self.transforms)
+		self.render_queue = renderqueue.RenderQueue()
+		self.render_queue.add_pass(renderqueue.PASS_BACKGROUND, state=stereo_state)
+		for pass_ in (renderqueue.PASS_BEHIND, renderqueue.PASS_INSIDE, renderqueue.PASS_IN_FRONT):
+			self.render_queue.add_pass(pass_, translucent=True, state=stereo_state)
+		self.render_queue.add_pass(renderqueue.PASS_OVERLAY, translucent=True)
+
 		GL.glClearColor(.1, 0, .1, 1)
 		GL.glBlendFunc(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA)
 		GL.glEnable(GL.GL_BLEND)
 		GL.glEnable(GL.GL_TEXTURE_CUBE_MAP_SEAMLESS)
 
-		GL.glEnable(GL.GL_LINE_SMOOTH)
-		GL.glLineWidth(shape.WIREFRAME_LINE_WIDTH)
-
 		try:
 			skybox_texture = self.load_texture('texture/skybox.png', cls=texture.CubeMap)
 		except FileNotFoundError:
@@ -74,102 +137,73 @@ class Scene:
 
 		self.skybox = skybox.SkyBox(self, params.DEPTH.MAX / 4, skybox_texture)
 
-		self.shapes = [shape(self) for shape in params.SHAPES]
-		self.balls = ball.Balls(self, list(map(self.load_texture, glob.glob('texture/ball*.png'))))
+		ball_texture = self.create_texture(texture.Texture2DArray)
+		ball_texture.load_images(sorted(glob.glob('texture/ball*.png')))
+		self.simulation = simulation.Simulation(ball_textures=ball_texture.layers, seed=seed)
 
-		self.max_symmetries = max([max(shape.symmetries.keys()) for shape in self.shapes])
-		self._symmetry_map = [None] * self.max_symmetries
+		self.shapes = { s: shape.Shape(self, s) for s in self.simulation.shapes }
+		self.balls = ball.Balls(self, self.simulation.balls, ball_texture)
 
 		self.hud = hud.Hud(self, (0, 0, size[0], size[1]))
 
-		self.controller.controls['shape'].on_change(lambda _, index: self.defer(self._set_shape, index))
+		sim_balls = self.simulation.balls
+		self.controller.controls['ball_radius'].on_change(lambda _, radius: self.defer(sim_balls.set_ball_radius, radius))
+		self.controller.controls['ball_speed'].on_change(lambda _, speed: self.defer(sim_balls.set_ball_speed, speed))
+		self.controller.controls['ball_count'].on_change(lambda _, count: self.defer(sim_balls.set_ball_count, count))
+		self.controller.controls['ball_collisions'].on_change(lambda _, enabled: self.defer(sim_balls.set_ball_collisions, enabled))
+		self.controller.controls['shape'].on_change(lambda _, index: self.defer(self.simulation.set_shape, index))
 
-		self.controller.initialize_controls()
+		self.controller.initialize_controls(controls)
 
 		now = time.monotonic()
 		self.last_update_time = now
 
-	def _set_shape(self, index):
-		shape = self.shapes[index]
-		default_symmetry = next(iter(shape.symmetries.keys()))
-		self._set_shape_and_symmetry(shape, default_symmetry)
-
-	def _set_shape_and_symmetry(self, shape, symmetry):
-		self.active_shape = shape
-		self.active_symmetry = symmetry
-
-		self._logger.debug("Changing shape to %s (%d)", self.active_shape.name, self.active_symmetry)
-
-		sym_map = self.active_shape.symmetries[self.active_symmetry]
-		self._symmetry_id_count = len(sym_map)
-		self._symmetry_ids = { face_index: i for i, faces in enumerate(sym_map) for face_index in faces }
-
-		self.face_queue = [[self.active_shape.faces[fi] for fi in sym] for sym in sym_map]
-		self._reset_faces()
-
-	def set_next_symmetry(self, delta=+1):
-		symmetries = list(self.active_shape.symmetries.keys())
-		cur_sym_index = symmetries.index(self.active_symmetry)
-		next_symmetry = symmetries[(cur_sym_index + delta) % len(symmetries)]
-		self._set_shape_and_symmetry(self.active_shape, next_symmetry)
-
-	def get_next_faces_and_rotate(self):
-		faces = self.face_queue.pop(0)
-		self.face_queue.append(faces)
-		self._next_faces_index = 0
-		return faces
-
-	def get_next_faces(self):
-		faces = self.face_queue[self._next_faces_index]
-		self._next_faces_index = (self._next_faces_index + 1) % len(self.face_queue)
-		return faces
-
-	def shuffle_faces(self):
-		active_map, inactive_map = self._symmetry_map[0:self._symmetry_id_count], self._symmetry_map[self._symmetry_id_count:]
-		random.shuffle(active_map)
-		self._symmetry_map = active_map + inactive_map
-		self._reset_faces()
-
-	def _reset_faces(self):
-		random.shuffle(self.face_queue)
-		self._next_faces_index = 0
-		self._update_face_colors()
-
 	def _update_face_colors(self):
-		for face in self.active_shape.faces:
-			if self.get_face_mapping(face) is None:
-				face.set_wire_color(self.color_palette.get_default_wire_color())
-				face.set_face_colors(*self.color_palette.get_default_face_colors())
+		# Faces only change colors when their mappings or the palette do
+		key = (self.color_palette, self.simulation.active_shape, self.simulation.mapping_version)
+		if key == self._face_colors_key:
+			return
+		self._face_colors_key = key
+
+		for face in self.simulation.active_shape.faces:
+			mapping = self.simulation.get_face_mapping(face)
+			if mapping is None:
+				face.set_wire_color(None)
+				face.set_face_colors(None, None)
 			else:
-				note = self.get_face_mapping(face)[1]
+				note = mapping[1]
 				face.set_wire_color(self.color_palette.get_wire_color_for_note(note))
 				face.set_face_colors(*self.color_palette.get_face_colors_for_note(note))
 
-	def get_face_mapping(self, face):
-		if face.index in self._symmetry_ids:
-			symmetry_id = self._symmetry_ids[face.index]
-			return self._symmetry_map[symmetry_id]
-
-		return None
-
-	def set_face_mapping(self, face, mapping):
-		self._symmetry_map[self._symmetry_ids[face.index]] = mapping
+	def get_active_shape(self):
+		return self.shapes[self.simulation.active_shape]
 
 	def set_stereoscopy(self, mode):
-		if mode == STEREOSCOPY_OFF:
-			self.color_palette = colorpalette.Shifting()
-		elif mode == STEREOSCOPY_ANAGLYPH:
+		if mode not in STEREOSCOPY_EYES:
+			raise ValueError("Invalid stereoscopy mode \"%s\"" % (mode,))
+
+		if mode == STEREOSCOPY_ANAGLYPH:
 			self.color_palette = colorpalette.Anaglyph()
 		else:
-			raise ValueError("Invalid stereoscopy mode \"%s\"" % (mode,))
+			self.color_palette = colorpalette.Shifting()
 
 		self.stereoscopy = mode
 
-	def update(self):
-		now = time.monotonic()
-		dt = now - self.last_update_time
+	def update(self, dt=None):
+		# A frame spans this update and the render after it, and its stats cover both
+		gfx.frames.begin_frame()
+		update_start = time.monotonic()
+
+		# Without a dt the scene follows the wall clock; replays drive it with recorded frame times instead
+		if dt is None:
+			dt = time.monotonic() - self.last_update_time
+		now = self.last_update_time + dt
 		self.last_update_time = now
 
+		# Input is handled at the start of the frame on the scene clock, so that replays handle it identically
+		self.controller.update(now)
+		self.midi.process_input(now)
+
 		while True:
 			try:
 				item = self._deferred_calls.get_nowait()
@@ -177,12 +211,12 @@ class Scene:
 			except queue.Empty:
 				break
 
-		self.controller.update(dt)
-
 		self.camera.update(dt)
 
-		self.view = self.camera.get_view_matrix()
-		self.projection = mp.perspectiveM(self.fov_y, self.size[0] / self.size[1], params.DEPTH.MIN, params.DEPTH.MAX)
+		self.transforms.set_camera(self.camera)
+		self.transforms.set_projection(self.fov_y, self.size[0] / self.size[1], params.DEPTH.MIN, params.DEPTH.MAX)
+		self.transforms.set_eye_separation(self.stereoscopy_eye_separation)
+		self.transforms.set_eyes(STEREOSCOPY_EYES[self.stereoscopy])
 
 		self.skybox.update(dt)
 
@@ -190,8 +224,23 @@ class Scene:
 		self._update_face_colors()
 		self.hud.set_colors(self.color_palette.get_hud_colors())
 
+		self.simulation.update(dt)
+
+		# Simulation time lags behind wall time by the part of the frame that hasn't been simulated yet
+		sim_now = self.simulation.get_time()
+		step_dt = 1. / self.simulation.balls.physics_rate
+		# Notes are also only scheduled once the update has got this far
+		frame_time = min(dt, params.PHYSICS_MAX_STEPS * step_dt) + (time.monotonic() - update_start)
+		self._note_frame_time = max(frame_time, self._note_frame_time + (frame_time - self._note_frame_time) * params.NOTE_LATENCY_DECAY)
+		# Long enough for this frame's earliest collision to still be ahead; see params.NOTE_LATENCY_DECAY
+		note_latency = self._note_frame_time + step_dt
+		for event in self.simulation.pop_events():
+			play_time = now - (sim_now - event.time) + note_latency
+			for mapping in event.mappings:
+				self.midi.schedule_note(play_time, *mapping)
+
+		self.get_active_shape().update(dt)
 		self.balls.update(dt)
-		self.active_shape.update(dt)
 
 		self.hud.update(dt)
 
@@ -205,84 +254,50 @@ class Scene:
 	def render(self):
 		GL.glClear(GL.GL_COLOR_BUFFER_BIT)
 
-		self.skybox.pre_render(self.projection, self.view)
-		self.skybox.render()
-
-		drawables = list(it.chain(self.active_shape.faces, self.balls.enabled_balls()))
-
-		def _drawable_sort_key(drawable):
-			if isinstance(drawable, shape.Face):
-				if mp.dot(drawable.normal, drawable.midpoint - self.camera.get_pos()) <= 0:
-					return -2 * params.DEPTH.MAX
-				else:
-					return +2 * params.DEPTH.MAX
-			return drawable.get_distance_to(self.camera.get_pos())
-
-		if self.stereoscopy == STEREOSCOPY_OFF:
-			self.balls.pre_render(self.projection, self.view)
-			self.active_shape.pre_render(self.projection, self.view)
+		# Every eye is drawn by the same draw calls, which are instanced once per eye
+		self._set_camera_block()
 
-			GL.glColorMaski(0, 1, 1, 1, 1)
+		self.skybox.render(self.render_queue)
+		self.get_active_shape().render(self.render_queue)
+		self.balls.render(self.render_queue)
+		self.hud.render(self.render_queue)
 
-			for drawable in sorted(drawables, key=_drawable_sort_key, reverse=True):
-				drawable.render()
+		self.render_queue.flush()
+		gfx.frames.end_frame()
 
-		elif self.stereoscopy == STEREOSCOPY_ANAGLYPH:
-			lview = mp.translateM([-self.stereoscopy_eye_separation / 2, 0, 0]) @ self.view
-			self.balls.pre_render(self.projection, lview)
-			self.active_shape.pre_render(self.projection, lview)
-
-			GL.glColorMaski(0, 0, 1, 1, 1)
-
-			for drawable in sorted(drawables, key=_drawable_sort_key, reverse=True):
-				drawable.render()
-
-			rview = mp.translateM([+self.stereoscopy_eye_separation / 2, 0, 0]) @ self.view
-
-			self.balls.pre_render(self.projection, rview)
-			self.active_shape.pre_render(self.projection, rview)
-
-			GL.glColorMaski(0, 1, 0, 0, 1)
-
-			for drawable in sorted(drawables, key=_drawable_sort_key, reverse=True):
-				drawable.render()
-
-			GL.glColorMaski(0, 1, 1, 1, 1)
-
-		self.hud.pre_render(self.projection, self.view)
-		self.hud.render()
+	def _set_camera_block(self):
+		# One buffer update serves every program reading the Camera block
+		data, version = self.transforms.get_camera_block()
+		if version != self._camera_block_version:
+			self._camera_block_version = version
+			self.camera_block.update(data)
 
 	def shutdown(self):
 		self.controller.shutdown()
+		self.simulation.shutdown()
 
 	def key_down(self, key):
 		if key == 'h':
 			self.hud.enabled = not self.hud.enabled
+		if key == 'b':
+			self.controller.handle_event('toggle_ball_collisions', None)
 		if key == 'x':
-			if self.stereoscopy == STEREOSCOPY_OFF:
-				self.set_stereoscopy(STEREOSCOPY_ANAGLYPH)
-			elif self.stereoscopy == STEREOSCOPY_ANAGLYPH:
-				self.set_stereoscopy(STEREOSCOPY_OFF)
+			next_mode = (STEREOSCOPY_MODES.index(self.stereoscopy) + 1) % len(STEREOSCOPY_MODES)
+			self.set_stereoscopy(STEREOSCOPY_MODES[next_mode])
 		self.keys[key] = True
 
 	def key_up(self, key):
 		self.keys[key] = False
 
 	def mouse_down(self, button, pos):
-		unp_n, unp_f = mp.unproject(pos, self.view, self.projection)
-		tri, time, pos = self.pick_triangle(unp_n, unp_f - unp_n)
+		unp_n, unp_f = mp.unproject(pos, self.transforms.view, self.transforms.projection)
+		tri, time, pos = self.simulation.pick_triangle(unp_n, unp_f - unp_n)
 		if tri is not None:
 			self._logger.debug("Picked face %d with button %d", tri.face.index, button)
 
 	def mouse_up(self, button, pos):
 		pass
 
-	def ball_face_collision(self, ball, face, pos):
-		mapping = self.get_face_mapping(face)
-		if mapping is not None:
-			self.midi.play_note(*mapping)
-			face.highlight(0)
-
 	def create_texture(self, cls=texture.Texture2D, **kwargs):
 		tex = cls(self._next_free_texture, **kwargs)
 		self._next_free_texture += 1
@@ -293,45 +308,5 @@ class Scene:
 		tex.load_image(filename)
 		return tex
 
-	def pick_triangle(self, start, forward, ray_radius=0, maxtime=None, blacklist=None):
-		# Vectorized bit basically doing mp.intersect_plane_sphere on all triangles
-		triangles = [t for f in self.active_shape.faces for t in f.triangles]
-		normals = np.array([t.normal for t in triangles])
-		vert0 = np.array([t.vertices[0] for t in triangles])
-		velproj = np.dot(normals, forward)
-		negs = np.repeat(((velproj > 0).astype(np.float32) * 2 - 1), 3).reshape(normals.shape[0], 3)
-		closest = start + (normals * negs) * ray_radius
-		distproj = np.sum(normals * (closest - vert0), axis=1)
-		intersection_times = distproj / -velproj
-		intersection_points = closest + np.outer(intersection_times, forward)
-
-		intersections = []
-		for t, intersection_time, intersection_point in zip(triangles, intersection_times, intersection_points):
-			if blacklist is not None and t in blacklist:
-				continue
-
-			if math.isinf(intersection_time) or math.isnan(intersection_time) or intersection_time < 0:
-				continue
-
-			if maxtime is not None and intersection_time > maxtime:
-				continue
-
-			if mp.dot(intersection_point - t.vertices[0], mp.cross(t.vertices[1] - t.vertices[0], t.normal)) > 0:
-				continue
-
-			if mp.dot(intersection_point - t.vertices[1], mp.cross(t.vertices[2] - t.vertices[1], t.normal)) > 0:
-				continue
-
-			if mp.dot(intersection_point - t.vertices[2], mp.cross(t.vertices[0] - t.vertices[2], t.normal)) > 0:
-				continue
-
-			intersections.append((t, intersection_time, intersection_point))
-
-		if len(intersections) == 0:
-			return (None, None, None)
-
-		first = sorted(intersections, key=lambda i: i[1])[0]
-		return (first[0], first[1], first[2])
-
 	def defer(self, func, *args, **kwargs):
 		self._deferred_calls.put_nowait((func, args, kwargs))
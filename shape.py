@@ -1,56 +1,85 @@
+import numpy as np
+from OpenGL import GL
+
+import geometry
 import gfx
 import mp
-import objreader
+import renderqueue
+import texture
+import transform
 
-HIGHLIGHT_FALLOFF_TIME = .5
 WIREFRAME_LINE_WIDTH = 2.
+# A ball lights up faces up to this many radii away from its surface
+BALL_LIGHT_RADIUS = 4.
 
-SHAPE_VS = """
-#version 130
+# Vertex attributes, in the order of the columns of the vertex buffer
+SHAPE_ATTRIBUTES = ('position', 'texUV', 'bary', 'wires', 'face')
+SHAPE_ATTRIBUTE_SIZES = (3, 2, 3, 3, 1)
 
-uniform mat4 u_view;
-uniform mat4 u_projection;
+# Rows of per-face data: normal color, highlighted color, wire color, then (highlight end time, whether the wire color
+# and the face colors are the palette's defaults, unused). They're only uploaded when a face changes.
+FACE_DATA_ROWS = 4
 
+SHAPE_VS = """
+#version 140
+""" + transform.CAMERA_BLOCK + transform.STEREO_VS + """
 in vec3 position;
-in vec3 bary;
 in vec2 texUV;
-in vec3 normal;
+in vec3 bary;
 in vec3 wires;
+in float face;
 
 out vec3 vf_position;
 out vec2 vf_texUV;
+out vec3 vf_bary;
+flat out vec3 vf_wires;
+flat out int vf_face;
 
 void main() {
-	gl_Position = u_projection * u_view * vec4(position, 1);
+	gl_Position = eye_position(u_view * vec4(position, 1), eye_index(gl_InstanceID));
 	vf_position = position;
 	vf_texUV = texUV;
+	vf_bary = bary;
+	vf_wires = wires;
+	vf_face = int(face);
 }
 """
 
 SHAPE_FS = """
-#version 130
+#version 140
+""" + transform.STEREO_FS + """
+#define WIRE_HALF_WIDTH """ + str(WIREFRAME_LINE_WIDTH / 2) + """
+#define BALL_LIGHT_RADIUS """ + str(BALL_LIGHT_RADIUS) + """
+
+#define FACE_DATA_ROWS """ + str(FACE_DATA_ROWS) + """
+#define HIGHLIGHT_FALLOFF_TIME """ + str(geometry.HIGHLIGHT_FALLOFF_TIME) + """
 
-#define MAX_BALLS 16
+// Center and visible radius of the balls near each face, grouped by face, and each face's range of them
+uniform samplerBuffer t_balls;
+uniform samplerBuffer t_ballRanges;
+uniform samplerBuffer t_faces;
 
-uniform vec4 u_balls[MAX_BALLS];
+// Shape time, and the palette's default colors
+uniform float u_time;
+uniform vec4 u_wireColor;
 uniform vec4 u_faceColorNormal;
 uniform vec4 u_faceColorHighlighted;
-uniform float u_faceHighlight;
 
 in vec3 vf_position;
 in vec2 vf_texUV;
+in vec3 vf_bary;
+flat in vec3 vf_wires;
+flat in int vf_face;
 
-out vec4 fragColor;
-
-float ball_highlight_factor() {
+float ball_highlight_factor(int first, int count) {
 	float maxHighlight = -1. / 0.;
 
-	for (int i = 0; i < MAX_BALLS; i++) {
-		float radius = u_balls[i].w;
-		if (radius == 0.0) continue;
+	for (int i = first; i < first + count; i++) {
+		vec4 ball = texelFetch(t_balls, i);
+		float radius = ball.w;
 
-		float dist = max(distance(vf_position, u_balls[i].xyz) - radius, 0.);
-		float light_radius = radius * 4;
+		float dist = max(distance(vf_position, ball.xyz) - radius, 0.);
+		float light_radius = radius * BALL_LIGHT_RADIUS;
 
 		// f(lr)=0, f(0)=1
 		float hf = (-1 / light_radius) * (dist - light_radius);
@@ -62,142 +91,135 @@ float ball_highlight_factor() {
 	return clamp(maxHighlight, 0, 1);
 }
 
-void main() {
-	vec4 faceColor = mix(u_faceColorNormal, u_faceColorHighlighted, u_faceHighlight);
-	vec4 ball_highlight = vec4(1, 1, 1, ball_highlight_factor());
-
-	fragColor = mix(faceColor, ball_highlight, ball_highlight.a);
+float wire_coverage() {
+	// Distance in pixels to the nearest triangle edge that is also an edge of the face. Each face draws the inner half
+	// of its wires, its neighbors draw the other half.
+	vec3 dist = (vf_bary + (1 - vf_wires)) / max(fwidth(vf_bary), 1e-6);
+	float d = min(min(dist.x, dist.y), dist.z);
+	return 1 - smoothstep(WIRE_HALF_WIDTH - .5, WIRE_HALF_WIDTH + .5, d);
 }
-"""
-
-WIRE_FS = """
-#version 130
-
-uniform vec4 u_wireColor;
-
-out vec4 fragColor;
 
 void main() {
-	fragColor = u_wireColor;
+	int row = vf_face * FACE_DATA_ROWS;
+	vec4 faceParams = texelFetch(t_faces, row + 3);
+	vec4 faceColorNormal = mix(texelFetch(t_faces, row), u_faceColorNormal, faceParams.z);
+	vec4 faceColorHighlighted = mix(texelFetch(t_faces, row + 1), u_faceColorHighlighted, faceParams.z);
+	vec4 wireColor = mix(texelFetch(t_faces, row + 2), u_wireColor, faceParams.y);
+
+	float highlight = clamp((faceParams.x - u_time) / HIGHLIGHT_FALLOFF_TIME, 0, 1);
+	vec4 faceColor = mix(faceColorNormal, faceColorHighlighted, highlight);
+	vec2 ballRange = texelFetch(t_ballRanges, vf_face).xy;
+	vec4 ball_highlight = vec4(1, 1, 1, ball_highlight_factor(int(ballRange.x), int(ballRange.y)));
+	faceColor = mix(faceColor, ball_highlight, ball_highlight.a);
+
+	// The wire goes over the face
+	float wireAlpha = wireColor.a * wire_coverage();
+	float alpha = wireAlpha + faceColor.a * (1 - wireAlpha);
+	vec3 color = wireColor.rgb * wireAlpha + faceColor.rgb * faceColor.a * (1 - wireAlpha);
+	set_color(vec4(color / max(alpha, 1e-6), alpha));
 }
 """
 
 class Shape:
-	def __init__(self, scene, name, radius):
+	def __init__(self, scene, shape):
 		self.scene = scene
-		self.name = name
-		self.radius = radius
+		self.shape = shape
 
-		self.faces = []
-		self.symmetries = {}
-		self.program = gfx.Program(SHAPE_VS, SHAPE_FS)
-		self.wire_program = gfx.Program(SHAPE_VS, WIRE_FS)
+		self.program = gfx.Program(SHAPE_VS, SHAPE_FS, SHAPE_ATTRIBUTES, transform.STEREO_OUTPUTS)
+		self.program.bind_uniform_block('Camera', transform.CAMERA_BINDING)
 
-	def load_file(self, filename, default_symmetry=True):
-		with open(filename, 'r') as f:
-			vertices, texcoords, normals = objreader.read_obj_map(f, vec_cls=mp.array)
+		# Every triangle of every face has its own three vertices in one buffer, so that each can carry its barycentric
+		# coordinates and which of its edges are wires. The rest of what a face looks like is looked up by its index in the
+		# face data buffer.
+		vertices = []
+		for i, f in enumerate(self.shape.faces):
+			for t in f.triangles:
+				for k, bary in enumerate(np.eye(3)):
+					vertices.append(np.concatenate([t.vertices[k], t.texcoords[k][:2], bary, t.wires, [i]]))
 
-		bsrad = max(map(lambda fvs: max(map(mp.norm, fvs)), vertices))
+		self.vao = gfx.VAO()
+		with self.vao:
+			self.vao.set_interleaved_vbo(gfx.VBO.create_with_data(vertices, dtype=np.float32), SHAPE_ATTRIBUTE_SIZES)
 
-		for i, vf in enumerate(vertices):
-			tf, nf = texcoords[i], normals[i]
-			vf_scaled = list(map(lambda v: v / bsrad * self.radius, vf))
-			face = Face(self, i, vf_scaled, tf, nf)
-			self.faces.append(face)
+		self.face_normals = mp.array([f.normal for f in self.shape.faces])
+		self.face_midpoints = mp.array([f.midpoint for f in self.shape.faces])
+		self.face_radii = mp.array([max(mp.norm(v - f.midpoint) for v in f.vertices) for f in self.shape.faces])
 
-		if default_symmetry:
-			self.symmetries[len(self.faces)] = [(f.index,) for f in self.faces]
+		# Room for every ball near every face; both are rewritten every frame
+		self.ball_data = self.scene.create_texture(texture.StreamTextureBuffer, rows=len(self.shape.faces) * len(self.scene.simulation.balls.balls))
+		self.ball_range_data = self.scene.create_texture(texture.StreamTextureBuffer, rows=len(self.shape.faces), internal_format=GL.GL_RG32F, columns=2)
 
-	def update(self, dt):
-		with self.program:
-			balls = [[b.pos[0], b.pos[1], b.pos[2], b.radius * b.opacity if b.enabled else 0.] for b in self.scene.balls.balls]
-			self.program.set_uniform('u_balls', balls)
-
-		for f in self.faces:
-			f.update(dt)
+		self._faces = np.zeros((len(self.shape.faces), FACE_DATA_ROWS, 4), dtype=np.float32)
+		self.face_data = self.scene.create_texture(texture.TextureBuffer)
+		self.face_data.load_array(self._faces.reshape(-1, 4))
+		self._face_data_version = None
 
-	def pre_render(self, projection, view):
 		with self.program:
-			self.program.set_uniform('u_view', view)
-			self.program.set_uniform('u_projection', projection)
-
-		with self.wire_program:
-			self.wire_program.set_uniform('u_view', view)
-			self.wire_program.set_uniform('u_projection', projection)
-
-class Face:
-	def __init__(self, shape, index, vertices, texcoords, normals):
-		self.shape = shape
-		self.index = index
-
-		self.triangles = []
-		self.midpoint = sum(vertices) / len(vertices)
-		self.normal = mp.triangle_normal(vertices[0:3])
-		self.wire_color = mp.array([1, 1, 1, 1])
-		self.face_color_normal = mp.array([1, 1, 1, .1])
-		self.face_color_highlighted = mp.array([1, 1, 1, 1])
-		self.highlight_time = 0.
-
-		self.wire_vao = gfx.VAO()
-		with self.wire_vao:
-			self.wire_vao.create_vbo_attrib(0, vertices)
-
-		for i in range(1, len(vertices)-1):
-			i0, i1, i2 = 0, i, i+1
-			_triplet = lambda arr: [arr[i0], arr[i1], arr[i2]]
-			triangle = Triangle(self, _triplet(vertices), _triplet(texcoords), _triplet(normals), [True, i2==len(vertices)-1, i==1])
-			self.triangles.append(triangle)
-
-	def set_wire_color(self, color):
-		self.wire_color = color
-
-	def set_face_colors(self, normal_color, highlighted_color):
-		self.face_color_normal = normal_color
-		self.face_color_highlighted = highlighted_color
-
-	def highlight(self, highlight_time, force=False):
-		highlight_time = float(highlight_time) + HIGHLIGHT_FALLOFF_TIME
-		if force:
-			self.highlight_time = highlight_time
-		else:
-			self.highlight_time = max(self.highlight_time, highlight_time)
+			self.program.set_uniform('t_balls', self.ball_data.number)
+			self.program.set_uniform('t_ballRanges', self.ball_range_data.number)
+			self.program.set_uniform('t_faces', self.face_data.number)
 
 	def update(self, dt):
-		self.highlight_time -= dt
-		self.face_highlight = mp.clamp(self.highlight_time / HIGHLIGHT_FALLOFF_TIME, 0., 1.)
-
-	def render(self):
-		with self.shape.program:
-			self.shape.program.set_uniform('u_faceColorNormal', self.face_color_normal)
-			self.shape.program.set_uniform('u_faceColorHighlighted', self.face_color_highlighted)
-			self.shape.program.set_uniform('u_faceHighlight', self.face_highlight)
-			for t in self.triangles:
-				t.render()
-
-		with self.shape.wire_program:
-			self.shape.wire_program.set_uniform('u_wireColor', self.wire_color)
-			self.wire_vao.draw_line_loop()
-
-	def __repr__(self):
-		return "<Face %d>" % (self.index,)
-
-class Triangle:
-	def __init__(self, face, vertices, texcoords=None, normals=None, wires=None):
-		if texcoords is None: texcoords = [[0, 0], [0, 1], [1, 0]]
-		if normals is None: normals = [[0, 0, 0], [0, 0, 0], [0, 0, 0]]
-		if wires is None: wires = [True, True, True]
-
-		self.face = face
-		self.vertices = vertices
-		self.texcoords = texcoords
-		self.normals = normals
-		self.wires = wires
-		self.normal = mp.triangle_normal(self.vertices)
-
-		self.vao = gfx.VAO()
-		with self.vao:
-			self.vao.create_vbo_attrib(0, self.vertices)
-			self.vao.create_vbo_attrib(1, self.texcoords)
-
-	def render(self):
-		self.vao.draw_triangles()
+		# Each face only gets the balls close enough to light it up
+		balls = self.scene.simulation.balls
+		enabled = np.flatnonzero(balls.enabled)
+		centers = balls.render_pos[enabled]
+		radii = balls.radius[enabled] * balls.opacity[enabled]
+
+		near = get_nearby_balls(self.face_normals, self.face_midpoints, self.face_radii, centers, radii)
+		face_indices, ball_indices = np.nonzero(near)
+		rows = len(ball_indices)
+		ball_data = self.ball_data.begin()
+		ball_data[:rows, 0:3] = centers[ball_indices]
+		ball_data[:rows, 3] = radii[ball_indices]
+		self.ball_data.end()
+
+		counts = np.bincount(face_indices, minlength=len(self.shape.faces))
+		ball_ranges = self.ball_range_data.begin()
+		ball_ranges[:, 0] = np.cumsum(counts) - counts
+		ball_ranges[:, 1] = counts
+		self.ball_range_data.end()
+
+		if self.shape.version != self._face_data_version:
+			self._face_data_version = self.shape.version
+			for i, f in enumerate(self.shape.faces):
+				self._faces[i, 0, :] = f.face_color_normal if f.face_color_normal is not None else 0
+				self._faces[i, 1, :] = f.face_color_highlighted if f.face_color_highlighted is not None else 0
+				self._faces[i, 2, :] = f.wire_color if f.wire_color is not None else 0
+				self._faces[i, 3, 0:3] = (f.highlight_until, f.wire_color is None, f.face_color_normal is None)
+			self.face_data.update(self._faces.reshape(-1, 4))
+
+		palette = self.scene.color_palette
+		face_color_normal, face_color_highlighted = palette.get_default_face_colors()
+		with self.program:
+			self.program.set_uniform('u_time', self.shape.time)
+			self.program.set_uniform('u_wireColor', palette.get_default_wire_color())
+			self.program.set_uniform('u_faceColorNormal', face_color_normal)
+			self.program.set_uniform('u_faceColorHighlighted', face_color_highlighted)
+
+	def render(self, queue):
+		# Faces seen from behind, which with a convex shape are all behind anything inside it, then faces seen from the
+		# front
+		depth = mp.norm(self.scene.camera.get_pos())
+		queue.submit(renderqueue.PASS_BEHIND, self.program, self._draw_back_faces, depth=depth)
+		queue.submit(renderqueue.PASS_IN_FRONT, self.program, self._draw_front_faces, depth=depth)
+
+	def _draw_back_faces(self):
+		self._draw_culled(GL.GL_FRONT)
+
+	def _draw_front_faces(self):
+		self._draw_culled(GL.GL_BACK)
+
+	def _draw_culled(self, cull_face):
+		GL.glEnable(GL.GL_CULL_FACE)
+		GL.glCullFace(cull_face)
+		self.vao.draw_triangles(instances=len(self.scene.transforms.eyes))
+		GL.glDisable(GL.GL_CULL_FACE)
+
+def get_nearby_balls(normals, midpoints, face_radii, centers, radii):
+	# (faces, balls) mask of the balls whose light reaches each face, going by the face plane and bounding sphere
+	reach = (BALL_LIGHT_RADIUS + 1) * radii
+	offsets = centers[np.newaxis, :, :] - midpoints[:, np.newaxis, :]
+	plane_distances = np.abs(np.einsum('fj,fbj->fb', normals, offsets))
+	distances = np.linalg.norm(offsets, axis=-1)
+	return (plane_distances < reach) & (distances < face_radii[:, np.newaxis] + reach) & (radii > 0)
@@ -1,9 +1,9 @@
+import geometry
 import params
-import shape
 
-def _autoloading_shape(filename, name=None, symmetries={}, default_symmetry=True):
-	def _shape_constructor(scene):
-		s = shape.Shape(scene, name, params.SHAPE_SCALE)
+def _autoloading_shape(filename, name=None, symmetries={}, default_symmetry=True, convex=False):
+	def _shape_constructor():
+		s = geometry.Shape(name, params.SHAPE_SCALE, convex=convex)
 		s.load_file(filename, default_symmetry=default_symmetry)
 		for k, v in symmetries.items():
 			s.symmetries[k] = v
@@ -13,26 +13,26 @@ def _autoloading_shape(filename, name=None, symmetries={}, default_symmetry=True
 _hexahedron_symmetries = {
 	3: [(0, 4), (1, 5), (2, 3)],
 }
-Hexahedron = _autoloading_shape('obj/hexahedron.obj', "Hexahedron", _hexahedron_symmetries)
+Hexahedron = _autoloading_shape('obj/hexahedron.obj', "Hexahedron", _hexahedron_symmetries, convex=True)
 
 _octohedron_symmetries = {
 	4: [(0, 5), (1, 6), (2, 7), (3, 4)],
 }
-Octohedron = _autoloading_shape('obj/octohedron.obj', "Octohedron", _octohedron_symmetries)
+Octohedron = _autoloading_shape('obj/octohedron.obj', "Octohedron", _octohedron_symmetries, convex=True)
 
 _dodecahedron_symmetries = {
 	6: [(0, 4), (1, 5), (2, 11), (3, 7), (6, 10), (8, 9)],
 	4: [(0, 1, 2), (3, 10, 11), (4, 7, 9), (5, 6, 8)],
 }
-Dodecahedron = _autoloading_shape('obj/dodecahedron.obj', "Dodecahedron", _dodecahedron_symmetries)
+Dodecahedron = _autoloading_shape('obj/dodecahedron.obj', "Dodecahedron", _dodecahedron_symmetries, convex=True)
 
 _icosahedron_symmetries = {
 	10: [(0, 16), (1, 17), (2, 18), (3, 19), (4, 15), (5, 14), (6, 10), (7, 11), (8, 12), (9, 13)],
 	5: [(0, 7, 8, 19), (1, 9, 14, 15), (2, 10, 11, 16), (3, 12, 13, 17), (4, 5, 6, 18)],
 }
-Icosahedron = _autoloading_shape('obj/icosahedron.obj', "Icosahedron", _icosahedron_symmetries)
+Icosahedron = _autoloading_shape('obj/icosahedron.obj', "Icosahedron", _icosahedron_symmetries, convex=True)
 
 _hexagon_prism_symmetries = {
 	6: [(0,), (1,), (2,), (3,), (4,), (5,)],
 }
-HexagonPrism = _autoloading_shape('obj/hexagon_prism.obj', "Hexagon Prism", _hexagon_prism_symmetries, default_symmetry=False)
+HexagonPrism = _autoloading_shape('obj/hexagon_prism.obj', "Hexagon Prism", _hexagon_prism_symmetries, default_symmetry=False, convex=True)
@@ -0,0 +1,465 @@
+import collections
+import logging
+import math
+import random
+
+import numpy as np
+
+import mp
+import params
+import physics
+import physicspool
+
+FaceCollisionEvent = collections.namedtuple('FaceCollisionEvent', ['time', 'ball', 'face', 'pos', 'mappings'])
+BallCollisionEvent = collections.namedtuple('BallCollisionEvent', ['time', 'ball0', 'ball1', 'pos', 'mappings'])
+
+# A planned bounce off of collider triangle/face `index` at absolute simulation time `time`; pos and dir are the ball's
+# center and direction right after it
+Bounce = collections.namedtuple('Bounce', ['time', 'face', 'index', 'point', 'pos', 'dir'])
+
+class Simulation:
+	def __init__(self, ball_textures=1, seed=None, ball_capacity=params.BALLS.MAX):
+		self._logger = logging.getLogger(__name__)
+
+		# All randomness goes through these so that a run can be reproduced from its seed
+		self.seed = seed if seed is not None else random.SystemRandom().randrange(2 ** 32)
+		self.random = random.Random(self.seed)
+		self.rng = np.random.default_rng(self.seed)
+
+		self.shapes = [shape() for shape in params.SHAPES]
+		# Capacity can exceed what the ball count control goes up to, for runs that set the count directly
+		self.balls = Balls(self, ball_textures, ball_capacity)
+		self.events = []
+
+		self.max_symmetries = max([max(shape.symmetries.keys()) for shape in self.shapes])
+		self._symmetry_map = [None] * self.max_symmetries
+		# Moves whenever the mapping of any face of the active shape might have changed
+		self.mapping_version = 0
+
+		self.set_shape(params.SHAPES.DEFAULT)
+
+	def set_shape(self, index):
+		shape = self.shapes[index]
+		default_symmetry = next(iter(shape.symmetries.keys()))
+		self.set_shape_and_symmetry(shape, default_symmetry)
+
+	def set_shape_and_symmetry(self, shape, symmetry):
+		self.active_shape = shape
+		self.active_symmetry = symmetry
+
+		self._logger.debug("Changing shape to %s (%d)", self.active_shape.name, self.active_symmetry)
+
+		sym_map = self.active_shape.symmetries[self.active_symmetry]
+		self._symmetry_id_count = len(sym_map)
+		self._symmetry_ids = { face_index: i for i, faces in enumerate(sym_map) for face_index in faces }
+
+		self.face_queue = [[self.active_shape.faces[fi] for fi in sym] for sym in sym_map]
+		self._reset_faces()
+		self.mapping_version += 1
+
+		if self.active_shape.convex:
+			self.collider = physics.ConvexCollider(self.active_shape.faces)
+		else:
+			self.collider = self.active_shape.collider
+
+		self.balls.invalidate_paths()
+
+	def set_next_symmetry(self, delta=+1):
+		symmetries = list(self.active_shape.symmetries.keys())
+		cur_sym_index = symmetries.index(self.active_symmetry)
+		next_symmetry = symmetries[(cur_sym_index + delta) % len(symmetries)]
+		self.set_shape_and_symmetry(self.active_shape, next_symmetry)
+
+	def get_next_faces_and_rotate(self):
+		faces = self.face_queue.pop(0)
+		self.face_queue.append(faces)
+		self._next_faces_index = 0
+		return faces
+
+	def get_next_faces(self):
+		faces = self.face_queue[self._next_faces_index]
+		self._next_faces_index = (self._next_faces_index + 1) % len(self.face_queue)
+		return faces
+
+	def shuffle_faces(self):
+		active_map, inactive_map = self._symmetry_map[0:self._symmetry_id_count], self._symmetry_map[self._symmetry_id_count:]
+		self.random.shuffle(active_map)
+		self._symmetry_map = active_map + inactive_map
+		self._reset_faces()
+		self.mapping_version += 1
+
+	def _reset_faces(self):
+		self.random.shuffle(self.face_queue)
+		self._next_faces_index = 0
+
+	def get_face_mapping(self, face):
+		if face.index in self._symmetry_ids:
+			symmetry_id = self._symmetry_ids[face.index]
+			return self._symmetry_map[symmetry_id]
+
+		return None
+
+	def set_face_mapping(self, face, mapping):
+		self._symmetry_map[self._symmetry_ids[face.index]] = mapping
+		self.mapping_version += 1
+
+	def update(self, dt):
+		self.balls.update(dt)
+		self.active_shape.update(dt)
+
+	def get_time(self):
+		return self.balls.get_time()
+
+	def shutdown(self):
+		self.balls.shutdown()
+
+	def pop_events(self):
+		events, self.events = self.events, []
+		return events
+
+	def pick_triangle(self, start, forward, ray_radius=0, maxtime=None):
+		collider = self.active_shape.collider
+		times, indices, points = collider.first_hits([start], [forward], [ray_radius], [np.inf if maxtime is None else maxtime])
+		if indices[0] < 0:
+			return (None, None, None)
+
+		return (collider.triangles[indices[0]], times[0], points[0])
+
+	def ball_face_collision(self, ball, face, pos, time_):
+		mapping = self.get_face_mapping(face)
+		if mapping is not None:
+			face.highlight(0)
+			ball.last_mapping = mapping
+
+		self.events.append(FaceCollisionEvent(time_, ball, face, pos, (mapping,) if mapping is not None else ()))
+
+	def ball_ball_collision(self, ball0, ball1, pos, time_):
+		# Colliding balls replay the notes of the faces they last hit
+		mappings = tuple(set([ball0.last_mapping, ball1.last_mapping]) - set([None]))
+		self.events.append(BallCollisionEvent(time_, ball0, ball1, pos, mappings))
+
+class Balls:
+	def __init__(self, simulation, ball_textures=1, capacity=params.BALLS.MAX):
+		self.simulation = simulation
+		self._logger = logging.getLogger(__name__)
+
+		self.ball_textures = ball_textures
+
+		# Ball state lives in arrays with a row per ball; Ball objects are views of their row. While physics workers run,
+		# the arrays they step live in their shared memory instead.
+		count = capacity
+		self.pos = np.zeros((count, 3), dtype=mp.DTYPE)
+		self.prev_pos = np.zeros((count, 3), dtype=mp.DTYPE)
+		self.render_pos = np.zeros((count, 3), dtype=mp.DTYPE)
+		self.dir = np.zeros((count, 3), dtype=mp.DTYPE)
+		self.speed = np.zeros(count, dtype=mp.DTYPE)
+		self.radius = np.zeros(count, dtype=mp.DTYPE)
+		self.opacity = np.zeros(count, dtype=mp.DTYPE)
+		self.texture = np.zeros(count, dtype=np.int32)
+		self.enabled = np.zeros(count, dtype=bool)
+		self._enabled_balls = None
+		self.balls = [Ball(self, i) for i in range(count)]
+
+		self._next_ball_index = 0
+		self._ball_speed = params.BALL_SPEED.DEFAULT
+		self._ball_radius = params.BALL_RADIUS.DEFAULT
+		self.physics_rate = params.PHYSICS_RATE
+		self.time = 0.
+		self._physics_time_left = 0.
+		self.ball_collisions = params.BALL_COLLISIONS.DEFAULT
+		self.ball_pairs_tested = 0
+		self.pool = None
+
+	def enabled_balls(self):
+		# Cached until a ball is enabled or disabled; callers must not modify the list
+		if self._enabled_balls is None:
+			self._enabled_balls = [self.balls[i] for i in np.flatnonzero(self.enabled)]
+		return self._enabled_balls
+
+	def _set_enabled(self, index, enabled):
+		if self.enabled[index] != enabled:
+			self.enabled[index] = enabled
+			self._enabled_balls = None
+
+	def send_next_to(self, face):
+		ball = self.balls[self._next_ball_index]
+		self._next_ball_index = (self._next_ball_index + 1) % len(self.balls)
+
+		dir_ = face.midpoint
+		self._reset_ball(ball, dir=dir_)
+		ball.fade_rate_after_collision = 2.
+		ball.enabled = True
+
+	def set_ball_count(self, count):
+		for i in range(len(self.balls)):
+			if i >= count:
+				self.balls[i].enabled = False
+			elif not self.balls[i].enabled:
+				self._reset_ball(self.balls[i])
+				self.balls[i].enabled = True
+
+	def set_ball_speed(self, speed):
+		self._ball_speed = speed
+		for b in self.enabled_balls():
+			b.speed = speed
+		self.invalidate_paths()
+
+	def set_ball_radius(self, radius):
+		self._ball_radius = radius
+		for b in self.enabled_balls():
+			b.radius = radius
+		self.invalidate_paths()
+
+	def set_ball_collisions(self, enabled):
+		self.ball_collisions = enabled
+
+	def reset_balls(self):
+		for b in self.enabled_balls():
+			self._reset_ball(b)
+
+	def set_physics_workers(self, workers):
+		if self.pool is not None:
+			# The state moves back out of shared memory before it goes away
+			for name, columns, dtype in physicspool.STATE_FIELDS:
+				setattr(self, name, getattr(self, name).copy())
+			self.pool.close()
+			self.pool = None
+
+		if workers > 0:
+			self.pool = physicspool.PhysicsPool(workers, len(self.balls))
+			for name, columns, dtype in physicspool.STATE_FIELDS:
+				shared = getattr(self.pool, name)
+				shared[...] = getattr(self, name)
+				setattr(self, name, shared)
+
+		# Planned paths went stale while the pool was stepping the balls
+		self.invalidate_paths()
+
+	def shutdown(self):
+		self.set_physics_workers(0)
+
+	def invalidate_paths(self):
+		for b in self.balls:
+			b.itinerary = None
+
+	def update(self, dt):
+		# Physics runs in fixed steps so collision timing doesn't depend on the frame rate; after a hitch we only catch
+		# up a bounded number of steps and let the simulation fall behind instead
+		step_dt = 1. / self.physics_rate
+		self._physics_time_left = min(self._physics_time_left + dt, params.PHYSICS_MAX_STEPS * step_dt)
+		self.ball_pairs_tested = 0
+
+		while self._physics_time_left >= step_dt:
+			self._physics_time_left -= step_dt
+			self._step(step_dt)
+			self.time += step_dt
+
+		alpha = self._physics_time_left / step_dt
+		mp.mix(self.prev_pos, self.pos, alpha, out=self.render_pos)
+
+	def get_time(self):
+		# Time the simulation has been advanced to, including what is left over for the next step
+		return self.time + self._physics_time_left
+
+	def _step(self, dt):
+		self._update_physics(dt)
+
+		if self.ball_collisions:
+			self._update_ball_collisions(dt)
+
+		for b in self.enabled_balls():
+			b.update(dt)
+
+		enabled = np.flatnonzero(self.enabled)
+		for i in enabled[mp.norm_n(self.pos[enabled]) > self.simulation.active_shape.radius]:
+			self._reset_ball(self.balls[i])
+
+	def _update_physics(self, dt):
+		if self.pool is not None:
+			self._update_physics_pool(dt)
+			return
+
+		# Balls travel on straight lines between bounces, so their paths are planned ahead and only replanned when a
+		# setter, shape change or ball-ball collision invalidates them; most steps are then a lookup per ball
+		balls = self.enabled_balls()
+		if len(balls) == 0:
+			return
+
+		end_time = self.time + dt
+		self._plan_paths(balls, end_time)
+
+		segments = []
+		for b in balls:
+			while len(b.itinerary) > 1 and b.itinerary[1].time <= end_time:
+				b.itinerary.popleft()
+				bounce = b.itinerary[0]
+				if not b.fading:
+					self.simulation.ball_face_collision(b, bounce.face, bounce.point, bounce.time)
+
+				if b.fade_rate_after_collision:
+					b.fading = True
+
+			segments.append(b.itinerary[0])
+
+		enabled = np.flatnonzero(self.enabled)
+		seg_pos = mp.array([s.pos for s in segments])
+		seg_dir = mp.array([s.dir for s in segments])
+		seg_time = np.array([s.time for s in segments])
+		self.prev_pos[enabled] = self.pos[enabled]
+		self.pos[enabled] = seg_pos + seg_dir * (self.speed[enabled] * (end_time - seg_time))[:, np.newaxis]
+		self.dir[enabled] = seg_dir
+
+	def _update_physics_pool(self, dt):
+		pool = self.pool
+		if pool.collider is not self.simulation.collider:
+			pool.set_collider(self.simulation.collider)
+
+		# The workers move the balls in place, in the shared arrays
+		for c in pool.step(dt):
+			b = self.balls[c.ball]
+			if not b.fading:
+				self.simulation.ball_face_collision(b, self.simulation.collider.faces[c.index], c.point, self.time + float(c.time))
+
+			if b.fade_rate_after_collision:
+				b.fading = True
+
+	def _plan_paths(self, balls, until):
+		for b in balls:
+			if b.itinerary is None:
+				b.itinerary = collections.deque([Bounce(self.time, None, -1, None, b.pos.copy(), b.dir.copy())])
+				b.planned_until = self.time
+
+		# Extends the itineraries of all balls at once, one bounce per iteration, until each of them is known past `until`.
+		# A ball that bounces MAX_BOUNCES times without getting a radius further is stuck (e.g. wedged in a corner); it
+		# stops being planned and keeps going on its last segment, until it leaves the shape and is reset.
+		collider = self.simulation.collider
+		stalls = {}
+		while True:
+			pending = [b for b in balls if b.planned_until <= until]
+			if len(pending) == 0:
+				break
+
+			tails = [b.itinerary[-1] for b in pending]
+			pos = mp.array([t.pos for t in tails])
+			dir_ = mp.array([t.dir for t in tails])
+			speed = mp.array([b.speed for b in pending])
+			radius = mp.array([b.radius for b in pending])
+			last_hit = np.array([t.index for t in tails])
+
+			times, indices, points = collider.first_hits(pos, dir_ * speed[:, np.newaxis], radius, np.full(len(pending), np.inf), ignore=last_hit)
+
+			hit = indices >= 0
+			normals = collider.normals[np.where(hit, indices, 0)]
+			centers = pos + dir_ * (speed * np.where(hit, times, 0))[:, np.newaxis]
+			dirs = mp.reflect_n(normals, dir_)
+
+			for b, tail, h, t, index, point, center, d, v, r in zip(pending, tails, hit, times, indices, points, centers, dirs, speed, radius):
+				if not h:
+					b.planned_until = np.inf
+					continue
+
+				bounces, distance = stalls.get(b.index, (0, 0.))
+				bounces, distance = bounces + 1, distance + float(t) * v
+				if distance >= r:
+					bounces, distance = 0, 0.
+				elif bounces >= physics.MAX_BOUNCES:
+					self._logger.warning("Ball %d is stuck; no longer planning its path", b.index)
+					b.planned_until = np.inf
+					continue
+				stalls[b.index] = (bounces, distance)
+
+				bounce = Bounce(tail.time + float(t), collider.faces[index], index, point, center, d)
+				b.itinerary.append(bounce)
+				b.planned_until = bounce.time
+
+	def _update_ball_collisions(self, dt):
+		balls = self.enabled_balls()
+		if len(balls) < 2:
+			return
+
+		enabled = np.flatnonzero(self.enabled)
+		pos, dir_, speed, radius = self.pos[enabled], self.dir[enabled], self.speed[enabled], self.radius[enabled]
+
+		collisions, pairs_tested = physics.collide_balls(pos, dir_, speed, radius, self.simulation.active_shape.radius)
+		self.ball_pairs_tested += pairs_tested
+
+		for c in collisions:
+			b0, b1 = balls[c.ball0], balls[c.ball1]
+			b0.dir, b0.speed = dir_[c.ball0], speed[c.ball0]
+			b1.dir, b1.speed = dir_[c.ball1], speed[c.ball1]
+			b0.itinerary = b1.itinerary = None
+			self.simulation.ball_ball_collision(b0, b1, c.point, self.time + dt)
+
+	def _reset_ball(self, ball, dir=None):
+		rng = self.simulation.rng
+		if dir is None: dir = mp.normalize(rng.standard_normal(3))
+		ball.init(
+			pos=[0, 0, 0],
+			dir=dir,
+			speed=self._ball_speed,
+			radius=self._ball_radius,
+			texture=rng.integers(self.ball_textures)
+		)
+
+def _state_row(name):
+	# Property for a ball's row of the Balls state array `name`; assigning copies into the row
+	def get(ball):
+		return getattr(ball.balls, name)[ball.index]
+
+	def set_(ball, value):
+		getattr(ball.balls, name)[ball.index] = value
+
+	return property(get, set_)
+
+class Ball:
+	pos = _state_row('pos')
+	prev_pos = _state_row('prev_pos')
+	render_pos = _state_row('render_pos')
+	dir = _state_row('dir')
+	speed = _state_row('speed')
+	radius = _state_row('radius')
+	opacity = _state_row('opacity')
+	texture = _state_row('texture')
+
+	def __init__(self, balls, index):
+		self.balls = balls
+		self.index = index
+
+		self.fade_rate_after_collision = 0
+
+		self.init([0, 0, 0], [0, 0, 0], 0, 0, 0)
+
+	@property
+	def enabled(self):
+		return bool(self.balls.enabled[self.index])
+
+	@enabled.setter
+	def enabled(self, enabled):
+		self.balls._set_enabled(self.index, enabled)
+
+	def init(self, pos, dir, speed, radius, texture):
+		self.pos = pos
+		self.prev_pos = pos
+		self.render_pos = pos
+		self.dir = dir
+		self.speed = speed
+		self.radius = radius
+		self.texture = texture
+		self.itinerary = None
+		self.planned_until = 0.
+
+		self.opacity = 1.
+		self.fading = False
+		self.last_mapping = None
+
+	def get_distance_to(self, target):
+		return math.dist(self.pos, target)
+
+	def update(self, dt):
+		if self.fading:
+			self.opacity -= dt * self.fade_rate_after_collision
+			if self.opacity < 0:
+				self.enabled = False
+
+	def __repr__(self):
+		return "<Ball %d>" % (self.index,)
@@ -1,33 +1,30 @@
 import gfx
 import mp
+import renderqueue
+import transform
 
 SKYBOX_VS = """
-#version 130
-
-uniform mat4 u_view;
-uniform mat4 u_projection;
-
+#version 140
+""" + transform.CAMERA_BLOCK + transform.STEREO_VS + """
 in vec3 position;
 out vec3 vf_position;
 
 void main() {
-	gl_Position = u_projection * u_view * vec4(position, 1);
+	gl_Position = eye_position(u_view * vec4(position, 1), eye_index(gl_InstanceID));
 	vf_position = position;
 }
 """
 
 SKYBOX_FS = """
-#version 130
-
+#version 140
+""" + transform.CAMERA_BLOCK + transform.STEREO_FS + """
 uniform samplerCube t_skybox;
-uniform vec3 u_camPos;
 
 in vec3 vf_position;
-out vec4 fragColor;
 
 void main() {
 	vec3 dir = vf_position - u_camPos;
-	fragColor = texture(t_skybox, dir);
+	set_color(texture(t_skybox, dir));
 }
 """
 
@@ -47,7 +44,8 @@ class SkyBox:
 
 		self.vertices = mp.array(self.QUADS)[:, [[1, 0, 2], [2, 0, 3]]].reshape(-1, 3) * distance
 
-		self.program = gfx.Program(SKYBOX_VS, SKYBOX_FS)
+		self.program = gfx.Program(SKYBOX_VS, SKYBOX_FS, outputs=transform.STEREO_OUTPUTS)
+		self.program.bind_uniform_block('Camera', transform.CAMERA_BINDING)
 		self.vao = gfx.VAO()
 		with self.vao:
 			self.vao.create_vbo_attrib(0, self.vertices)
@@ -57,14 +55,10 @@ class SkyBox:
 				self.program.set_uniform('t_skybox', self.texture.number)
 
 	def update(self, dt):
-		with self.program:
-			self.program.set_uniform('u_camPos', self.scene.camera.get_pos())
+		pass
 
-	def pre_render(self, projection, view):
-		with self.program:
-			self.program.set_uniform('u_view', view)
-			self.program.set_uniform('u_projection', projection)
+	def render(self, queue):
+		queue.submit(renderqueue.PASS_BACKGROUND, self.program, self._draw, texture=self.texture)
 
-	def render(self):
-		with self.program:
-			self.vao.draw_triangles()
+	def _draw(self):
+		self.vao.draw_triangles(instances=len(self.scene.transforms.eyes))
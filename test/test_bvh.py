@@ -0,0 +1,49 @@
+import math
+import unittest
+
+import numpy as np
+
+import bvh
+import mp
+
+def _sphere_mesh(divisions):
+	# UV sphere triangles, dense enough to need a BVH
+	triangles = []
+	for i in range(divisions):
+		for j in range(2 * divisions):
+			def _p(a, b):
+				theta, phi = math.pi * a / divisions, math.pi * b / divisions
+				return [math.sin(theta) * math.cos(phi), math.cos(theta), math.sin(theta) * math.sin(phi)]
+			p0, p1, p2, p3 = _p(i, j), _p(i+1, j), _p(i+1, j+1), _p(i, j+1)
+			triangles.append([p0, p1, p2])
+			triangles.append([p0, p2, p3])
+	return mp.array(triangles)
+
+class TestBVH(unittest.TestCase):
+	def test_leaves_cover_all_triangles(self):
+		tree = bvh.BVH(_sphere_mesh(16), leaf_size=4)
+		self.assertEqual(sorted(tree.order.tolist()), list(range(16 * 32 * 2)))
+		self.assertTrue(all(tree.counts[tree.lefts < 0] > 0))
+
+	def test_query_is_conservative(self):
+		vertices = _sphere_mesh(16)
+		tree = bvh.BVH(vertices)
+
+		rng = np.random.default_rng(0)
+		pos = mp.asarray(rng.uniform(-.5, .5, (20, 3)))
+		vel = mp.asarray(rng.standard_normal((20, 3)))
+		radius = mp.asarray(rng.uniform(0, .1, 20))
+		maxtime = mp.asarray(rng.uniform(.1, 2, 20))
+
+		spheres, triangles = tree.query(pos, vel, radius, maxtime)
+		pairs = set(zip(spheres.tolist(), triangles.tolist()))
+		self.assertLess(len(pairs), 20 * len(vertices))
+
+		# Every triangle whose bounding box, grown by the radius, is touched by the sweep must be a candidate
+		for s in range(20):
+			steps = np.linspace(0, maxtime[s], 200)[:, np.newaxis]
+			path = pos[s] + vel[s] * steps
+			for t, tri in enumerate(vertices):
+				lo, hi = tri.min(axis=0) - radius[s], tri.max(axis=0) + radius[s]
+				if np.any(np.all((path >= lo) & (path <= hi), axis=-1)):
+					self.assertIn((s, t), pairs)
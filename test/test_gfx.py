@@ -0,0 +1,89 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+from OpenGL import GL
+
+import gfx
+
+class TestStats(unittest.TestCase):
+	def setUp(self):
+		self.uploads = []
+		setters = { GL.GL_FLOAT: (lambda location, value: self.uploads.append(value.tolist()), np.float32) }
+		patcher = mock.patch.dict(gfx._UNIFORM_SETTERS, setters)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+		self.frames = gfx.Frames()
+		self.uniform = gfx.Uniform('u_time', 0, 1, GL.GL_FLOAT)
+
+	def test_frame_counts_uniform_uploads(self):
+		# Per-frame uniforms are set while updating, before anything is drawn
+		self.frames.begin_frame()
+		self.uniform.set(1.)
+		self.assertEqual((gfx.stats.uniform_uploads, gfx.stats.uniform_uploads_elided), (1, 0))
+
+		self.frames.begin_frame()
+		self.uniform.set(1.)
+		self.assertEqual((gfx.stats.uniform_uploads, gfx.stats.uniform_uploads_elided), (0, 1))
+
+		self.frames.begin_frame()
+		self.uniform.set(2.)
+		self.assertEqual((gfx.stats.uniform_uploads, gfx.stats.uniform_uploads_elided), (1, 0))
+		self.assertEqual(self.uploads, [[1.], [2.]])
+
+class TestStreamBuffer(unittest.TestCase):
+	def setUp(self):
+		# No GL context here: GL calls go to a mock whose fences are told apart by frame, and mapping hands out memory
+		self.gl = mock.MagicMock()
+		self.gl.GL_ALREADY_SIGNALED, self.gl.GL_CONDITION_SATISFIED, self.gl.GL_TIMEOUT_EXPIRED = 1, 2, 3
+		self.gl.glGetIntegerv.return_value = 256
+		self.frames = gfx.Frames()
+		self.gl.glFenceSync.side_effect = lambda *args: ('fence', self.frames.number)
+		for patcher in (
+			mock.patch.object(gfx, 'GL', self.gl),
+			mock.patch.object(gfx, 'frames', self.frames),
+			mock.patch.object(gfx, 'has_extension', return_value=True),
+			mock.patch.object(gfx.StreamBuffer, 'mmap_range', lambda self, offset, size, access: bytearray(size)),
+		):
+			patcher.start()
+			self.addCleanup(patcher.stop)
+		self.addCleanup(gfx.state.invalidate)
+
+	def test_regions_rotate_and_wait_for_frames_in_flight(self):
+		buffer = gfx.StreamBuffer(4, 6)
+		self.assertTrue(buffer.persistent)
+		self.assertEqual((buffer.regions, buffer.region_stride), (gfx.STREAM_FRAMES, 256))
+
+		# The first frame reusing a region waits for it once; the rest find their frames already done
+		self.gl.glClientWaitSync.side_effect = [self.gl.GL_TIMEOUT_EXPIRED, self.gl.GL_CONDITION_SATISFIED] + [self.gl.GL_ALREADY_SIGNALED] * 10
+
+		regions = []
+		for i in range(2 * gfx.STREAM_FRAMES):
+			self.frames.begin_frame()
+			buffer.begin()[:] = i
+			self.assertEqual(buffer.begin()[0, 0], i)
+			buffer.end()
+			regions.append((buffer.region, buffer.offset))
+			if i == gfx.STREAM_FRAMES:
+				self.assertEqual(gfx.stats.fence_waits, 1)
+			self.frames.end_frame()
+
+		self.assertEqual(regions, [(i % gfx.STREAM_FRAMES, i % gfx.STREAM_FRAMES * 256) for i in range(2 * gfx.STREAM_FRAMES)])
+		waited = [call.args[0] for call in self.gl.glClientWaitSync.call_args_list]
+		self.assertEqual(waited, [('fence', 0), ('fence', 0)] + [('fence', i) for i in range(1, gfx.STREAM_FRAMES)])
+		self.assertEqual(gfx.stats.fence_waits, 0)
+
+	def test_orphaned_buffer_has_one_region(self):
+		with mock.patch.object(gfx.StreamBuffer, 'allow_persistent', False):
+			buffer = gfx.StreamBuffer(4, 6)
+		self.assertFalse(buffer.persistent)
+		self.assertEqual(buffer.regions, 1)
+
+		for i in range(2):
+			self.frames.begin_frame()
+			buffer.begin()[:] = i
+			buffer.end()
+			self.assertEqual((buffer.region, buffer.offset), (0, 0))
+			self.frames.end_frame()
+		self.gl.glClientWaitSync.assert_not_called()
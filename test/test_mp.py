@@ -56,3 +56,71 @@ class TestTriangleContains(unittest.TestCase):
 		self.assertFalse(mp.triangle_contains_point(tri, mp.array([-1, -1, 0])))
 		self.assertFalse(mp.triangle_contains_point(tri, mp.array([-.1, 9, 0])))
 		self.assertFalse(mp.triangle_contains_point(tri, mp.array([5, -.8, 0])))
+
+class TestBatched(unittest.TestCase):
+	def setUp(self):
+		rng = np.random.default_rng(0)
+		self.tris = mp.array(rng.uniform(-1, 1, (50, 3, 3)))
+		self.pos = mp.array(rng.uniform(-1, 1, (50, 3)))
+		self.vel = mp.array(rng.uniform(-1, 1, (50, 3)))
+
+	def test_vector_ops(self):
+		for v0, v1 in zip(self.pos, self.vel):
+			assert_close(mp.dot_n(v0, v1), mp.dot(v0, v1))
+			np.testing.assert_allclose(mp.cross_n(v0, v1), mp.cross(v0, v1), atol=1e-6)
+			np.testing.assert_allclose(mp.reflect_n(mp.normalize(v1), v0), mp.reflect(mp.normalize(v1), v0), atol=1e-6)
+
+		np.testing.assert_allclose(mp.norm_n(self.pos), [mp.norm(v) for v in self.pos], rtol=1e-6)
+		np.testing.assert_allclose(mp.normalize_n(self.pos), [mp.normalize(v) for v in self.pos], atol=1e-6)
+		np.testing.assert_allclose(mp.triangle_normal_n(self.tris), [mp.triangle_normal(t) for t in self.tris], atol=1e-5)
+
+		for result in (mp.dot_n(self.pos, self.vel), mp.normalize_n(self.pos), mp.reflect_n(self.vel, self.pos), mp.triangle_normal_n(self.tris)):
+			self.assertEqual(result.dtype, mp.DTYPE)
+
+	def test_intersect_and_contains(self):
+		times, points = mp.intersect_plane_sphere_n(self.tris, self.pos, self.vel, .1)
+		self.assertEqual(times.dtype, mp.DTYPE)
+		for tri, p, v, t, ip in zip(self.tris, self.pos, self.vel, times, points):
+			expected_t, expected_ip = mp.intersect_plane_sphere(tri, p, v, .1)
+			self.assertAlmostEqual(t / expected_t, 1, places=3)
+			np.testing.assert_allclose(ip, expected_ip, atol=1e-3)
+
+		contains = mp.triangle_contains_point_n(self.tris, self.pos)
+		self.assertEqual(list(contains), [mp.triangle_contains_point(t, p) for t, p in zip(self.tris, self.pos)])
+		edge_perps = mp.triangle_edge_perps_n(self.tris)
+		self.assertEqual(list(mp.triangle_contains_point_n(self.tris, self.pos, edge_perps=edge_perps)), list(contains))
+
+		# A single triangle broadcasts against many points
+		tri = mp.array([[0, 0, 0], [1, 0, 0], [0, 1, 0]])
+		self.assertEqual(list(mp.triangle_contains_point_n(tri, [[.1, .1, 0], [1.5, 1.5, 0]])), [True, False])
+		times, points = mp.intersect_plane_sphere_n(tri, [[0, 0, 1], [0, 0, 1]], [[0, 0, -1], [1, 0, 0]])
+		self.assertEqual(list(times), [1, -np.inf])
+
+class TestOut(unittest.TestCase):
+	def test_lookat(self):
+		eye, center, up = mp.array([9, 1, 2]), mp.array([0, 0, 0]), mp.array([0, 1, 0])
+		M = mp.lookatM(eye, center, up)
+		np.testing.assert_allclose(M @ np.append(eye, 1), [0, 0, 0, 1], atol=1e-5)
+		np.testing.assert_allclose(M @ np.append(center, 1), [0, 0, -np.linalg.norm(eye), 1], atol=1e-5)
+
+	def test_out_variants(self):
+		v0, v1 = mp.array([1, 2, 3]), mp.array([-2, .5, 1])
+		M, v = mp.identityM(), mp.array([0, 0, 0])
+
+		self.assertIs(mp.translateM(v0, out=M), M)
+		np.testing.assert_array_equal(M, mp.translateM(v0))
+		self.assertIs(mp.scaleM(2., out=M), M)
+		np.testing.assert_array_equal(M, mp.scaleM(2.))
+		self.assertIs(mp.perspectiveM(1., 1.5, .1, 100., out=M), M)
+		np.testing.assert_allclose(M, mp.perspectiveM(1., 1.5, .1, 100.))
+		self.assertIs(mp.lookatM(v0, v1, [0, 1, 0], out=M), M)
+		np.testing.assert_allclose(M, mp.lookatM(v0, v1, [0, 1, 0]))
+
+		self.assertIs(mp.cross(v0, v1, out=v), v)
+		np.testing.assert_array_equal(v, np.cross(v0, v1))
+		mp.cross(v, v1, out=v)
+		np.testing.assert_allclose(v, np.cross(np.cross(v0, v1), v1))
+		self.assertIs(mp.normalize(v0, out=v), v)
+		np.testing.assert_allclose(v, v0 / np.linalg.norm(v0))
+		self.assertIs(mp.mix(v0, v1, .25, out=v), v)
+		np.testing.assert_allclose(v, mp.mix(v0, v1, .25))
@@ -0,0 +1,131 @@
+import math
+import unittest
+
+import numpy as np
+
+import mp
+import physics
+
+class _Face:
+	def __init__(self, vertices):
+		self.vertices = mp.array(vertices)
+		self.midpoint = sum(self.vertices) / len(self.vertices)
+		self.normal = mp.triangle_normal(self.vertices[0:3])
+		self.triangles = [_Triangle(self, self.vertices[[0, i, i+1]]) for i in range(1, len(vertices)-1)]
+
+class _Triangle:
+	def __init__(self, face, vertices):
+		self.face = face
+		self.vertices = vertices
+		self.normal = mp.triangle_normal(self.vertices)
+
+def _box_faces(size):
+	# Axis aligned box centered at the origin, with both windings present
+	faces = []
+	for axis in range(3):
+		for sign in (-1, +1):
+			u, v = (axis + 1) % 3, (axis + 2) % 3
+			quad = []
+			for cu, cv in ((-1, -1), (+1, -1), (+1, +1), (-1, +1)):
+				p = [0, 0, 0]
+				p[axis], p[u], p[v] = sign * size, cu * size, cv * size
+				quad.append(p)
+			faces.append(_Face(quad))
+	return faces
+
+def _box_triangles(size):
+	return [t for f in _box_faces(size) for t in f.triangles]
+
+class TestTriangleCollider(unittest.TestCase):
+	def test_first_hits(self):
+		collider = physics.TriangleCollider(_box_triangles(1))
+
+		times, indices, points = collider.first_hits([[0, 0, 0], [0, 0, 0]], [[1, 0, 0], [0, -2, 0]], [.5, 0], [math.inf, math.inf])
+		np.testing.assert_allclose(times, [.5, .5])
+		np.testing.assert_allclose(points, [[1, 0, 0], [0, -1, 0]], atol=1e-6)
+		self.assertTrue(all(indices >= 0))
+
+	def test_maxtime_and_exclude(self):
+		collider = physics.TriangleCollider(_box_triangles(1))
+
+		times, indices, points = collider.first_hits([[0, .3, .1]], [[1, 0, 0]], [0], [.5])
+		self.assertEqual(indices[0], -1)
+
+		times, indices, points = collider.first_hits([[0, .3, .1]], [[1, 0, 0]], [0], [2])
+		times, indices, points = collider.first_hits([[0, .3, .1]], [[1, 0, 0]], [0], [2], ignore=indices)
+		self.assertEqual(indices[0], -1)
+
+class TestConvexCollider(unittest.TestCase):
+	def test_first_hits(self):
+		collider = physics.ConvexCollider(_box_faces(1))
+
+		times, indices, points = collider.first_hits([[0, 0, 0], [0, .5, 0], [0, 0, 0]], [[1, 0, 0], [0, 1, 0], [0, 0, 1]], [.5, .75, 0], [math.inf, math.inf, .5])
+		np.testing.assert_allclose(times[0:2], [.5, 0])
+		np.testing.assert_allclose(points[0:2], [[1, 0, 0], [0, 1.25, 0]], atol=1e-6)
+		self.assertEqual(indices[2], -1)
+		self.assertTrue(np.allclose(collider.normals[indices[0]], [1, 0, 0]))
+		self.assertTrue(np.allclose(collider.normals[indices[1]], [0, 1, 0]))
+
+	def test_matches_triangle_collider(self):
+		faces = _box_faces(1)
+		convex = physics.ConvexCollider(faces)
+		triangles = physics.TriangleCollider([t for f in faces for t in f.triangles])
+
+		rng = np.random.default_rng(0)
+		pos = mp.asarray(rng.uniform(-.5, .5, (50, 3)))
+		vel = mp.asarray(rng.standard_normal((50, 3)))
+		radius = mp.asarray(rng.uniform(0, .4, 50))
+		maxtime = np.full(50, math.inf)
+
+		ctimes, cindices, cpoints = convex.first_hits(pos, vel, radius, maxtime)
+		ttimes, tindices, tpoints = triangles.first_hits(pos, vel, radius, maxtime)
+		np.testing.assert_allclose(ctimes, ttimes, rtol=1e-4)
+		np.testing.assert_allclose(cpoints, tpoints, atol=1e-4)
+		self.assertEqual([convex.faces[i] for i in cindices], [triangles.faces[i] for i in tindices])
+
+class TestAdvance(unittest.TestCase):
+	def test_advance_bounces(self):
+		for collider in (physics.TriangleCollider(_box_triangles(1)), physics.ConvexCollider(_box_faces(1))):
+			self._test_advance_bounces(collider)
+
+	def _test_advance_bounces(self, collider):
+		pos = mp.array([[0, .1, .2], [.1, .2, 0], [.2, .3, -.1]])
+		dir_ = mp.array([[1, 0, 0], [0, 0, 1], [0, 1, 0]])
+		speed = mp.array([1, 3, .1])
+		radius = mp.array([.5, .5, .1])
+
+		collisions = physics.advance(collider, pos, dir_, speed, radius, 1.)
+
+		np.testing.assert_allclose(pos, [[0, .1, .2], [.1, .2, 0], [.2, .4, -.1]], atol=1e-5)
+		np.testing.assert_allclose(dir_, [[-1, 0, 0], [0, 0, -1], [0, 1, 0]], atol=1e-6)
+		self.assertEqual([c.ball for c in collisions], [0, 1, 1, 1])
+		np.testing.assert_allclose([c.time for c in collisions], [.5, 1 / 6, 1 / 2, 5 / 6], atol=1e-6)
+
+class TestBallCollisions(unittest.TestCase):
+	def test_find_ball_pairs(self):
+		rng = np.random.default_rng(0)
+		pos = mp.asarray(rng.uniform(-3, 3, (200, 3)))
+		radius = mp.asarray(rng.uniform(.05, .3, 200))
+
+		firsts, seconds = physics.find_ball_pairs(pos, radius, 3.)
+		candidates = set(zip(firsts.tolist(), seconds.tolist()))
+		self.assertEqual(len(candidates), len(firsts))
+		self.assertLess(len(candidates), 200 * 199 // 2)
+
+		for i in range(200):
+			for j in range(i + 1, 200):
+				if mp.norm(pos[i] - pos[j]) < radius[i] + radius[j]:
+					self.assertTrue((i, j) in candidates or (j, i) in candidates)
+
+	def test_collide_balls(self):
+		pos = mp.array([[0, 0, 0], [.3, 0, 0], [2, 2, 2]])
+		dir_ = mp.array([[1, 0, 0], [0, 1, 0], [1, 0, 0]])
+		speed = mp.array([2, 1, 1])
+		radius = mp.array([.2, .2, .2])
+
+		collisions, pairs_tested = physics.collide_balls(pos, dir_, speed, radius, 3.)
+		self.assertEqual([(c.ball0, c.ball1) for c in collisions], [(0, 1)])
+		np.testing.assert_allclose(dir_ * speed[:, np.newaxis], [[0, 0, 0], [2, 1, 0], [1, 0, 0]], atol=1e-6)
+
+		collisions, pairs_tested = physics.collide_balls(pos, dir_, speed, radius, 3.)
+		self.assertEqual(collisions, [])
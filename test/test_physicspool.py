@@ -0,0 +1,81 @@
+import unittest
+
+import numpy as np
+
+import mp
+import params
+import physics
+import physicspool
+
+class TestPhysicsPool(unittest.TestCase):
+	def setUp(self):
+		self.collider = physics.ConvexCollider(params.SHAPES[0]().faces)
+
+	def _random_balls(self, count):
+		rng = np.random.default_rng(1)
+		pos = mp.array(rng.uniform(-.5, .5, (count, 3)))
+		dir_ = mp.array(rng.standard_normal((count, 3)))
+		dir_ /= np.linalg.norm(dir_, axis=-1)[:, np.newaxis]
+		speed = mp.array(rng.uniform(5, 20, count))
+		radius = np.full(count, .1, dtype=mp.DTYPE)
+		return pos, dir_, speed, radius
+
+	def test_matches_single_process(self):
+		count = 50
+		pos, dir_, speed, radius = self._random_balls(count)
+
+		pool = physicspool.PhysicsPool(3, 64)
+		try:
+			pool.set_collider(self.collider)
+			pool.pos[:count], pool.dir[:count], pool.speed[:count], pool.radius[:count] = pos, dir_, speed, radius
+			pool.enabled[:count] = True
+
+			for i in range(10):
+				expected = physics.advance(self.collider, pos, dir_, speed, radius, 1 / 60)
+				collisions = pool.step(1 / 60)
+
+				np.testing.assert_allclose(pool.pos[:count], pos, atol=1e-5)
+				np.testing.assert_allclose(pool.dir[:count], dir_, atol=1e-5)
+				self.assertEqual(sorted((c.ball, c.index) for c in collisions), sorted((c.ball, c.index) for c in expected))
+				self.assertEqual([c.time for c in collisions], sorted(c.time for c in collisions))
+		finally:
+			pool.close()
+
+	def test_sparse_balls_are_stepped_in_place(self):
+		count = 50
+		pos, dir_, speed, radius = self._random_balls(count)
+		enabled = np.arange(count) % 3 != 0
+
+		pool = physicspool.PhysicsPool(2, count)
+		try:
+			pool.set_collider(self.collider)
+			pool.pos[:], pool.dir[:], pool.speed[:], pool.radius[:] = pos, dir_, speed, radius
+			pool.enabled[:] = enabled
+
+			expected_pos, expected_dir = pos[enabled], dir_[enabled]
+			expected = physics.advance(self.collider, expected_pos, expected_dir, speed[enabled], radius[enabled], 1 / 10)
+			collisions = pool.step(1 / 10)
+
+			np.testing.assert_allclose(pool.pos[enabled], expected_pos, atol=1e-5)
+			np.testing.assert_allclose(pool.prev_pos[enabled], pos[enabled])
+			np.testing.assert_allclose(pool.pos[~enabled], pos[~enabled])
+			rows = np.flatnonzero(enabled)
+			self.assertEqual(sorted((c.ball, c.index) for c in collisions), sorted((rows[c.ball], c.index) for c in expected))
+		finally:
+			pool.close()
+
+	def test_ring_overflow(self):
+		pool = physicspool.PhysicsPool(1, 8, ring_capacity=4)
+		try:
+			pool.set_collider(self.collider)
+			pool.pos[:] = 0
+			pool.dir[:] = [1, 0, 0]
+			pool.speed[:] = 100
+			pool.radius[:] = .1
+			pool.enabled[:] = True
+
+			with self.assertLogs('physicspool', level='WARNING'):
+				collisions = pool.step(1 / 10)
+			self.assertEqual(len(collisions), 4)
+		finally:
+			pool.close()
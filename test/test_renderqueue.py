@@ -0,0 +1,59 @@
+import unittest
+
+import renderqueue
+
+class FakeProgram:
+	def __init__(self, id_, log):
+		self.id = id_
+		self.log = log
+
+	def activate(self):
+		self.log.append(('program', self.id))
+
+class FakeState:
+	def __init__(self, log):
+		self.log = log
+
+	def activate(self):
+		self.log.append('enter')
+
+	def deactivate(self):
+		self.log.append('exit')
+
+class TestRenderQueue(unittest.TestCase):
+	def setUp(self):
+		self.log = []
+		self.queue = renderqueue.RenderQueue()
+		self.state = FakeState(self.log)
+		self.queue.add_pass(renderqueue.PASS_BACKGROUND, state=self.state)
+		self.queue.add_pass(renderqueue.PASS_INSIDE, translucent=True, state=self.state)
+		self.queue.add_pass(renderqueue.PASS_OVERLAY)
+		self.programs = [FakeProgram(i, self.log) for i in range(2)]
+
+	def _submit(self, pass_, program, name, depth=0.):
+		self.queue.submit(pass_, self.programs[program], lambda: self.log.append(name), depth=depth)
+
+	def test_groups_by_program_within_opaque_passes(self):
+		self._submit(renderqueue.PASS_OVERLAY, 0, 'hud')
+		self._submit(renderqueue.PASS_BACKGROUND, 0, 'a')
+		self._submit(renderqueue.PASS_BACKGROUND, 1, 'b')
+		self._submit(renderqueue.PASS_BACKGROUND, 0, 'c')
+		self.queue.flush()
+
+		self.assertEqual(self.log, ['enter', ('program', 0), 'a', 'c', ('program', 1), 'b', 'exit', ('program', 0), 'hud'])
+		self.assertEqual((self.queue.draws, self.queue.state_changes), (4, 5))
+
+	def test_translucent_passes_draw_back_to_front(self):
+		self._submit(renderqueue.PASS_INSIDE, 0, 'near', depth=1.)
+		self._submit(renderqueue.PASS_INSIDE, 1, 'far', depth=5.)
+		self._submit(renderqueue.PASS_INSIDE, 0, 'middle', depth=3.)
+		self._submit(renderqueue.PASS_BACKGROUND, 1, 'background')
+		self.queue.flush()
+
+		draws = [entry for entry in self.log if isinstance(entry, str) and entry not in ('enter', 'exit')]
+		self.assertEqual(draws, ['background', 'far', 'middle', 'near'])
+		self.assertEqual(self.log.count('enter'), 1)
+
+		self.log.clear()
+		self.queue.flush()
+		self.assertEqual((self.log, self.queue.draws), ([], 0))
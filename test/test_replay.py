@@ -0,0 +1,33 @@
+import os
+import tempfile
+import unittest
+
+import replay
+
+class TestReplay(unittest.TestCase):
+	def test_round_trip(self):
+		with tempfile.TemporaryDirectory() as directory:
+			filename = os.path.join(directory, 'run.jsonl')
+
+			recorder = replay.Recorder(filename, 1234, { 'ball_count': 3 })
+			recorder.add_frame(.016)
+			recorder.event('midi', [0x90, 60, 100])
+			recorder.event('key_down', 'b')
+			recorder.event('mouse_down', 1, (.25, .5))
+			recorder.event('midi', [0x80, 60, 0])
+			recorder.add_frame(.017)
+			recorder.close()
+
+			player = replay.Player(filename)
+			self.assertEqual(player.seed, 1234)
+			self.assertEqual(player.controls, { 'ball_count': 3 })
+			self.assertEqual(len(player), 2)
+
+			self.assertEqual(player.next_frame(), (.016, []))
+			self.assertEqual(player.next_frame(), (.017, [
+				('midi', [[0x90, 60, 100]]),
+				('key_down', ['b']),
+				('mouse_down', [1, [.25, .5]]),
+				('midi', [[0x80, 60, 0]]),
+			]))
+			self.assertIsNone(player.next_frame())
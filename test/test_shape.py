@@ -0,0 +1,18 @@
+import unittest
+
+import numpy as np
+
+import mp
+import shape
+
+class TestShape(unittest.TestCase):
+	def test_nearby_balls(self):
+		# A unit square face on the z=0 plane
+		normals = mp.array([[0, 0, 1]])
+		midpoints = mp.array([[0, 0, 0]])
+		face_radii = mp.array([np.sqrt(2)])
+
+		centers = mp.array([[0, 0, .4], [0, 0, .6], [5, 0, .1], [0, 0, .1]])
+		radii = mp.array([.1, .1, .1, 0])
+		near = shape.get_nearby_balls(normals, midpoints, face_radii, centers, radii)
+		self.assertEqual(near.tolist(), [[True, False, False, False]])
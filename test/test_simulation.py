@@ -0,0 +1,200 @@
+import math
+import unittest
+
+import geometry
+import mp
+import params
+import physics
+import simulation
+
+class TestSimulation(unittest.TestCase):
+	def setUp(self):
+		self.sim = simulation.Simulation()
+
+	def _map_all_faces(self):
+		for i, faces in enumerate(self.sim.face_queue):
+			self.sim.set_face_mapping(faces[0], (0, 60 + i, .1, 100, 0))
+
+	def test_balls_stay_inside_shapes(self):
+		for index in range(params.SHAPES.COUNT):
+			self.sim.set_shape(index)
+			self.sim.balls.set_ball_speed(params.BALL_SPEED.MAX)
+			self.sim.balls.set_ball_count(params.BALLS.MAX)
+
+			for i in range(60):
+				self.sim.update(1 / 60)
+				for b in self.sim.balls.enabled_balls():
+					self.assertLess(mp.norm(b.pos), self.sim.active_shape.radius)
+
+	def test_collision_events(self):
+		self._map_all_faces()
+		self.sim.balls.set_ball_count(4)
+		self.sim.balls.set_ball_speed(10.)
+
+		for i in range(60):
+			self.sim.update(1 / 60)
+
+		events = self.sim.pop_events()
+		self.assertGreater(len(events), 0)
+		for e in events:
+			self.assertIsInstance(e, simulation.FaceCollisionEvent)
+			self.assertEqual(e.mappings, (self.sim.get_face_mapping(e.face),))
+		self.assertEqual(self.sim.pop_events(), [])
+
+	def test_event_times_independent_of_frame_rate(self):
+		def _event_times(frame_dt):
+			sim = simulation.Simulation()
+			sim.set_shape(self.sim.shapes.index(self.sim.active_shape))
+			sim.balls.set_ball_count(1)
+			sim.balls.balls[0].init([0, 0, 0], mp.normalize(mp.array([1, 2, 3])), 10., .1, 0)
+
+			for i in range(int(1 / frame_dt)):
+				sim.update(frame_dt)
+			return [e.time for e in sim.pop_events()]
+
+		times = _event_times(1 / 30)
+		self.assertGreater(len(times), 0)
+		self.assertEqual(times, sorted(times))
+		self.assertTrue(0 < times[0] < 1)
+		for a, b in zip(times, _event_times(1 / 144)):
+			self.assertAlmostEqual(a, b, places=4)
+
+	def _plan_paths(self, until):
+		# (time, ball, face) for every bounce planned up to the absolute simulation time `until`
+		balls = self.sim.balls.enabled_balls()
+		self.sim.balls._plan_paths(balls, until)
+		return sorted(((bounce.time, b, bounce.face) for b in balls for bounce in list(b.itinerary)[1:] if bounce.time <= until), key=lambda c: c[0])
+
+	def test_planned_paths(self):
+		self._map_all_faces()
+		self.sim.balls.set_ball_count(4)
+		self.sim.balls.set_ball_speed(10.)
+
+		upcoming = self._plan_paths(1.)
+		self.assertGreater(len(upcoming), 0)
+		for i in range(60):
+			self.sim.update(1 / 60)
+
+		events = sorted(self.sim.pop_events(), key=lambda e: e.time)
+		upcoming = [c for c in upcoming if c[0] <= self.sim.balls.time]
+		self.assertEqual([(e.ball, e.face) for e in events], [(b, f) for t, b, f in upcoming])
+		for e, (t, b, f) in zip(events, upcoming):
+			self.assertAlmostEqual(e.time, t)
+
+		# Changing the speed replans from the balls' current positions
+		self.sim.balls.set_ball_speed(5.)
+		upcoming = self._plan_paths(self.sim.balls.time + 1.)
+		self.assertTrue(all(t >= self.sim.balls.time for t, b, f in upcoming))
+		self.assertTrue(all(len(b.itinerary) == 1 or b.itinerary[1].time <= self.sim.balls.time + 1. for b in self.sim.balls.enabled_balls()))
+
+	def test_planned_paths_past_max_bounces(self):
+		self.sim.balls.set_ball_count(1)
+		self.sim.balls.set_ball_speed(params.BALL_SPEED.MAX)
+
+		until = self.sim.balls.time + 30.
+		upcoming = self._plan_paths(until)
+		self.assertGreater(len(upcoming), physics.MAX_BOUNCES)
+		for b in self.sim.balls.enabled_balls():
+			self.assertGreater(b.planned_until, until)
+
+	def test_physics_workers(self):
+		self._map_all_faces()
+		self.sim.balls.set_ball_count(4)
+		self.sim.balls.set_ball_speed(10.)
+		self.sim.balls.set_physics_workers(2)
+		try:
+			for i in range(60):
+				self.sim.update(1 / 60)
+				for b in self.sim.balls.enabled_balls():
+					self.assertLess(mp.norm(b.pos), self.sim.active_shape.radius)
+
+			self.assertGreater(len(self.sim.pop_events()), 0)
+		finally:
+			self.sim.shutdown()
+		self.assertIsNone(self.sim.balls.pool)
+
+	def test_physics_workers_step_shared_state(self):
+		count = params.BALLS.MAX + 100
+		sim = simulation.Simulation(ball_capacity=count)
+		sim.balls.set_ball_count(count)
+		sim.balls.set_ball_speed(10.)
+		sim.balls.set_physics_workers(2)
+		try:
+			self.assertIs(sim.balls.pos, sim.balls.pool.pos)
+			for i in range(10):
+				sim.update(1 / 60)
+			for b in sim.balls.enabled_balls():
+				self.assertLess(mp.norm(b.pos), sim.active_shape.radius)
+			moved = sim.balls.pos.copy()
+		finally:
+			sim.shutdown()
+		self.assertEqual(len(sim.balls.enabled_balls()), count)
+		self.assertEqual(sim.balls.pos.tolist(), moved.tolist())
+
+	def test_seeded_runs_are_identical(self):
+		def _run(seed):
+			sim = simulation.Simulation(seed=seed)
+			sim.balls.set_ball_count(4)
+			sim.balls.set_ball_speed(10.)
+			sim.balls.set_ball_collisions(True)
+			for i in range(60):
+				sim.update(1 / 60)
+			return [(e.time, e.ball.index) for e in sim.pop_events()], [b.pos.tolist() for b in sim.balls.enabled_balls()]
+
+		self.assertEqual(_run(5), _run(5))
+		self.assertNotEqual(_run(5), _run(6))
+
+	def test_face_queue(self):
+		self._map_all_faces()
+		first = self.sim.get_next_faces_and_rotate()
+		self.assertIs(self.sim.face_queue[-1], first)
+
+		mappings = sorted(self.sim.get_face_mapping(faces[0]) for faces in self.sim.face_queue)
+		self.sim.shuffle_faces()
+		self.assertEqual(sorted(self.sim.get_face_mapping(faces[0]) for faces in self.sim.face_queue), mappings)
+
+	def test_balls_are_views_of_state_arrays(self):
+		balls = self.sim.balls
+		balls.set_ball_count(3)
+		self.assertEqual([b.index for b in balls.enabled_balls()], [0, 1, 2])
+
+		ball = balls.balls[1]
+		ball.pos = [1, 2, 3]
+		self.assertEqual(balls.pos[1].tolist(), [1, 2, 3])
+		balls.radius[1] = .5
+		self.assertEqual(ball.radius, .5)
+
+		ball.enabled = False
+		self.assertEqual([b.index for b in balls.enabled_balls()], [0, 2])
+
+	def test_face_highlight_fades_with_shape_time(self):
+		shape = self.sim.active_shape
+		face = shape.faces[0]
+		face.highlight(.5)
+		version = shape.version
+
+		self.sim.update(.75)
+		self.assertEqual(shape.version, version)
+		self.assertAlmostEqual(face.get_highlight(), .5)
+
+		face.highlight(0, force=True)
+		self.assertNotEqual(shape.version, version)
+		self.assertAlmostEqual(face.get_highlight(), 1.)
+
+	def test_shape_time_is_rebased(self):
+		shape = self.sim.active_shape
+		faces = shape.faces
+		shape.update(geometry.TIME_REBASE_PERIOD - .5)
+		faces[0].highlight(.5)
+		faces[1].highlight(math.inf)
+		faces[2].highlight(0)
+		version = shape.version
+		highlights = [f.get_highlight() for f in faces[:3]]
+
+		shape.update(.75)
+		self.assertEqual(shape.time, 0.)
+		self.assertNotEqual(shape.version, version)
+		self.assertAlmostEqual(faces[0].get_highlight(), .5)
+		self.assertEqual(faces[1].get_highlight(), 1.)
+		self.assertEqual(faces[2].get_highlight(), 0.)
+		self.assertEqual(highlights, [1., 1., 1.])
@@ -0,0 +1,49 @@
+import unittest
+
+import numpy as np
+
+import camera
+import mp
+import transform
+
+class TestTransformState(unittest.TestCase):
+	def setUp(self):
+		self.camera = camera.WanderingSphericalCamera([0, 0, 0], [0, 1, 0], lambda e: e, lambda e: 1., lambda e: 9.)
+		self.camera.update(.1)
+		self.transforms = transform.TransformState()
+
+	def test_versions_only_move_on_change(self):
+		self.transforms.set_camera(self.camera)
+		self.transforms.set_projection(1., 1.5, .1, 100.)
+		view_version, projection_version = self.transforms.view_version, self.transforms.projection_version
+
+		self.transforms.set_camera(self.camera)
+		self.transforms.set_projection(1., 1.5, .1, 100.)
+		self.assertEqual((self.transforms.view_version, self.transforms.projection_version), (view_version, projection_version))
+
+		self.camera.update(.1)
+		self.transforms.set_camera(self.camera)
+		self.transforms.set_projection(1., 2., .1, 100.)
+		self.assertEqual((self.transforms.view_version, self.transforms.projection_version), (view_version + 1, projection_version + 1))
+
+		np.testing.assert_allclose(self.transforms.view, mp.lookatM(self.camera.get_pos(), [0, 0, 0], [0, 1, 0]), atol=1e-6)
+		np.testing.assert_allclose(self.transforms.projection, mp.perspectiveM(1., 2., .1, 100.))
+
+	def test_camera_block_eyes(self):
+		self.transforms.set_camera(self.camera)
+		self.transforms.set_eye_separation(.5)
+		self.transforms.set_eyes([(transform.EYE_LEFT, transform.VIEWPORT_LEFT, transform.MASK_ALL), (transform.EYE_RIGHT, transform.VIEWPORT_RIGHT, transform.MASK_ALL)])
+
+		block, version = self.transforms.get_camera_block()
+		self.assertEqual(len(block), transform.CAMERA_BLOCK_FLOATS)
+		np.testing.assert_allclose(block[0:16], self.transforms.view.ravel())
+		self.assertEqual(block[35:36].view(np.int32)[0], 2)
+		np.testing.assert_allclose(block[36:44:4], [-.25, +.25])
+		np.testing.assert_allclose(block[44:52], transform.VIEWPORT_LEFT + transform.VIEWPORT_RIGHT)
+		self.assertEqual(self.transforms.get_camera_block()[1], version)
+
+		self.transforms.set_eyes([(transform.EYE_CENTER, transform.VIEWPORT_FULL, transform.MASK_ALL)])
+		block, new_version = self.transforms.get_camera_block()
+		self.assertNotEqual(new_version, version)
+		self.assertEqual(block[35:36].view(np.int32)[0], 1)
+		self.assertEqual(block[36], 0)
@@ -2,6 +2,8 @@ import numpy as np
 from OpenGL import GL
 from PIL import Image
 
+import gfx
+
 class Texture:
 	@classmethod
 	def create_with_image(cls, number, image_file, **kwargs):
@@ -9,13 +11,14 @@ class Texture:
 		tex.load_image(image_file)
 		return tex
 
-	def __init__(self, number, texture_type):
+	def __init__(self, number, texture_type, filtered=True):
 		self.number = number
 		self.type = texture_type
 		self.id = GL.glGenTextures(1)
-		with self:
-			GL.glTexParameteri(self.type, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR_MIPMAP_LINEAR)
-			GL.glTexParameteri(self.type, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
+		if filtered:
+			with self:
+				GL.glTexParameteri(self.type, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR_MIPMAP_LINEAR)
+				GL.glTexParameteri(self.type, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
 
 	def load_image(self, image_file):
 		with Image.open(image_file) as img:
@@ -27,8 +30,7 @@ class Texture:
 		raise NotImplementedError()
 
 	def activate(self):
-		GL.glActiveTexture(GL.GL_TEXTURE0 + self.number)
-		GL.glBindTexture(self.type, self.id)
+		gfx.state.bind_texture(self.number, self.type, self.id)
 
 	def _get_format_and_type(self, arr, bgr=False):
 		if arr.shape[2] == 3:
@@ -84,6 +86,70 @@ class Texture2D(Texture):
 			GL.glTexSubImage2D(self.type, 0, xoff, yoff, width, height, informat, intype, arr)
 			GL.glGenerateMipmap(self.type)
 
+class Texture2DArray(Texture):
+	# Layers of equally sized images, picked by index in the shader
+	def __init__(self, number):
+		super().__init__(number, GL.GL_TEXTURE_2D_ARRAY)
+		self.layers = 0
+
+	def load_images(self, image_files):
+		arrs = []
+		for image_file in image_files:
+			with Image.open(image_file) as img:
+				arrs.append(np.asarray(img))
+
+		return self.load_arrays(arrs)
+
+	def load_arrays(self, arrs, bgr=False):
+		informat, intype = self._get_format_and_type(arrs[0], bgr=bgr)
+		height, width = arrs[0].shape[0:2]
+		arr = np.stack([np.flip(a, axis=0) for a in arrs])
+
+		with self:
+			GL.glTexImage3D(self.type, 0, GL.GL_RGBA, width, height, len(arrs), 0, informat, intype, arr)
+			GL.glGenerateMipmap(self.type)
+		self.layers = len(arrs)
+
+class TextureBuffer(Texture):
+	# Texels are the rows of a buffer, read in shaders with texelFetch. Rows are 4 floats by default.
+	def __init__(self, number, internal_format=GL.GL_RGBA32F):
+		super().__init__(number, GL.GL_TEXTURE_BUFFER, filtered=False)
+		self.internal_format = internal_format
+		self.buffer = gfx.VBO(buffer_type=GL.GL_TEXTURE_BUFFER, hint=GL.GL_STREAM_DRAW, dtype=np.float32)
+
+	def load_array(self, arr, bgr=False):
+		# Sets the size of the buffer; later updates can only overwrite it
+		with self.buffer:
+			self.buffer.set_data(arr)
+		with self:
+			GL.glTexBuffer(self.type, self.internal_format, self.buffer.id)
+
+	def update(self, arr, offset=0):
+		self.buffer.update(arr, offset * self.buffer.data.itemsize * self.buffer.data.shape[-1])
+
+class StreamTextureBuffer(Texture):
+	# A texture buffer rewritten every frame through a gfx.StreamBuffer, between begin() and end()
+	def __init__(self, number, rows, internal_format=GL.GL_RGBA32F, columns=4):
+		super().__init__(number, GL.GL_TEXTURE_BUFFER, filtered=False)
+		self.internal_format = internal_format
+		self.buffer = gfx.StreamBuffer(rows, columns, buffer_type=GL.GL_TEXTURE_BUFFER)
+		self._offset = None
+
+	def begin(self):
+		return self.buffer.begin()
+
+	def end(self):
+		self.buffer.end()
+		if self.buffer.offset == self._offset:
+			return
+
+		self._offset = self.buffer.offset
+		with self:
+			if self.buffer.persistent:
+				GL.glTexBufferRange(self.type, self.internal_format, self.buffer.id, self.buffer.offset, self.buffer.region_size)
+			else:
+				GL.glTexBuffer(self.type, self.internal_format, self.buffer.id)
+
 class CubeMap(Texture):
 	def __init__(self, number, inverted=True):
 		super().__init__(number, GL.GL_TEXTURE_CUBE_MAP)
@@ -0,0 +1,146 @@
+import numpy as np
+
+import mp
+
+EYE_CENTER = 0
+EYE_LEFT = -1
+EYE_RIGHT = +1
+
+# Where an eye's image goes, as the scale (xy) and offset (zw) of its normalized device coordinates
+VIEWPORT_FULL = (1, 1, 0, 0)
+VIEWPORT_LEFT = (.5, 1, -.5, 0)
+VIEWPORT_RIGHT = (.5, 1, +.5, 0)
+VIEWPORT_TOP = (1, .5, 0, +.5)
+VIEWPORT_BOTTOM = (1, .5, 0, -.5)
+
+# Which color channels an eye is drawn to
+MASK_ALL = (1, 1, 1)
+MASK_RED = (1, 0, 0)
+MASK_CYAN = (0, 1, 1)
+
+MAX_EYES = 2
+
+# Uniform block shared by every program that needs the camera. Matrices are row major so they can be uploaded straight
+# from NumPy; the block is laid out by std140 rules, which puts u_eyes in the padding after u_camPos. Every draw is
+# instanced once per eye, and the eye arrays say where each one is seen from and drawn to.
+CAMERA_BINDING = 0
+CAMERA_BLOCK = """
+layout(std140, row_major) uniform Camera {
+	mat4 u_view;
+	mat4 u_projection;
+	vec3 u_camPos;
+	int u_eyes;
+	vec4 u_eyeOffset[""" + str(MAX_EYES) + """];
+	vec4 u_eyeViewport[""" + str(MAX_EYES) + """];
+	vec4 u_eyeMask[""" + str(MAX_EYES) + """];
+};
+"""
+CAMERA_BLOCK_FLOATS = 16 + 16 + 4 + 3 * 4 * MAX_EYES
+
+# Vertex shader functions for drawing in stereo. eye_position() takes a view space position, moves it to where the
+# given eye sees it and squeezes it into the eye's viewport. The clip distances cut off what would spill into another
+# eye's viewport; they only need enabling when viewports are split.
+STEREO_VS = """
+out float gl_ClipDistance[4];
+flat out vec3 vf_eyeMask;
+
+int eye_index(int instance) {
+	return instance % u_eyes;
+}
+
+vec4 eye_position(vec4 viewPosition, int eye) {
+	vec4 p = u_projection * (viewPosition + vec4(u_eyeOffset[eye].x, 0, 0, 0));
+	gl_ClipDistance[0] = p.w - p.x;
+	gl_ClipDistance[1] = p.w + p.x;
+	gl_ClipDistance[2] = p.w - p.y;
+	gl_ClipDistance[3] = p.w + p.y;
+	vf_eyeMask = u_eyeMask[eye].rgb;
+
+	vec4 viewport = u_eyeViewport[eye];
+	return vec4(p.xy * viewport.xy + viewport.zw * p.w, p.zw);
+}
+"""
+STEREO_CLIP_DISTANCES = 4
+
+# Fragment shader output for drawing in stereo, with dual source blending: the second output is the blend factor of
+# each channel, which leaves the channels the eye doesn't draw to untouched
+STEREO_FS = """
+flat in vec3 vf_eyeMask;
+
+out vec4 fragColor;
+out vec4 fragBlend;
+
+void set_color(vec4 color) {
+	fragColor = color;
+	fragBlend = vec4(vf_eyeMask * color.a, color.a);
+}
+"""
+STEREO_OUTPUTS = ('fragColor', 'fragBlend')
+
+class TransformState:
+	# Camera and projection matrices and the stereo eyes, packed into the Camera block. Matrices are recomputed only when
+	# their inputs change, and come with a version that moves whenever their value does, so consumers can skip work for
+	# matrices they've already seen.
+	def __init__(self):
+		self.view = mp.identityM()
+		self.projection = mp.identityM()
+		self.camera_pos = np.zeros(3, dtype=mp.DTYPE)
+		self.view_version = 0
+		self.projection_version = 0
+
+		self._camera_version = None
+		self._projection_params = None
+		self._eye_separation = 0.
+		self._eye_separation_version = 0
+		self.eyes = ()
+		self._eyes_version = 0
+
+		self._camera_block = np.zeros(CAMERA_BLOCK_FLOATS, dtype=mp.DTYPE)
+		self._camera_block_key = None
+
+	def set_camera(self, camera):
+		if camera.version != self._camera_version:
+			self._camera_version = camera.version
+			self.view[:] = camera.get_view_matrix()
+			self.camera_pos[:] = camera.get_pos()
+			self.view_version += 1
+
+	def set_projection(self, fov_y, aspect, near, far):
+		params = (fov_y, aspect, near, far)
+		if params != self._projection_params:
+			self._projection_params = params
+			mp.perspectiveM(fov_y, aspect, near, far, out=self.projection)
+			self.projection_version += 1
+
+	def set_eye_separation(self, separation):
+		if separation != self._eye_separation:
+			self._eye_separation = separation
+			self._eye_separation_version += 1
+
+	def set_eyes(self, eyes):
+		# Takes (eye, viewport, mask) for each eye to draw
+		eyes = tuple(eyes)
+		if eyes != self.eyes:
+			if not 0 < len(eyes) <= MAX_EYES:
+				raise ValueError("Can't draw %d eyes" % (len(eyes),))
+			self.eyes = eyes
+			self._eyes_version += 1
+
+	def get_camera_block(self):
+		# Returns (data, version) of the Camera uniform block
+		key = (self.view_version, self.projection_version, self._eye_separation_version, self._eyes_version)
+		block = self._camera_block
+		if self._camera_block_key != key:
+			self._camera_block_key = key
+			block[0:16] = self.view.ravel()
+			block[16:32] = self.projection.ravel()
+			block[32:35] = self.camera_pos
+			block[35:36].view(np.int32)[0] = len(self.eyes)
+
+			offsets, viewports, masks = (block[36 + 4 * MAX_EYES * i:36 + 4 * MAX_EYES * (i + 1)].reshape(MAX_EYES, 4) for i in range(3))
+			for i, (eye, viewport, mask) in enumerate(self.eyes):
+				offsets[i, 0] = eye * self._eye_separation / 2
+				viewports[i] = viewport
+				masks[i, 0:3] = mask
+
+		return (block, key)